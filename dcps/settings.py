@@ -38,6 +38,7 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'studies.profiling.ProfilingMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'whitenoise.middleware.WhiteNoiseMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
@@ -87,6 +88,43 @@ if DEBUG and not os.getenv('DB_PASSWORD'):
         'NAME': BASE_DIR / 'db.sqlite3',
     }
 
+# Covering indexes (Index.include) are PostgreSQL-only; SQLite builds them as plain indexes
+SILENCED_SYSTEM_CHECKS = ['models.W040']
+
+# Cache
+# CACHE_BACKEND selects locmem (default, per process), file, redis or memcached.
+# A shared backend (file, redis, memcached) is required when running several
+# gunicorn workers: the data version lives in this cache, and with locmem a
+# bump after a write only invalidates the worker that made it.
+CACHE_BACKEND = os.getenv('CACHE_BACKEND', 'locmem')
+CACHE_BACKENDS = {
+    'locmem': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'dcps',
+    },
+    'file': {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': os.getenv('CACHE_LOCATION', '/var/tmp/dcps_cache'),
+    },
+    'redis': {
+        # Requires the redis package
+        'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+        'LOCATION': os.getenv('CACHE_LOCATION', 'redis://127.0.0.1:6379/1'),
+    },
+    'memcached': {
+        # Requires the pymemcache package
+        'BACKEND': 'django.core.cache.backends.memcached.PyMemcacheCache',
+        'LOCATION': os.getenv('CACHE_LOCATION', '127.0.0.1:11211'),
+    },
+}
+CACHES = {
+    'default': {
+        **CACHE_BACKENDS[CACHE_BACKEND],
+        'TIMEOUT': int(os.getenv('CACHE_TIMEOUT', 60 * 60 * 24)),
+        'KEY_PREFIX': 'dcps',
+    }
+}
+
 # Password validation
 AUTH_PASSWORD_VALIDATORS = [
     {
@@ -144,9 +182,29 @@ LOGGING = {
             'level': 'INFO',
             'propagate': True,
         },
+        'studies': {
+            'handlers': ['file'],
+            'level': 'INFO',
+            'propagate': True,
+        },
     },
 }
 
+# Request profiling (studies.profiling): Server-Timing headers on a sampled share of
+# requests, slow-request logging and per-view query budgets, which raise instead of
+# logging when enforced (the default under DEBUG, and so in tests)
+PROFILING_SAMPLE_RATE = float(os.getenv('PROFILING_SAMPLE_RATE', '1.0' if DEBUG else '0.05'))
+PROFILING_SLOW_REQUEST_MS = float(os.getenv('PROFILING_SLOW_REQUEST_MS', '500'))
+PROFILING_SERVER_TIMING = os.getenv('PROFILING_SERVER_TIMING', '1') == '1'
+PROFILING_ENFORCE_BUDGETS = os.getenv('PROFILING_ENFORCE_BUDGETS', '1' if DEBUG else '0') == '1'
+
+# Change feed (studies.changelog): entries younger than this are held back from
+# /api/v1/changes/ so a replica's cursor never passes a transaction still committing
+CHANGES_SETTLE_SECONDS = float(os.getenv('CHANGES_SETTLE_SECONDS', '5'))
+# Bearer token that lets a replica (manage.py sync_from --token) read the feed
+# without a staff session; empty disables token access
+CHANGES_FEED_TOKEN = os.getenv('CHANGES_FEED_TOKEN', '')
+
 # Production settings override
 if not DEBUG:
     DATABASES['default'] = {
@@ -1,6 +1,20 @@
-from django.contrib import admin
+from django import forms
+from django.contrib import admin, messages
+from django.core.exceptions import PermissionDenied
+from django.db.models import Count, IntegerField, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+from django.forms import modelformset_factory
+from django.http import HttpResponseRedirect
+from django.template.response import TemplateResponse
+from django.urls import path, reverse
 from django.utils.html import format_html
-from .models import DentalCariesStudy, CariesData, DataExtractionNote, ProjectMetadata
+from . import corrections, jobs
+from .pagination import EstimatedCountPaginator
+from .models import (
+    DentalCariesStudy, CariesData, DataExtractionNote, ProjectMetadata,
+    ModelFit, PosteriorSummary, ProjectionRun, Job, SensitivityRun, SensitivityResult,
+    Crosswalk, CrosswalkRule, ChangeLogEntry, SyncCursor,
+)
 
 
 @admin.register(DentalCariesStudy)
@@ -13,7 +27,8 @@ class DentalCariesStudyAdmin(admin.ModelAdmin):
         'age_group', 
         'sample_size',
         'caries_index_used',
-        'quality_score'
+        'quality_score',
+        'strata_count'
     ]
     list_filter = [
         'province', 
@@ -25,6 +40,12 @@ class DentalCariesStudyAdmin(admin.ModelAdmin):
     ]
     search_fields = ['title', 'authors', 'study_id', 'journal']
     readonly_fields = ['created_at', 'updated_at', 'extraction_date']
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+    actions = ['mark_verified', 'clear_verification', 'edit_in_grid']
+    
+    # Most studies the grid edit view takes at once
+    GRID_LIMIT = 1000
     
     fieldsets = (
         ('Study Identification', {
@@ -66,8 +87,67 @@ class DentalCariesStudyAdmin(admin.ModelAdmin):
         return obj.title
     title_truncated.short_description = 'Title'
     
+    def strata_count(self, obj):
+        return obj.strata_count
+    strata_count.short_description = 'Strata'
+    strata_count.admin_order_field = 'strata_count'
+    
     def get_queryset(self, request):
-        return super().get_queryset(request).prefetch_related('caries_data')
+        # Correlated subquery: only evaluated for the rows on the page, unlike a GROUP BY over the join
+        strata = CariesData.objects.filter(study=OuterRef('pk')).order_by().values('study').annotate(
+            n=Count('pk')
+        ).values('n')
+        return super().get_queryset(request).annotate(
+            strata_count=Coalesce(Subquery(strata, output_field=IntegerField()), 0)
+        )
+    
+    def mark_verified(self, request, queryset):
+        count = corrections.verify_studies(queryset, request.user.get_username())
+        self.message_user(request, f"Marked {count} stud{'y' if count == 1 else 'ies'} as verified")
+    mark_verified.short_description = "Mark selected studies verified by me today"
+    
+    def clear_verification(self, request, queryset):
+        count = corrections.clear_verification(queryset)
+        self.message_user(request, f"Cleared verification of {count} stud{'y' if count == 1 else 'ies'}")
+    clear_verification.short_description = "Clear verification of selected studies"
+    
+    def edit_in_grid(self, request, queryset):
+        pks = list(queryset.order_by().values_list('pk', flat=True)[:self.GRID_LIMIT + 1])
+        if len(pks) > self.GRID_LIMIT:
+            self.message_user(request, f"Select at most {self.GRID_LIMIT} studies to edit at once", messages.ERROR)
+            return None
+        url = reverse('admin:studies_dentalcariesstudy_grid')
+        return HttpResponseRedirect(f"{url}?ids={','.join(map(str, pks))}")
+    edit_in_grid.short_description = "Edit quality and verification of selected studies in a grid"
+    
+    def get_urls(self):
+        return [
+            path('grid/', self.admin_site.admin_view(self.grid_view), name='studies_dentalcariesstudy_grid'),
+        ] + super().get_urls()
+    
+    def grid_view(self, request):
+        """Spreadsheet-style formset over GRID_FIELDS; saving writes every changed row with one bulk_update"""
+        if not self.has_change_permission(request):
+            raise PermissionDenied
+        pks = [int(pk) for pk in request.GET.get('ids', '').split(',') if pk.isdigit()][:self.GRID_LIMIT]
+        queryset = DentalCariesStudy.objects.filter(pk__in=pks).only(
+            'pk', 'study_id', 'title', *corrections.GRID_FIELDS
+        ).order_by('study_id')
+        GridFormSet = modelformset_factory(DentalCariesStudy, fields=corrections.GRID_FIELDS, extra=0)
+        formset = GridFormSet(request.POST or None, queryset=queryset)
+        if request.method == 'POST' and formset.is_valid():
+            changed = [form for form in formset.forms if form.has_changed()]
+            fields = sorted({name for form in changed for name in form.changed_data})
+            count = corrections.update_studies([form.instance for form in changed], fields)
+            self.message_user(request, f"Updated {count} stud{'y' if count == 1 else 'ies'}")
+            return HttpResponseRedirect(reverse('admin:studies_dentalcariesstudy_changelist'))
+        context = {
+            **self.admin_site.each_context(request),
+            'opts': self.model._meta,
+            'title': f"Edit {len(pks)} studies",
+            'formset': formset,
+        }
+        return TemplateResponse(request, 'admin/studies/dentalcariesstudy/grid.html', context)
 
 
 class CariesDataInline(admin.TabularInline):
@@ -96,6 +176,23 @@ class DataExtractionNoteInline(admin.TabularInline):
 DentalCariesStudyAdmin.inlines = [CariesDataInline, DataExtractionNoteInline]
 
 
+class CorrectionsForm(forms.Form):
+    file = forms.FileField(required=False, help_text="CSV with a stratum_id column, e.g. an edited export_strata file")
+    csv_text = forms.CharField(required=False, widget=forms.HiddenInput)
+    
+    def clean(self):
+        cleaned = super().clean()
+        upload = cleaned.get('file')
+        if upload is not None:
+            try:
+                cleaned['csv_text'] = upload.read().decode('utf-8-sig')
+            except UnicodeDecodeError:
+                raise forms.ValidationError("The CSV must be UTF-8 encoded")
+        if not cleaned.get('csv_text'):
+            raise forms.ValidationError("Choose a CSV file")
+        return cleaned
+
+
 @admin.register(CariesData)
 class CariesDataAdmin(admin.ModelAdmin):
     list_display = [
@@ -107,23 +204,67 @@ class CariesDataAdmin(admin.ModelAdmin):
         'mean_dmft_DMFT'
     ]
     list_filter = ['sex', 'age_category', 'socioeconomic_status', 'study__province']
+    list_select_related = ['study']
     search_fields = ['study__title', 'study__study_id']
+    autocomplete_fields = ['study']
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
     
     def study_title_short(self, obj):
         return f"{obj.study.title[:40]}..." if len(obj.study.title) > 40 else obj.study.title
     study_title_short.short_description = 'Study'
+    study_title_short.admin_order_field = 'study__title'
+    
+    def get_urls(self):
+        return [
+            path(
+                'corrections/', self.admin_site.admin_view(self.corrections_view),
+                name='studies_cariesdata_corrections'
+            ),
+        ] + super().get_urls()
+    
+    def corrections_view(self, request):
+        """Upload a corrections CSV, preview the changed fields, then apply them in one transaction"""
+        if not self.has_change_permission(request):
+            raise PermissionDenied
+        form = CorrectionsForm(request.POST or None, request.FILES or None)
+        changes = None
+        if request.method == 'POST' and form.is_valid():
+            apply = 'apply' in request.POST
+            try:
+                changes = corrections.apply_csv(form.cleaned_data['csv_text'], dry_run=not apply)
+            except ValueError as exc:
+                form.add_error(None, str(exc))
+            else:
+                if apply:
+                    self.message_user(request, f"Corrected {len(changes)} strata")
+                    return HttpResponseRedirect(reverse('admin:studies_cariesdata_changelist'))
+                form = CorrectionsForm(initial={'csv_text': form.cleaned_data['csv_text']})
+        context = {
+            **self.admin_site.each_context(request),
+            'opts': self.model._meta,
+            'title': "Upload stratum corrections",
+            'form': form,
+            'changes': changes,
+        }
+        return TemplateResponse(request, 'admin/studies/cariesdata/corrections.html', context)
 
 
 @admin.register(DataExtractionNote)
 class DataExtractionNoteAdmin(admin.ModelAdmin):
     list_display = ['study_title_short', 'note_type', 'note_preview', 'created_by', 'created_at']
     list_filter = ['note_type', 'created_by', 'created_at']
+    list_select_related = ['study']
     search_fields = ['study__title', 'note_text']
     readonly_fields = ['created_at']
+    autocomplete_fields = ['study']
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
     
     def study_title_short(self, obj):
         return f"{obj.study.title[:30]}..." if len(obj.study.title) > 30 else obj.study.title
     study_title_short.short_description = 'Study'
+    study_title_short.admin_order_field = 'study__title'
     
     def note_preview(self, obj):
         return f"{obj.note_text[:50]}..." if len(obj.note_text) > 50 else obj.note_text
@@ -148,4 +289,137 @@ class ProjectMetadataAdmin(admin.ModelAdmin):
         ('Data Analysis', {
             'fields': ('analysis_software', 'bayesian_model_version')
         })
-    ) 
\ No newline at end of file
+    ) 
+
+
+class PosteriorSummaryInline(admin.TabularInline):
+    model = PosteriorSummary
+    extra = 0
+    fields = ['component', 'label', 'mean', 'sd', 'q025', 'q50', 'q975']
+    readonly_fields = fields
+    can_delete = False
+
+
+@admin.register(ModelFit)
+class ModelFitAdmin(admin.ModelAdmin):
+    list_display = ['version', 'name', 'status', 'n_strata', 'dic', 'waic', 'created_at', 'finished_at']
+    list_filter = ['status', 'name']
+    readonly_fields = [
+        'status', 'data_hash', 'n_strata', 'log_marginal_likelihood', 'dic', 'p_dic', 'waic', 'p_waic',
+        'hyperparameters', 'message', 'created_at', 'started_at', 'finished_at'
+    ]
+    exclude = ['draws']
+    inlines = [PosteriorSummaryInline]
+
+
+@admin.register(ProjectionRun)
+class ProjectionRunAdmin(admin.ModelAdmin):
+    list_display = ['fit', 'scenario', 'horizon', 'trajectories', 'updated_at']
+    list_filter = ['scenario']
+    list_select_related = ['fit']
+    readonly_fields = ['fit', 'scenario', 'parameters', 'horizon', 'trajectories', 'created_at', 'updated_at']
+
+
+@admin.register(Job)
+class JobAdmin(admin.ModelAdmin):
+    list_display = ['id', 'task', 'status', 'progress_percent', 'progress_message', 'attempts', 'created_by', 'created_at']
+    list_filter = ['status', 'task']
+    search_fields = ['task', 'input_hash', 'created_by']
+    readonly_fields = [
+        'input_hash', 'status', 'progress', 'progress_message', 'result', 'error', 'attempts', 'worker',
+        'cancel_requested', 'created_at', 'started_at', 'heartbeat_at', 'finished_at'
+    ]
+    actions = ['cancel_jobs', 'retry_jobs']
+    
+    def progress_percent(self, obj):
+        return f"{obj.progress:.0%}"
+    progress_percent.short_description = 'Progress'
+    
+    def cancel_jobs(self, request, queryset):
+        for job in queryset.filter(status__in=['queued', 'running']):
+            jobs.cancel(job)
+        self.message_user(request, "Cancellation requested")
+    cancel_jobs.short_description = "Cancel selected jobs"
+    
+    def retry_jobs(self, request, queryset):
+        count = sum(jobs.retry(job) for job in queryset)
+        self.message_user(request, f"Requeued {count} job(s)")
+    retry_jobs.short_description = "Retry failed or cancelled jobs"
+    
+    def save_model(self, request, obj, form, change):
+        if not change:
+            obj.input_hash = jobs.input_hash(obj.task, obj.params) if obj.task in jobs.TASKS else ''
+            obj.created_by = request.user.get_username()
+        super().save_model(request, obj, form, change)
+
+
+class SensitivityResultInline(admin.TabularInline):
+    model = SensitivityResult
+    extra = 0
+    fields = ['label', 'status', 'dic', 'delta_dic', 'waic', 'delta_waic', 'converged', 'elapsed', 'error']
+    readonly_fields = fields
+    can_delete = False
+
+
+@admin.register(SensitivityRun)
+class SensitivityRunAdmin(admin.ModelAdmin):
+    list_display = ['name', 'status', 'n_specs', 'processes', 'elapsed', 'created_at']
+    list_filter = ['status', 'name']
+    readonly_fields = ['grid', 'status', 'n_specs', 'processes', 'elapsed', 'message', 'created_at', 'finished_at']
+    inlines = [SensitivityResultInline]
+
+
+class CrosswalkRuleInline(admin.TabularInline):
+    model = CrosswalkRule
+    extra = 1
+    fields = [
+        'outcome', 'source_index', 'source_criteria', 'target_index',
+        'intercept', 'slope', 'intercept_se', 'slope_se', 'covariance', 'residual_sd'
+    ]
+
+
+@admin.register(Crosswalk)
+class CrosswalkAdmin(admin.ModelAdmin):
+    list_display = ['version', 'name', 'is_active', 'rule_count', 'created_at']
+    list_filter = ['is_active']
+    search_fields = ['name', 'source']
+    readonly_fields = ['created_at', 'updated_at']
+    inlines = [CrosswalkRuleInline]
+    
+    def rule_count(self, obj):
+        return obj.rule_count
+    rule_count.short_description = 'Rules'
+    rule_count.admin_order_field = 'rule_count'
+    
+    def get_queryset(self, request):
+        return super().get_queryset(request).annotate(rule_count=Count('rules'))
+
+
+@admin.register(ChangeLogEntry)
+class ChangeLogEntryAdmin(admin.ModelAdmin):
+    list_display = ['id', 'action', 'model', 'object_id', 'changed_fields', 'created_at']
+    list_filter = ['action', 'model']
+    search_fields = ['=object_id']
+    readonly_fields = ['model', 'object_id', 'action', 'data', 'previous', 'created_at']
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+    
+    def changed_fields(self, obj):
+        return ', '.join(obj.data) if obj.action == 'update' else ''
+    changed_fields.short_description = 'Fields'
+    
+    # The log is append-only
+    def has_add_permission(self, request):
+        return False
+    
+    def has_change_permission(self, request, obj=None):
+        return False
+    
+    def has_delete_permission(self, request, obj=None):
+        return False
+
+
+@admin.register(SyncCursor)
+class SyncCursorAdmin(admin.ModelAdmin):
+    list_display = ['source', 'cursor', 'entries_applied', 'updated_at']
+    readonly_fields = ['updated_at']
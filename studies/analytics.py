@@ -0,0 +1,298 @@
+"""In-process columnar cache of studies and caries strata for vectorized analytics
+
+Each worker holds one copy of the study and stratum tables as NumPy arrays,
+with categorical columns stored as integer codes. Reads compare the cached
+data version (bumped by studies.signals on every committed write) with the
+version the arrays were built at; when it has moved, only rows whose
+``updated_at`` is newer than the last load are fetched and spliced in.
+Deletes leave no stamp, so after a splice each table's length is checked
+against a row count in the database and a table that disagrees is reloaded
+in full. Repeated reads at an unchanged version touch only
+the cache, never the database.
+
+``updated_at`` is stamped when a row is saved, not when its transaction
+commits, so a row can turn up with a stamp older than the last load. Each
+delta therefore reaches back REFRESH_OVERLAP before the last high-water
+mark; rows fetched twice are spliced in idempotently. An insert from a
+transaction that stays open longer than that shows up in the row count
+check; an update from one is only picked up by a full reload (``reset()``).
+"""
+import datetime
+import threading
+
+import numpy as np
+from django.db.models import Max, Q
+from django.db.models.functions import ExtractYear
+
+from . import caching
+from .models import DentalCariesStudy, CariesData
+
+
+CHUNK_SIZE = 2000
+# How far before the last high-water mark a delta refresh reaches back, for late commits
+REFRESH_OVERLAP = datetime.timedelta(minutes=10)
+
+# (column, ORM path or annotation, kind) where kind is 'category', 'int' or 'float'
+STUDY_COLUMNS = [
+    ('id', 'id', 'int'),
+    ('study_id', 'study_id', 'category'),
+    ('province', 'province', 'category'),
+    ('age_group', 'age_group', 'category'),
+    ('caries_index_used', 'caries_index_used', 'category'),
+    ('publication_year', 'publication_year', 'int'),
+    ('collection_year', 'collection_year', 'int'),
+    ('sample_size', 'sample_size', 'int'),
+]
+
+STRATUM_COLUMNS = [
+    ('id', 'id', 'int'),
+    ('study', 'study_id', 'int'),
+    ('study_id', 'study__study_id', 'category'),
+    ('province', 'study__province', 'category'),
+    ('age_group', 'study__age_group', 'category'),
+    ('caries_index_used', 'study__caries_index_used', 'category'),
+    ('examination_criteria', 'study__examination_criteria', 'category'),
+    ('publication_year', 'study__publication_year', 'int'),
+    ('collection_year', 'collection_year', 'int'),
+    ('age_min', 'study__age_min', 'float'),
+    ('age_max', 'study__age_max', 'float'),
+    ('sex', 'sex', 'category'),
+    ('age_category', 'age_category', 'category'),
+    ('socioeconomic_status', 'socioeconomic_status', 'category'),
+    ('sample_size_group', 'sample_size_group', 'int'),
+    ('caries_prevalence', 'caries_prevalence', 'float'),
+    ('caries_prevalence_ci_lower', 'caries_prevalence_ci_lower', 'float'),
+    ('caries_prevalence_ci_upper', 'caries_prevalence_ci_upper', 'float'),
+    ('mean_dmft_DMFT', 'mean_dmft_DMFT', 'float'),
+    ('mean_dmft_DMFT_sd', 'mean_dmft_DMFT_sd', 'float'),
+    ('mean_decayed', 'mean_decayed', 'float'),
+    ('mean_missing', 'mean_missing', 'float'),
+    ('mean_filled', 'mean_filled', 'float'),
+    ('care_index', 'care_index', 'float'),
+]
+
+
+class Table:
+    """Columnar table sorted by primary key; categorical columns hold int32 codes"""
+
+    def __init__(self, spec):
+        self.spec = spec
+        self.labels = {name: [] for name, _, kind in spec if kind == 'category'}
+        self._codes = {name: {} for name in self.labels}
+        self.columns = self._empty()
+
+    def _empty(self):
+        return {name: np.empty(0, dtype=self._dtype(kind)) for name, _, kind in self.spec}
+
+    @staticmethod
+    def _dtype(kind):
+        return {'category': np.int32, 'int': np.int64, 'float': np.float64}[kind]
+
+    def __len__(self):
+        return len(self.columns['id'])
+
+    def _encode(self, name, values):
+        codes, labels = self._codes[name], self.labels[name]
+        out = np.empty(len(values), dtype=np.int32)
+        for i, value in enumerate(values):
+            code = codes.get(value)
+            if code is None:
+                code = codes[value] = len(labels)
+                labels.append(value)
+            out[i] = code
+        return out
+
+    def _build(self, rows):
+        if not rows:
+            return self._empty()
+        columns = {}
+        for (name, _, kind), values in zip(self.spec, zip(*rows)):
+            if kind == 'category':
+                columns[name] = self._encode(name, values)
+            else:
+                columns[name] = np.array(values, dtype=self._dtype(kind))
+        return columns
+
+    def load(self, rows):
+        self.columns = self._build(rows)
+        self._sort()
+
+    def splice(self, rows):
+        """Replace rows with the same id as ``rows`` and add new ones"""
+        new = self._build(rows)
+        keep = ~np.isin(self.columns['id'], new['id'])
+        self.columns = {
+            name: np.concatenate([column[keep], new[name]]) for name, column in self.columns.items()
+        }
+        self._sort()
+
+    def _sort(self):
+        order = np.argsort(self.columns['id'], kind='stable')
+        self.columns = {name: column[order] for name, column in self.columns.items()}
+
+    def decode(self, name, codes):
+        if name not in self.labels:
+            return codes.tolist()
+        labels = self.labels[name]
+        return [labels[code] for code in codes]
+
+    def group_by(self, *keys, mask=None):
+        return GroupBy(self, keys, mask)
+
+
+class GroupBy:
+    """Vectorized group-by over a Table
+
+    ``keys`` are column names, ``(alias, column name)`` pairs, or
+    ``(name, array)`` pairs for derived keys such as a period bucket.
+    Aggregates come back as arrays aligned with ``self.keys``; means are NaN
+    for groups with no non-null values.
+    """
+
+    def __init__(self, table, keys, mask=None):
+        self.table = table
+        self.mask = np.ones(len(table), dtype=bool) if mask is None else mask
+        self.names, sources, arrays = [], [], []
+        for key in keys:
+            name, source = key if isinstance(key, tuple) else (key, key)
+            array = table.columns[source] if isinstance(source, str) else np.asarray(source)
+            self.names.append(name)
+            sources.append(source if isinstance(source, str) else None)
+            arrays.append(array[self.mask].astype(np.int64))
+        if len(arrays) == 1:
+            unique, inverse = np.unique(arrays[0], return_inverse=True)
+            unique = unique[:, None]
+        else:
+            unique, inverse = np.unique(np.stack(arrays, axis=1), axis=0, return_inverse=True)
+        self.inverse = inverse.reshape(-1)
+        self.size = len(unique)
+        self.keys = [
+            table.decode(source, unique[:, i]) if source else unique[:, i].tolist()
+            for i, source in enumerate(sources)
+        ]
+
+    def values(self, column):
+        return self.table.columns[column][self.mask]
+
+    def count(self, column=None):
+        """Rows per group, or non-null values of ``column`` per group"""
+        if column is None:
+            return np.bincount(self.inverse, minlength=self.size)
+        valid = ~np.isnan(self.values(column))
+        return np.bincount(self.inverse, weights=valid, minlength=self.size).astype(np.int64)
+
+    def sum(self, column, weights=None):
+        values = self.values(column).astype(np.float64)
+        if weights is not None:
+            values = values * weights[self.mask]
+        return np.bincount(self.inverse, weights=np.nan_to_num(values), minlength=self.size)
+
+    def mean(self, column, weights=None):
+        values = self.values(column).astype(np.float64)
+        w = np.ones(len(values)) if weights is None else weights[self.mask].astype(np.float64)
+        valid = ~np.isnan(values) & ~np.isnan(w)
+        total = np.bincount(self.inverse, weights=np.where(valid, values * w, 0.0), minlength=self.size)
+        weight = np.bincount(self.inverse, weights=np.where(valid, w, 0.0), minlength=self.size)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            return np.where(weight > 0, total / weight, np.nan)
+
+    def nunique(self, column):
+        pairs = np.unique(np.stack([self.inverse, self.values(column)], axis=1), axis=0)
+        return np.bincount(pairs[:, 0], minlength=self.size)
+
+    def align(self, values, keys):
+        """``values`` (one per group of a single-key group-by) re-ordered to ``keys``; NaN where absent"""
+        lookup = dict(zip(self.keys[0], values))
+        return np.array([lookup.get(key, np.nan) for key in keys], dtype=np.float64)
+
+    def rows(self, **measures):
+        """List of dicts (key names plus measures) with NaN rendered as None, like SQL NULL"""
+        result = []
+        for i in range(self.size):
+            row = {name: keys[i] for name, keys in zip(self.names, self.keys)}
+            for name, values in measures.items():
+                value = values[i].item() if hasattr(values[i], 'item') else values[i]
+                row[name] = None if isinstance(value, float) and np.isnan(value) else value
+            result.append(row)
+        return result
+
+
+class StrataFrame:
+    """Studies and strata tables plus the bookkeeping for incremental refresh"""
+
+    def __init__(self):
+        self.studies = Table(STUDY_COLUMNS)
+        self.strata = Table(STRATUM_COLUMNS)
+        self.version = None
+        self.loaded_until = None
+
+    @staticmethod
+    def _rows(model, spec, condition=None):
+        prefix = 'study__' if model is CariesData else ''
+        queryset = model.objects.annotate(collection_year=ExtractYear(f'{prefix}data_collection_start'))
+        if condition is not None:
+            queryset = queryset.filter(condition)
+        paths = [path for _, path, _ in spec]
+        return list(queryset.values_list(*paths).order_by('id').iterator(chunk_size=CHUNK_SIZE))
+
+    @staticmethod
+    def _high_water():
+        marks = [
+            model.objects.aggregate(last=Max('updated_at'))['last']
+            for model in (DentalCariesStudy, CariesData)
+        ]
+        marks = [mark for mark in marks if mark is not None]
+        return max(marks) if marks else None
+
+    def refresh(self, version):
+        """Bring the arrays up to date; a full load the first time, deltas afterwards"""
+        high_water = self._high_water()
+        if self.loaded_until is None:
+            self.studies.load(self._rows(DentalCariesStudy, STUDY_COLUMNS))
+            self.strata.load(self._rows(CariesData, STRATUM_COLUMNS))
+        else:
+            # Strata are denormalised with their study's fields, so a changed
+            # study pulls in all of its strata as well
+            since = Q(updated_at__gte=self.loaded_until - REFRESH_OVERLAP)
+            studies = self._rows(DentalCariesStudy, STUDY_COLUMNS, since)
+            changed = [row[0] for row in studies]
+            strata = self._rows(CariesData, STRATUM_COLUMNS, since | Q(study_id__in=changed))
+            self.studies.splice(studies)
+            self.strata.splice(strata)
+            # Deletes (or inserts older than the overlap) leave the counts apart
+            if len(self.studies) != DentalCariesStudy.objects.count():
+                self.studies.load(self._rows(DentalCariesStudy, STUDY_COLUMNS))
+            if len(self.strata) != CariesData.objects.count():
+                self.strata.load(self._rows(CariesData, STRATUM_COLUMNS))
+        self.loaded_until = high_water
+        self.version = version
+
+
+_frame = StrataFrame()
+_lock = threading.Lock()
+
+
+def frame(harmonize=None):
+    """The up-to-date StrataFrame for this process
+
+    With ``harmonize`` (a caries index code), a read-only view with the
+    strata converted to that index by the active crosswalk (see
+    studies.crosswalks); raises ValueError if that is not possible.
+    """
+    version = caching.data_version()
+    if _frame.version != version:
+        with _lock:
+            if _frame.version != version:
+                _frame.refresh(version)
+    if harmonize:
+        from . import crosswalks
+
+        return crosswalks.harmonize(_frame, harmonize)
+    return _frame
+
+
+def reset():
+    """Drop the cached arrays; the next frame() call reloads everything"""
+    global _frame
+    with _lock:
+        _frame = StrataFrame()
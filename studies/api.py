@@ -0,0 +1,308 @@
+"""Read-only versioned JSON API (/api/v1/) for studies and caries strata
+
+List endpoints take the same filters as StudyListView, ``?fields=`` for sparse
+fieldsets, ``?updated_since=`` for deltas and keyset pagination through
+``?cursor=``/``?limit=``. Every response carries a strong ETag and a
+Last-Modified header derived from ``updated_at``, and conditional requests
+are answered with 304 before any rows are fetched. The strata export streams
+the full joined table as CSV, Parquet or Arrow. The change feed lists inserts,
+updates and deletes after a cursor, for replicas (see studies.changelog).
+It carries whole rows, including the reviewer fields the list endpoints
+leave out, so it is served to staff sessions and to requests with the
+CHANGES_FEED_TOKEN bearer token only.
+"""
+import hashlib
+import hmac
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.db.models import Count, Max
+from django.http import JsonResponse, StreamingHttpResponse
+from django.utils.cache import get_conditional_response
+from django.utils.dateparse import parse_datetime
+from django.utils.http import http_date, quote_etag
+from django.views.generic import View
+
+from . import changelog, export
+from .filters import study_filters, study_ordering
+from .models import DentalCariesStudy, CariesData
+from .pagination import keyset_paginate
+
+
+DEFAULT_LIMIT = 50
+MAX_LIMIT = 500
+
+STUDY_FIELDS = {
+    'study_id': 'study_id',
+    'title': 'title',
+    'authors': 'authors',
+    'journal': 'journal',
+    'publication_year': 'publication_year',
+    'doi': 'doi',
+    'pubmed_id': 'pubmed_id',
+    'study_design': 'study_design',
+    'study_setting': 'study_setting',
+    'province': 'province',
+    'city_region': 'city_region',
+    'sample_size': 'sample_size',
+    'age_group': 'age_group',
+    'age_min': 'age_min',
+    'age_max': 'age_max',
+    'data_collection_start': 'data_collection_start',
+    'data_collection_end': 'data_collection_end',
+    'caries_index_used': 'caries_index_used',
+    'examination_criteria': 'examination_criteria',
+    'quality_score': 'quality_score',
+    'risk_of_bias': 'risk_of_bias',
+    'notes': 'notes',
+    'created_at': 'created_at',
+    'updated_at': 'updated_at',
+}
+
+STRATUM_FIELDS = {
+    'id': 'id',
+    'study_id': 'study__study_id',
+    'sex': 'sex',
+    'age_category': 'age_category',
+    'socioeconomic_status': 'socioeconomic_status',
+    'sample_size_group': 'sample_size_group',
+    'caries_prevalence': 'caries_prevalence',
+    'caries_prevalence_ci_lower': 'caries_prevalence_ci_lower',
+    'caries_prevalence_ci_upper': 'caries_prevalence_ci_upper',
+    'mean_dmft_DMFT': 'mean_dmft_DMFT',
+    'mean_dmft_DMFT_sd': 'mean_dmft_DMFT_sd',
+    'mean_decayed': 'mean_decayed',
+    'mean_missing': 'mean_missing',
+    'mean_filled': 'mean_filled',
+    'care_index': 'care_index',
+    'created_at': 'created_at',
+    'updated_at': 'updated_at',
+}
+
+
+class InvalidParameter(ValueError):
+    """Raised for malformed API parameters; rendered as a 400 JSON error"""
+
+
+def checked_study_filters(params):
+    """study_filters(), raising InvalidParameter for a malformed value"""
+    try:
+        return study_filters(params)
+    except ValueError as exc:
+        raise InvalidParameter(str(exc)) from exc
+
+
+def stratum_filters(params):
+    """ORM filter kwargs for strata: study filters on the parent plus study/sex/age_category"""
+    filters = {f'study__{lookup}': value for lookup, value in checked_study_filters(params).items()}
+    for name, lookup in [('study', 'study__study_id'), ('sex', 'sex'), ('age_category', 'age_category')]:
+        value = params.get(name)
+        if value:
+            filters[lookup] = value
+    return filters
+
+
+class ReadOnlyAPIView(View):
+    """Shared machinery: field selection, conditional GET and JSON rendering"""
+    model = None
+    fields = {}
+
+    def get_queryset(self):
+        return self.model.objects.all()
+
+    def selected_fields(self):
+        requested = self.request.GET.get('fields')
+        if not requested:
+            return list(self.fields)
+        names = [name.strip() for name in requested.split(',') if name.strip()]
+        unknown = [name for name in names if name not in self.fields]
+        if unknown:
+            raise InvalidParameter(f"Unknown fields: {', '.join(unknown)}")
+        return names
+
+    def fetch(self, queryset, names):
+        """Return the response payload for the selected output field names"""
+        values, paths = self.rows(queryset, names)
+        return {'results': [self.render(row, paths) for row in values]}
+
+    def get(self, request, *args, **kwargs):
+        try:
+            names = self.selected_fields()
+            queryset = self.get_queryset()
+        except InvalidParameter as exc:
+            return JsonResponse({'error': str(exc)}, status=400)
+
+        # One aggregate query decides whether the client's copy is current
+        state = queryset.order_by().aggregate(last_modified=Max('updated_at'), count=Count('id'))
+        params = sorted((key, value) for key, values in request.GET.lists() for value in values)
+        fingerprint = f"{request.path}|{params}|{state['count']}|{state['last_modified']}"
+        etag = quote_etag(hashlib.sha256(fingerprint.encode()).hexdigest())
+        last_modified = int(state['last_modified'].timestamp()) if state['last_modified'] else None
+
+        response = get_conditional_response(request, etag=etag, last_modified=last_modified)
+        if response is None:
+            try:
+                response = JsonResponse(self.fetch(queryset, names))
+            except InvalidParameter as exc:
+                return JsonResponse({'error': str(exc)}, status=400)
+        response['ETag'] = etag
+        if last_modified is not None:
+            response['Last-Modified'] = http_date(last_modified)
+        return response
+
+    def rows(self, queryset, names, extra=()):
+        """values() rows with output names; ``extra`` paths are fetched but not returned"""
+        paths = {name: self.fields[name] for name in names}
+        fetch = list(dict.fromkeys([*paths.values(), *extra]))
+        return queryset.values(*fetch), paths
+
+    @staticmethod
+    def render(row, paths):
+        return {name: row[path] for name, path in paths.items()}
+
+
+class ListAPIView(ReadOnlyAPIView):
+    """List endpoint with keyset pagination and ?updated_since= deltas"""
+
+    def get_ordering(self):
+        return 'id'
+
+    def filter_updated_since(self, queryset):
+        since = self.request.GET.get('updated_since')
+        if not since:
+            return queryset
+        parsed = parse_datetime(since)
+        if parsed is None:
+            raise InvalidParameter("updated_since must be an ISO 8601 datetime")
+        return queryset.filter(updated_at__gte=parsed)
+
+    def fetch(self, queryset, names):
+        try:
+            limit = min(int(self.request.GET.get('limit', DEFAULT_LIMIT)), MAX_LIMIT)
+        except ValueError:
+            raise InvalidParameter("limit must be an integer")
+        if limit < 1:
+            raise InvalidParameter("limit must be positive")
+
+        ordering = self.get_ordering()
+        values, paths = self.rows(queryset, names, extra=(ordering.lstrip('-'), 'id'))
+        try:
+            page = keyset_paginate(values, ordering, limit, self.request.GET.get('cursor'))
+        except ValueError:
+            raise InvalidParameter("Invalid cursor")
+
+        next_url = None
+        if page.next_cursor:
+            query = self.request.GET.copy()
+            query['cursor'] = page.next_cursor
+            next_url = self.request.build_absolute_uri(f"{self.request.path}?{query.urlencode()}")
+        return {
+            'results': [self.render(row, paths) for row in page],
+            'next_cursor': page.next_cursor,
+            'next': next_url,
+        }
+
+
+class StudyListAPI(ListAPIView):
+    """GET /api/v1/studies/"""
+    model = DentalCariesStudy
+    fields = STUDY_FIELDS
+
+    def get_queryset(self):
+        queryset = super().get_queryset().filter(**checked_study_filters(self.request.GET))
+        return self.filter_updated_since(queryset)
+
+    def get_ordering(self):
+        return study_ordering(self.request.GET.get('sort'))
+
+
+class StudyDetailAPI(ReadOnlyAPIView):
+    """GET /api/v1/studies/<study_id>/"""
+    model = DentalCariesStudy
+    fields = STUDY_FIELDS
+
+    def get(self, request, *args, **kwargs):
+        if not self.get_queryset().exists():
+            return JsonResponse({'error': "Study not found"}, status=404)
+        return super().get(request, *args, **kwargs)
+
+    def get_queryset(self):
+        return super().get_queryset().filter(study_id=self.kwargs['study_id'])
+
+    def fetch(self, queryset, names):
+        values, paths = self.rows(queryset, names)
+        return self.render(values.get(), paths)
+
+
+class StratumListAPI(ListAPIView):
+    """GET /api/v1/strata/ (study filters apply to the parent study)"""
+    model = CariesData
+    fields = STRATUM_FIELDS
+
+    def get_queryset(self):
+        return self.filter_updated_since(super().get_queryset().filter(**stratum_filters(self.request.GET)))
+
+
+class StratumExportAPI(View):
+    """GET /api/v1/strata/export/?format=csv|parquet|arrow (streamed; same filters as strata)"""
+
+    def get(self, request, *args, **kwargs):
+        fmt = request.GET.get('format', 'csv')
+        if fmt not in export.EXPORT_FORMATS:
+            return JsonResponse(
+                {'error': f"format must be one of {', '.join(export.EXPORT_FORMATS)}"}, status=400
+            )
+        try:
+            chunks = export.iter_export(fmt, CariesData.objects.filter(**stratum_filters(request.GET)))
+        except InvalidParameter as exc:
+            return JsonResponse({'error': str(exc)}, status=400)
+        except ImproperlyConfigured as exc:
+            return JsonResponse({'error': str(exc)}, status=501)
+        content_type, extension = export.EXPORT_FORMATS[fmt]
+        response = StreamingHttpResponse(chunks, content_type=content_type)
+        response['Content-Disposition'] = f'attachment; filename="dcps_strata.{extension}"'
+        return response
+
+
+class ChangeFeedAPI(View):
+    """GET /api/v1/changes/?since=<cursor>&limit= (change log entries in commit order)"""
+
+    @staticmethod
+    def authorized(request):
+        """A staff session, or ``Authorization: Bearer <CHANGES_FEED_TOKEN>`` when a token is configured"""
+        if request.user.is_staff:
+            return True
+        token = getattr(settings, 'CHANGES_FEED_TOKEN', '')
+        scheme, _, given = request.headers.get('Authorization', '').partition(' ')
+        return bool(token) and scheme.lower() == 'bearer' and hmac.compare_digest(given.strip(), token)
+
+    def get(self, request, *args, **kwargs):
+        if not self.authorized(request):
+            return JsonResponse({'error': "The change feed requires staff access or the feed token"}, status=403)
+        try:
+            since = int(request.GET.get('since', 0))
+            limit = min(int(request.GET.get('limit', changelog.DEFAULT_LIMIT)), changelog.MAX_LIMIT)
+        except ValueError:
+            return JsonResponse({'error': "since and limit must be integers"}, status=400)
+        if not 0 <= since <= changelog.MAX_CURSOR or limit < 1:
+            return JsonResponse(
+                {'error': f"since must be between 0 and {changelog.MAX_CURSOR} and limit must be positive"},
+                status=400,
+            )
+        entries, has_more = changelog.feed(since, limit)
+        return JsonResponse({
+            'results': [
+                {
+                    'cursor': entry['id'],
+                    'model': entry['model'],
+                    'object_id': entry['object_id'],
+                    'action': entry['action'],
+                    'data': entry['data'],
+                    'previous': entry['previous'],
+                    'created_at': entry['created_at'],
+                }
+                for entry in entries
+            ],
+            'next_cursor': entries[-1]['id'] if entries else since,
+            'has_more': has_more,
+        })
@@ -4,4 +4,10 @@ from django.apps import AppConfig
 class StudiesConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'studies'
-    verbose_name = 'Dental Caries Studies' 
\ No newline at end of file
+    verbose_name = 'Dental Caries Studies'
+    
+    def ready(self):
+        from django.db.models.signals import post_migrate
+        from . import signals
+        
+        post_migrate.connect(signals.build_search_index, sender=self)
@@ -0,0 +1,682 @@
+"""In-app Bayesian hierarchical model for mean dmft/DMFT (BYM2 + RW2), INLA style
+
+The protocol's model for stratum i with n_i children and total count
+y_i = round(mean dmft/DMFT x n_i):
+
+    y_i ~ NegBin(mean n_i exp(eta_i), size n_i r)
+    eta_i = alpha + S[province] + T[year] + A[age] + G[sex] + interactions
+
+where S is BYM2 over the province/territory graph (studies.spatial), T an
+RW2 (or RW1) over data-collection years, A an RW1 over age bands, G iid over
+sex, and the Knorr-Held type I interactions are iid. Hyperparameters have the
+protocol priors: PC priors on precisions, Beta on the BYM2 mixing parameter
+and Gamma(0.01, 0.01) on the dispersion.
+
+Fitting follows INLA's empirical-Bayes strategy. For given hyperparameters
+theta the latent field is found by Newton iterations on the sparse precision
+Q(theta) + A'WA, with the sum-to-zero constraints applied by conditioning by
+kriging. The Laplace approximation of p(theta | y) is maximised with L-BFGS-B,
+and posterior summaries come from draws of the Gaussian approximation at the
+mode. Q is assembled with scipy.sparse. It is factorised with CHOLMOD when
+scikit-sparse is installed, and with a LAPACK Cholesky otherwise; the latent
+field is only a few hundred nodes.
+"""
+import hashlib
+import io
+import re
+from dataclasses import asdict, dataclass, fields
+
+import numpy as np
+from scipy import linalg, optimize, sparse
+from scipy.special import gammaln
+
+from . import analytics, spatial
+
+try:
+    from sksparse.cholmod import cholesky as cholmod_cholesky
+except ImportError:
+    cholmod_cholesky = None
+
+
+LIKELIHOODS = ('nbinomial', 'poisson')
+TEMPORAL_MODELS = ('rw2', 'rw1')
+INTERACTIONS = ('space_time', 'space_age', 'time_age')
+
+INTERCEPT_PRECISION = 0.1  # alpha ~ N(0, 10)
+JITTER = 1e-5  # keeps intrinsic (ICAR/RW) blocks proper; constraints remove their null space
+THETA_BOUNDS = (-10.0, 12.0)
+NEWTON_MAX_ITER = 50
+NEWTON_TOLERANCE = 1e-8
+
+AGE_RE = re.compile(r'(\d+(?:\.\d+)?)(?:\s*-\s*(\d+(?:\.\d+)?))?\s*(?:years?|yrs?)\b', re.IGNORECASE)
+
+
+@dataclass(frozen=True)
+class ModelSpec:
+    """Model options; the defaults are the protocol's reference specification"""
+    likelihood: str = 'nbinomial'
+    temporal: str = 'rw2'
+    graph: str = 'default'
+    interactions: tuple = ('space_time',)
+    pc_u: float = 1.0
+    pc_alpha: float = 0.01
+    rho_a: float = 0.5
+    rho_b: float = 0.5
+    age_width: int = 5
+    samples: int = 1000
+    seed: int = 2050
+
+    @classmethod
+    def from_dict(cls, data):
+        """Build and validate a spec; raises ValueError for unknown or invalid options"""
+        data = dict(data or {})
+        unknown = set(data) - {field.name for field in fields(cls)}
+        if unknown:
+            raise ValueError(f"Unknown model options: {', '.join(sorted(unknown))}")
+        if 'interactions' in data:
+            data['interactions'] = tuple(data['interactions'])
+        spec = cls(**data)
+        spec.validate()
+        return spec
+
+    def validate(self):
+        if self.likelihood not in LIKELIHOODS:
+            raise ValueError(f"likelihood must be one of: {', '.join(LIKELIHOODS)}")
+        if self.temporal not in TEMPORAL_MODELS:
+            raise ValueError(f"temporal must be one of: {', '.join(TEMPORAL_MODELS)}")
+        if self.graph not in spatial.GRAPHS or spatial.graph_nodes(self.graph) != spatial.PROVINCES:
+            raise ValueError(f"graph must be one of: {', '.join(g for g in spatial.GRAPHS if g not in spatial.NODES)}")
+        if any(name not in INTERACTIONS for name in self.interactions):
+            raise ValueError(f"interactions must be drawn from: {', '.join(INTERACTIONS)}")
+        if not (self.pc_u > 0 and 0 < self.pc_alpha < 1 and self.rho_a > 0 and self.rho_b > 0):
+            raise ValueError("pc_u, rho_a and rho_b must be positive and pc_alpha in (0, 1)")
+        if self.age_width < 1 or self.samples < 10:
+            raise ValueError("age_width must be >= 1 and samples >= 10")
+
+    def to_dict(self):
+        data = asdict(self)
+        data['interactions'] = list(self.interactions)
+        return data
+
+
+@dataclass
+class ModelData:
+    """Observations for the model, with each stratum's index into every effect"""
+    y: np.ndarray
+    exposure: np.ndarray
+    province: np.ndarray  # index into spatial.PROVINCES, -1 for national/multi-province strata
+    province_labels: list  # every province label in the data, including 'national'
+    province_all: np.ndarray  # index into province_labels
+    year: np.ndarray
+    years: list
+    age: np.ndarray
+    age_labels: list
+    sex: np.ndarray
+    sex_labels: list
+    stratum_ids: np.ndarray
+
+    def __len__(self):
+        return len(self.y)
+
+    def fingerprint(self):
+        digest = hashlib.sha256()
+        for array in (self.y, self.exposure, self.province_all, self.year, self.age, self.sex):
+            digest.update(np.ascontiguousarray(array).tobytes())
+        return digest.hexdigest()
+
+
+def stratum_ages(strata):
+    """Mid-point age of each stratum: the 'a-b years' in its label, else the study's age range"""
+    columns = strata.columns
+    parsed = np.full(len(strata.labels['age_category']), np.nan)
+    for code, label in enumerate(strata.labels['age_category']):
+        match = AGE_RE.search(label or '')
+        if match:
+            low = float(match.group(1))
+            high = float(match.group(2) or match.group(1))
+            parsed[code] = (low + high) / 2
+    ages = parsed[columns['age_category']]
+    return np.where(np.isnan(ages), (columns['age_min'] + columns['age_max']) / 2, ages)
+
+
+def _index(values):
+    """Dense 0..k-1 index of ``values`` plus the sorted distinct values"""
+    labels, index = np.unique(values, return_inverse=True)
+    return index.reshape(-1), labels.tolist()
+
+
+def model_data(spec, frame=None):
+    """ModelData from the analytics arrays: strata with a mean dmft/DMFT and a sample size"""
+    strata = (frame or analytics.frame()).strata
+    columns = strata.columns
+    usable = ~np.isnan(columns['mean_dmft_DMFT']) & (columns['sample_size_group'] > 0)
+
+    exposure = columns['sample_size_group'][usable].astype(np.float64)
+    y = np.round(columns['mean_dmft_DMFT'][usable] * exposure)
+
+    province_codes = strata.decode('province', columns['province'][usable])
+    lookup = {code: i for i, code in enumerate(spatial.PROVINCES)}
+    province = np.array([lookup.get(code, -1) for code in province_codes], dtype=np.int64)
+    province_all, province_labels = _index(np.array(province_codes, dtype=object).astype(str))
+
+    collection_year = columns['collection_year'][usable]
+    years = list(range(int(collection_year.min()), int(collection_year.max()) + 1)) if len(y) else []
+    year = (collection_year - (years[0] if years else 0)).astype(np.int64)
+
+    band = (stratum_ages(strata)[usable] // spec.age_width).astype(np.int64)
+    low = int(band.min()) if len(y) else 0
+    high = int(band.max()) if len(y) else -1
+    age = band - low
+    age_labels = [f"{b * spec.age_width}-{(b + 1) * spec.age_width - 1}" for b in range(low, high + 1)]
+
+    sex_codes = np.array(strata.decode('sex', columns['sex'][usable]), dtype=object).astype(str)
+    sex, sex_labels = _index(sex_codes)
+
+    return ModelData(
+        y=y, exposure=exposure, province=province, province_labels=province_labels,
+        province_all=province_all, year=year, years=years, age=age, age_labels=age_labels,
+        sex=sex, sex_labels=sex_labels, stratum_ids=columns['id'][usable],
+    )
+
+
+class Factor:
+    """Cholesky factor of a sparse symmetric positive definite matrix"""
+
+    def __init__(self, matrix):
+        if cholmod_cholesky is not None:
+            self._cholmod = cholmod_cholesky(matrix.tocsc())
+        else:
+            self._cholmod = None
+            self._lower = linalg.cholesky(matrix.toarray(), lower=True)
+
+    def solve(self, rhs):
+        if self._cholmod is not None:
+            return self._cholmod(rhs)
+        return linalg.cho_solve((self._lower, True), rhs)
+
+    def logdet(self):
+        if self._cholmod is not None:
+            return self._cholmod.logdet()
+        return 2 * np.log(np.diag(self._lower)).sum()
+
+    def solve_lt(self, z):
+        """L^-T z, so that mode + L^-T z ~ N(mode, Q^-1) for standard normal z"""
+        if self._cholmod is not None:
+            return self._cholmod.apply_Pt(self._cholmod.solve_Lt(z, use_LDLt_decomposition=False))
+        return linalg.solve_triangular(self._lower, z, trans='T', lower=True)
+
+
+def _random_walk(size, order):
+    """RW1/RW2 structure matrix D'D for ``size`` equally spaced nodes"""
+    if size <= order:
+        return sparse.csr_matrix((size, size))
+    difference = sparse.eye(size, format='csr')
+    for _ in range(order):
+        difference = difference[1:] - difference[:-1]
+    return (difference.T @ difference).tocsr()
+
+
+def _pc_log_prior(log_precision, u, alpha):
+    """PC prior on a precision (Simpson et al. 2017), as a density on log(precision)"""
+    rate = -np.log(alpha) / u
+    return np.log(rate / 2) - log_precision / 2 - rate * np.exp(-log_precision / 2)
+
+
+@dataclass
+class Block:
+    """One latent effect: its columns in the field, per-observation index and prior"""
+    name: str
+    labels: list
+    index: np.ndarray
+    kind: str  # 'fixed', 'iid', 'intrinsic' or 'bym2'
+    structure: object = None
+    rank: int = 0
+    constraints: tuple = ()
+    offset: int = 0
+
+    @property
+    def size(self):
+        return 2 * len(self.labels) if self.kind == 'bym2' else len(self.labels)
+
+
+class HierarchicalModel:
+    """Latent Gaussian model for ModelData; fit() returns a FitResult"""
+
+    def __init__(self, data, spec):
+        self.data = data
+        self.spec = spec
+        self.blocks = self._blocks()
+        offset = 0
+        for block in self.blocks:
+            block.offset = offset
+            offset += block.size
+        self.size = offset
+
+        rows, cols = [], []
+        for block in self.blocks:
+            present = np.flatnonzero(block.index >= 0)
+            rows.append(present)
+            cols.append(block.offset + block.index[present])
+        rows, cols = np.concatenate(rows), np.concatenate(cols)
+        self.design = sparse.csr_matrix((np.ones(len(rows)), (rows, cols)), shape=(len(data), self.size))
+
+        constraints = []
+        for block in self.blocks:
+            for indicator in block.constraints:
+                row = np.zeros(self.size)
+                row[block.offset:block.offset + len(indicator)] = indicator
+                if block.kind == 'bym2':
+                    # Constraints on the BYM2 block apply to its ICAR half (u)
+                    row = np.roll(row, len(block.labels))
+                constraints.append(row)
+        self.constraints = np.array(constraints).reshape(-1, self.size)
+
+        self.theta_names = []
+        for block in self.blocks:
+            if block.kind != 'fixed':
+                self.theta_names.append(f'log_precision_{block.name}')
+            if block.kind == 'bym2':
+                self.theta_names.append('logit_phi_spatial')
+        if spec.likelihood == 'nbinomial':
+            self.theta_names.append('log_size')
+        self._x = np.zeros(self.size)
+
+    def _blocks(self):
+        data, spec = self.data, self.spec
+        adjacency = spatial.adjacency_matrix(spec.graph)
+        structure = spatial.scaled_icar_structure(adjacency)
+        labels = spatial.component_labels(adjacency)
+        # One sum-to-zero constraint per connected component (isolated nodes are proper)
+        icar_constraints = tuple(
+            (labels == component).astype(float)
+            for component in np.unique(labels) if (labels == component).sum() > 1
+        )
+
+        n_years, n_ages = len(data.years), len(data.age_labels)
+        order = 2 if spec.temporal == 'rw2' else 1
+        blocks = [
+            Block('intercept', ['(Intercept)'], np.zeros(len(data), dtype=np.int64), 'fixed'),
+            Block(
+                'spatial', list(spatial.PROVINCES), data.province, 'bym2', structure,
+                rank=len(spatial.PROVINCES), constraints=icar_constraints,
+            ),
+            Block(
+                'temporal', [str(year) for year in data.years], data.year, 'intrinsic',
+                _random_walk(n_years, order), rank=max(n_years - order, 0), constraints=(np.ones(n_years),),
+            ),
+            Block(
+                'age', data.age_labels, data.age, 'intrinsic', _random_walk(n_ages, 1),
+                rank=max(n_ages - 1, 0), constraints=(np.ones(n_ages),),
+            ),
+            Block('sex', data.sex_labels, data.sex, 'iid', rank=len(data.sex_labels)),
+        ]
+        pairs = {
+            'space_time': (data.province_all, data.year, data.province_labels, [str(y) for y in data.years]),
+            'space_age': (data.province_all, data.age, data.province_labels, data.age_labels),
+            'time_age': (data.year, data.age, [str(y) for y in data.years], data.age_labels),
+        }
+        for name in spec.interactions:
+            first, second, first_labels, second_labels = pairs[name]
+            index, keys = _index(first * len(second_labels) + second)
+            labels = [f"{first_labels[key // len(second_labels)]}:{second_labels[key % len(second_labels)]}" for key in keys]
+            blocks.append(Block(name, labels, index, 'iid', rank=len(labels)))
+        return blocks
+
+    def block(self, name):
+        return next(block for block in self.blocks if block.name == name)
+
+    # Hyperparameters -----------------------------------------------------
+
+    def _unpack(self, theta):
+        return dict(zip(self.theta_names, theta))
+
+    def precision(self, theta):
+        """Prior precision matrix of the latent field at ``theta``"""
+        values = self._unpack(theta)
+        parts = []
+        for block in self.blocks:
+            if block.kind == 'fixed':
+                parts.append(sparse.identity(block.size) * INTERCEPT_PRECISION)
+                continue
+            tau = np.exp(values[f'log_precision_{block.name}'])
+            if block.kind == 'iid':
+                parts.append(sparse.identity(block.size) * tau)
+            elif block.kind == 'intrinsic':
+                parts.append(tau * block.structure + JITTER * sparse.identity(block.size))
+            else:
+                phi = 1 / (1 + np.exp(-values['logit_phi_spatial']))
+                m = len(block.labels)
+                identity = sparse.identity(m)
+                cross = -np.sqrt(phi * tau) / (1 - phi) * identity
+                parts.append(sparse.bmat([
+                    [tau / (1 - phi) * identity, cross],
+                    [cross, block.structure + phi / (1 - phi) * identity + JITTER * identity],
+                ]))
+        return sparse.block_diag(parts, format='csc')
+
+    def log_prior_determinant(self, theta):
+        """1/2 log|Q(theta)| up to a constant, from the rank of each block"""
+        values = self._unpack(theta)
+        total = 0.0
+        for block in self.blocks:
+            if block.kind == 'fixed':
+                continue
+            log_tau = values[f'log_precision_{block.name}']
+            if block.kind == 'bym2':
+                phi = 1 / (1 + np.exp(-values['logit_phi_spatial']))
+                total += 0.5 * len(block.labels) * (log_tau - np.log(1 - phi))
+            else:
+                total += 0.5 * block.rank * log_tau
+        return total
+
+    def log_hyperprior(self, theta):
+        spec = self.spec
+        total = 0.0
+        for name, value in self._unpack(theta).items():
+            if name.startswith('log_precision_'):
+                total += _pc_log_prior(value, spec.pc_u, spec.pc_alpha)
+            elif name == 'logit_phi_spatial':
+                # Beta(a, b) on phi, with the Jacobian of the logit
+                phi = 1 / (1 + np.exp(-value))
+                total += (
+                    spec.rho_a * np.log(phi) + spec.rho_b * np.log(1 - phi)
+                    + gammaln(spec.rho_a + spec.rho_b) - gammaln(spec.rho_a) - gammaln(spec.rho_b)
+                )
+            else:
+                # Gamma(0.01, 0.01) on the dispersion r, on log(r)
+                total += 0.01 * np.log(0.01) - gammaln(0.01) + 0.01 * value - 0.01 * np.exp(value)
+        return total
+
+    # Likelihood ------------------------------------------------------------
+
+    def log_likelihood(self, eta, theta):
+        """Pointwise log-likelihood, its gradient in eta and the negative second derivative"""
+        y, exposure = self.data.y, self.data.exposure
+        mu = exposure * np.exp(eta)
+        if self.spec.likelihood == 'poisson':
+            return y * np.log(mu) - mu - gammaln(y + 1), y - mu, mu
+        size = exposure * np.exp(self._unpack(theta)['log_size'])
+        log_total = np.log(size + mu)
+        pointwise = (
+            gammaln(y + size) - gammaln(size) - gammaln(y + 1)
+            + size * (np.log(size) - log_total) + y * (np.log(mu) - log_total)
+        )
+        gradient = y - (y + size) * mu / (size + mu)
+        weight = (y + size) * mu * size / (size + mu) ** 2
+        return pointwise, gradient, weight
+
+    # Latent field ------------------------------------------------------------
+
+    def _constrain(self, factor, vector):
+        """Condition ``vector`` (columns) on the sum-to-zero constraints"""
+        if not len(self.constraints):
+            return vector
+        w = factor.solve(self.constraints.T)
+        correction = w @ np.linalg.solve(self.constraints @ w, self.constraints @ vector)
+        return vector - correction
+
+    def mode(self, theta):
+        """Newton iterations for the mode of p(x | y, theta); returns (x, factor, Q)"""
+        prior = self.precision(theta)
+        design = self.design
+        x = self._x.copy()
+
+        def objective(value):
+            return self.log_likelihood(design @ value, theta)[0].sum() - 0.5 * value @ (prior @ value)
+
+        current = objective(x)
+        for _ in range(NEWTON_MAX_ITER):
+            eta = design @ x
+            _, gradient, weight = self.log_likelihood(eta, theta)
+            hessian = prior + design.T @ sparse.diags(weight) @ design
+            factor = Factor(hessian)
+            proposal = self._constrain(factor, factor.solve(design.T @ (gradient + weight * eta)))
+            step = proposal - x
+            for _ in range(20):
+                candidate = x + step
+                value = objective(candidate)
+                if value >= current - 1e-10:
+                    break
+                step /= 2
+            x, current = candidate, value
+            if np.max(np.abs(step)) < NEWTON_TOLERANCE:
+                break
+
+        _, _, weight = self.log_likelihood(design @ x, theta)
+        factor = Factor(prior + design.T @ sparse.diags(weight) @ design)
+        self._x = x
+        return x, factor, prior
+
+    def log_posterior(self, theta):
+        """Laplace approximation to log p(theta | y) up to a constant"""
+        x, factor, prior = self.mode(theta)
+        pointwise, _, _ = self.log_likelihood(self.design @ x, theta)
+        return (
+            self.log_hyperprior(theta) + self.log_prior_determinant(theta)
+            - 0.5 * x @ (prior @ x) + pointwise.sum() - 0.5 * factor.logdet()
+        )
+
+    # Fitting -----------------------------------------------------------------
+
+    def _theta_start(self):
+        return np.array([1.0 if name == 'log_size' else 0.0 for name in self.theta_names])
+
+    def _theta_hessian(self, theta, step=0.05):
+        """Central-difference Hessian of -log p(theta | y) at the mode"""
+        d = len(theta)
+        hessian = np.zeros((d, d))
+        f0 = -self.log_posterior(theta)
+        for i in range(d):
+            for j in range(i, d):
+                ei, ej = np.eye(d)[i] * step, np.eye(d)[j] * step
+                if i == j:
+                    value = (-self.log_posterior(theta + ei) - 2 * f0 - self.log_posterior(theta - ei)) / step ** 2
+                else:
+                    value = (
+                        -self.log_posterior(theta + ei + ej) + self.log_posterior(theta + ei - ej)
+                        + self.log_posterior(theta - ei + ej) - self.log_posterior(theta - ei - ej)
+                    ) / (4 * step ** 2)
+                hessian[i, j] = hessian[j, i] = value
+        return hessian
+
+    def fit(self):
+        result = optimize.minimize(
+            lambda theta: -self.log_posterior(theta), self._theta_start(), method='L-BFGS-B',
+            bounds=[THETA_BOUNDS] * len(self.theta_names),
+        )
+        theta = result.x
+        log_mlik = -result.fun
+        try:
+            covariance = np.linalg.inv(self._theta_hessian(theta))
+            theta_sd = np.sqrt(np.where(np.diag(covariance) > 0, np.diag(covariance), np.nan))
+        except np.linalg.LinAlgError:
+            covariance = np.full((len(theta), len(theta)), np.nan)
+            theta_sd = np.full(len(theta), np.nan)
+
+        x, factor, _ = self.mode(theta)
+        rng = np.random.default_rng(self.spec.seed)
+        noise = factor.solve_lt(rng.standard_normal((self.size, self.spec.samples)))
+        draws = x[:, None] + self._constrain(factor, noise)
+        return FitResult(self, theta, theta_sd, covariance, log_mlik, x, draws, converged=result.success)
+
+
+def summarize(samples):
+    """mean, sd and 2.5/50/97.5% quantiles over axis 0"""
+    q025, q50, q975 = np.quantile(samples, [0.025, 0.5, 0.975], axis=0)
+    return {'mean': samples.mean(axis=0), 'sd': samples.std(axis=0, ddof=1), 'q025': q025, 'q50': q50, 'q975': q975}
+
+
+class FitResult:
+    """Posterior summaries, model criteria and draws of a fitted HierarchicalModel"""
+
+    def __init__(self, model, theta, theta_sd, theta_covariance, log_mlik, mode, draws, converged=True):
+        self.model = model
+        self.theta = theta
+        self.theta_sd = theta_sd
+        self.theta_covariance = theta_covariance
+        self.log_mlik = log_mlik
+        self.mode = mode
+        self.draws = draws
+        self.converged = converged
+        self._criteria()
+
+    def block_draws(self, name):
+        """Draws (samples x nodes) of one effect; for BYM2, the combined spatial effect b"""
+        block = self.model.block(name)
+        return self.draws[block.offset:block.offset + len(block.labels)].T
+
+    def _criteria(self):
+        model = self.model
+        eta = (model.design @ self.draws).T
+        pointwise = np.array([model.log_likelihood(row, self.theta)[0] for row in eta])
+        at_mode = model.log_likelihood(model.design @ self.mode, self.theta)[0].sum()
+        mean_deviance = -2 * pointwise.sum(axis=1).mean()
+        self.p_dic = mean_deviance + 2 * at_mode
+        self.dic = mean_deviance + self.p_dic
+        peak = pointwise.max(axis=0)
+        lppd = (peak + np.log(np.exp(pointwise - peak).mean(axis=0))).sum()
+        self.p_waic = pointwise.var(axis=0, ddof=1).sum()
+        self.waic = -2 * (lppd - self.p_waic)
+
+    def hyperparameters(self):
+        """Mode and SD of each hyperparameter on its internal scale, plus the natural-scale mode"""
+        result = {}
+        for name, value, sd in zip(self.model.theta_names, self.theta, self.theta_sd):
+            if name.startswith('log_precision_'):
+                natural = {'precision': float(np.exp(value)), 'sd': float(np.exp(-value / 2))}
+            elif name == 'logit_phi_spatial':
+                natural = {'phi': float(1 / (1 + np.exp(-value)))}
+            else:
+                natural = {'size': float(np.exp(value))}
+            # The SD is unknown (None) when the Hessian at the mode was not positive definite
+            result[name] = {'mode': float(value), 'sd': float(sd) if np.isfinite(sd) else None, **natural}
+        return result
+
+    def summaries(self):
+        """(component, label, stats) rows for every effect plus fitted mean dmft/DMFT"""
+        rows = []
+        for block in self.model.blocks:
+            stats = summarize(self.block_draws(block.name))
+            rows += [
+                (block.name, label, {key: float(values[i]) for key, values in stats.items()})
+                for i, label in enumerate(block.labels)
+            ]
+        intercept = self.block_draws('intercept')
+        fitted = {
+            'fitted_province': (spatial.PROVINCES, np.exp(intercept + self.block_draws('spatial'))),
+            'fitted_year': (self.model.block('temporal').labels, np.exp(intercept + self.block_draws('temporal'))),
+        }
+        for component, (labels, samples) in fitted.items():
+            stats = summarize(samples)
+            rows += [
+                (component, label, {key: float(values[i]) for key, values in stats.items()})
+                for i, label in enumerate(labels)
+            ]
+        return rows
+
+    def draws_archive(self):
+        """Compressed .npz bytes of the draws later stages (projections, CV) start from"""
+        buffer = io.BytesIO()
+        np.savez_compressed(
+            buffer,
+            intercept=self.block_draws('intercept').astype(np.float32),
+            spatial=self.block_draws('spatial').astype(np.float32),
+            temporal=self.block_draws('temporal').astype(np.float32),
+            age=self.block_draws('age').astype(np.float32),
+            years=np.array(self.model.data.years),
+            age_labels=np.array(self.model.data.age_labels),
+            provinces=np.array(spatial.PROVINCES),
+            theta=self.theta,
+            theta_names=np.array(self.model.theta_names),
+            theta_covariance=self.theta_covariance,
+        )
+        return buffer.getvalue()
+
+
+def fit(spec=None, frame=None):
+    """Fit the model with ``spec`` (a ModelSpec, dict or None for the reference spec)"""
+    if not isinstance(spec, ModelSpec):
+        spec = ModelSpec.from_dict(spec)
+    data = model_data(spec, frame)
+    if len(data) < 2:
+        raise ValueError("Need at least two strata with a mean dmft/DMFT to fit the model")
+    return HierarchicalModel(data, spec).fit()
+
+
+def load_draws(archive):
+    """Inverse of FitResult.draws_archive()"""
+    with np.load(io.BytesIO(bytes(archive))) as npz:
+        return {name: npz[name] for name in npz.files}
+
+
+def queue_fit(spec=None, name='reference'):
+    """Create a queued ModelFit with the next model version"""
+    from django.db import IntegrityError, transaction
+    from django.db.models import Max
+
+    from .models import ModelFit
+
+    spec = (spec if isinstance(spec, ModelSpec) else ModelSpec.from_dict(spec)).to_dict()
+    while True:
+        version = (ModelFit.objects.aggregate(latest=Max('version'))['latest'] or 0) + 1
+        try:
+            with transaction.atomic():
+                return ModelFit.objects.create(version=version, name=name, spec=spec)
+        except IntegrityError:
+            continue  # another process took this version number
+
+
+def run_fit(model_fit):
+    """Fit a queued ModelFit and store its posterior summaries; returns False if already claimed"""
+    from django.db import transaction
+    from django.utils import timezone
+
+    from . import caching
+    from .models import ModelFit, PosteriorSummary
+
+    claimed = ModelFit.objects.filter(pk=model_fit.pk, status='queued').update(
+        status='running', started_at=timezone.now()
+    )
+    if not claimed:
+        return False
+    model_fit.refresh_from_db()
+
+    try:
+        spec = ModelSpec.from_dict(model_fit.spec)
+        result = fit(spec)
+    except Exception as exc:
+        ModelFit.objects.filter(pk=model_fit.pk).update(
+            status='failed', message=f"{exc.__class__.__name__}: {exc}", finished_at=timezone.now()
+        )
+        raise
+
+    with transaction.atomic():
+        PosteriorSummary.objects.filter(fit=model_fit).delete()
+        PosteriorSummary.objects.bulk_create([
+            PosteriorSummary(fit=model_fit, component=component, label=label, **stats)
+            for component, label, stats in result.summaries()
+        ], batch_size=500)
+        model_fit.status = 'completed'
+        model_fit.data_hash = result.model.data.fingerprint()
+        model_fit.n_strata = len(result.model.data)
+        model_fit.log_marginal_likelihood = result.log_mlik
+        model_fit.dic, model_fit.p_dic = result.dic, result.p_dic
+        model_fit.waic, model_fit.p_waic = result.waic, result.p_waic
+        model_fit.hyperparameters = result.hyperparameters()
+        model_fit.draws = result.draws_archive()
+        model_fit.message = '' if result.converged else "Hyperparameter optimisation did not converge"
+        model_fit.finished_at = timezone.now()
+        model_fit.save()
+        # Cached dashboard responses embed model estimates
+        transaction.on_commit(caching.bump_data_version)
+    return True
+
+
+def latest_fit(name=None):
+    """Most recent completed ModelFit (optionally for one specification name), or None"""
+    from .models import ModelFit
+
+    fits = ModelFit.objects.filter(status='completed')
+    if name:
+        fits = fits.filter(name=name)
+    return fits.defer('draws').order_by('-version').first()
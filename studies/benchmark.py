@@ -0,0 +1,184 @@
+"""Latency and query-count benchmark of every URL in studies/urls.py
+
+Each route is requested through the Django test client, which runs the
+full middleware stack without a web server. Path parameters are filled
+from the database, and a few routes get extra query strings (filters,
+groupings) that exercise their heavier paths. For every case the harness
+reports p50/p95/mean latency and the SQL query count and time, measured
+with the same execute wrapper that studies.profiling uses.
+
+``warm`` mode lets the versioned response cache work, as it does in
+production between writes. ``cold`` bumps the data version before every
+request, so each one pays for the analytics refresh and the view itself.
+Results are JSON with the commit, database vendor and row counts, so runs
+on SQLite and PostgreSQL, or before and after a change, can be compared
+with ``compare()``. A case that answers with a 4xx or 5xx status is timing
+an error page, not the view: it is marked ``ok: false``, listed under
+``errors`` and left out of comparisons.
+"""
+import datetime
+import subprocess
+import time
+
+import django
+import numpy as np
+from django.conf import settings
+from django.db import connection
+from django.test import Client
+from django.urls import URLPattern, reverse
+
+from . import caching, profiling, urls
+from .models import CariesData, DentalCariesStudy, Job
+
+
+MODES = ('warm', 'cold')
+
+# Extra query strings per URL name, on top of the bare URL
+QUERIES = {
+    'study_list': ['province=ON&sort=-publication_year', 'age_group=school_age&year_from=2000'],
+    'study_search': ['q=caries', 'q=fluoride+children&mode=phrase'],
+    'api_temporal_trends': ['bucket=year'],
+    'api_meta_analysis': ['by=province&outcome=dmft&method=dl', 'by=province,age_group,sex'],
+    'api_validation': ['mode=kfold&k=5'],
+    'api_compositions': ['by=province,age_group'],
+    'api_v1_studies': ['province=ON'],
+    'api_v1_strata': ['province=QC'],
+}
+
+
+def _path_values():
+    """Values for the path parameters of studies/urls.py, or None where the table is empty"""
+    study = DentalCariesStudy.objects.order_by('pk').values_list('study_id', flat=True).first()
+    job = Job.objects.order_by('-pk').values_list('pk', flat=True).first()
+    return {'study_id': study, 'pk': job}
+
+
+def cases(names=None):
+    """(name, url) pairs for every studies URL pattern and its extra query strings
+
+    Patterns whose path parameters cannot be filled from the database are skipped.
+    """
+    values = _path_values()
+    found = []
+    for pattern in urls.urlpatterns:
+        if not isinstance(pattern, URLPattern) or (names and pattern.name not in names):
+            continue
+        kwargs = {name: values.get(name) for name in pattern.pattern.converters}
+        if None in kwargs.values():
+            continue
+        path = reverse(f"{urls.app_name}:{pattern.name}", kwargs=kwargs)
+        found.append((pattern.name, path))
+        found += [(pattern.name, f"{path}?{query}") for query in QUERIES.get(pattern.name, [])]
+    return found
+
+
+def _client(username=None):
+    hosts = [host for host in settings.ALLOWED_HOSTS if host != '*' and not host.startswith('.')]
+    # Errors are recorded as a 500 status instead of aborting the run
+    client = Client(raise_request_exception=False, HTTP_HOST=hosts[0] if hosts else 'localhost')
+    if username:
+        from django.contrib.auth import get_user_model
+
+        client.force_login(get_user_model().objects.get(username=username))
+    return client
+
+
+def measure(client, url, iterations=20, warmup=1, mode='warm'):
+    """Latency (ms) percentiles and SQL counts of ``iterations`` GET requests to ``url``"""
+    secure = getattr(settings, 'SECURE_SSL_REDIRECT', False)
+    latencies, queries, sql_time, statuses = [], [], [], set()
+    for iteration in range(warmup + iterations):
+        if mode == 'cold':
+            caching.bump_data_version()
+        profile = profiling.RequestProfile()
+        started = time.perf_counter()
+        with connection.execute_wrapper(profile):
+            response = client.get(url, secure=secure)
+            if response.streaming:
+                for _ in response.streaming_content:
+                    pass
+        elapsed = time.perf_counter() - started
+        statuses.add(response.status_code)
+        if iteration >= warmup:
+            latencies.append(elapsed * 1000)
+            queries.append(profile.queries)
+            sql_time.append(profile.sql_time * 1000)
+    latencies = np.array(latencies)
+    return {
+        'status': max(statuses),
+        'ok': max(statuses) < 400,
+        'p50_ms': float(np.percentile(latencies, 50)),
+        'p95_ms': float(np.percentile(latencies, 95)),
+        'mean_ms': float(latencies.mean()),
+        'max_ms': float(latencies.max()),
+        'queries': int(np.median(queries)),
+        'max_queries': int(max(queries)),
+        'sql_ms': float(np.mean(sql_time)),
+    }
+
+
+def _commit():
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'], cwd=settings.BASE_DIR,
+            capture_output=True, text=True, check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run(iterations=20, warmup=1, mode='warm', names=None, username=None, progress=None):
+    """Benchmark every case; returns the JSON-ready result document
+
+    Raises ValueError for an unknown mode or fewer than one iteration.
+    Cases that answered with an error status are listed under ``errors``.
+    """
+    if mode not in MODES:
+        raise ValueError(f"mode must be one of: {', '.join(MODES)}")
+    if iterations < 1 or warmup < 0:
+        raise ValueError("iterations must be at least 1 and warmup at least 0")
+    client = _client(username)
+    selected = cases(names)
+    results = []
+    for number, (name, url) in enumerate(selected, start=1):
+        results.append({'name': name, 'url': url, **measure(client, url, iterations, warmup, mode)})
+        if progress:
+            progress(number, len(selected), results[-1])
+    return {
+        'commit': _commit(),
+        'created_at': datetime.datetime.now(datetime.timezone.utc).isoformat(),
+        'database': connection.vendor,
+        'django': django.get_version(),
+        'mode': mode,
+        'iterations': iterations,
+        'studies': DentalCariesStudy.objects.count(),
+        'strata': CariesData.objects.count(),
+        'results': results,
+        'errors': [{'url': row['url'], 'status': row['status']} for row in results if not row['ok']],
+    }
+
+
+def _ok(row):
+    return row.get('ok', row['status'] < 400)
+
+
+def compare(baseline, current, metric='p95_ms'):
+    """Per-URL change of ``metric`` and query count between two result documents
+
+    URLs that errored in either run are left out.
+    """
+    before = {row['url']: row for row in baseline['results'] if _ok(row)}
+    rows = []
+    for row in current['results']:
+        previous = before.get(row['url'])
+        if previous is None or not _ok(row):
+            continue
+        rows.append({
+            'url': row['url'],
+            'before': previous[metric],
+            'after': row[metric],
+            'ratio': row[metric] / previous[metric] if previous[metric] else None,
+            'queries_before': previous['queries'],
+            'queries_after': row['queries'],
+        })
+    return rows
@@ -0,0 +1,66 @@
+"""Versioned response caching for the public pages and JSON APIs
+
+Cache keys embed a global data version. Writes to studies or caries data bump
+the version (see studies.signals), so every cached response becomes
+unreachable after the next committed change instead of waiting out a TTL.
+
+The version is a nanosecond timestamp, not a counter. A cache may evict the
+key or restart empty, and a fresh stamp never equals a version that earlier
+responses were cached under. Each process reads the version from the
+default cache, so deployments with several workers need a shared backend
+(file, redis or memcached); with locmem a bump only reaches its own process.
+"""
+import hashlib
+import time
+
+from django.core.cache import cache
+
+
+DATA_VERSION_KEY = 'data-version'
+
+
+def data_version():
+    """Current data version, initialised on first use (or after the key was evicted)"""
+    version = cache.get(DATA_VERSION_KEY)
+    if version is None:
+        stamp = time.time_ns()
+        cache.add(DATA_VERSION_KEY, stamp, timeout=None)
+        version = cache.get(DATA_VERSION_KEY, stamp)
+    return version
+
+
+def bump_data_version():
+    """Invalidate every cached response by moving to a new data version"""
+    cache.set(DATA_VERSION_KEY, time.time_ns(), timeout=None)
+
+
+def response_key(request, name):
+    """Cache key for a view name plus the request's filter (GET) combination"""
+    params = '&'.join(
+        f"{key}={value}" for key, values in sorted(request.GET.lists()) for value in sorted(values)
+    )
+    digest = hashlib.md5(f"{request.path}?{params}".encode()).hexdigest()
+    return f"response:{name}:v{data_version()}:{digest}"
+
+
+class CachedResponseMixin:
+    """Serve GET responses from the cache, keyed per view, filters and data version"""
+    cache_timeout = None  # falls back to the TIMEOUT of the default cache
+
+    def dispatch(self, request, *args, **kwargs):
+        if request.method != 'GET':
+            return super().dispatch(request, *args, **kwargs)
+
+        key = response_key(request, self.__class__.__name__)
+        response = cache.get(key)
+        if response is not None:
+            return response
+
+        response = super().dispatch(request, *args, **kwargs)
+        if response.status_code == 200 and not response.streaming:
+            timeout = self.cache_timeout if self.cache_timeout is not None else cache.default_timeout
+            if hasattr(response, 'render') and callable(response.render):
+                response.add_post_render_callback(lambda rendered: cache.set(key, rendered, timeout))
+            else:
+                cache.set(key, response, timeout)
+        return response
@@ -0,0 +1,234 @@
+"""Append-only change log of studies and strata, and the replica side of its feed
+
+Every insert, update and delete of a DentalCariesStudy or CariesData row
+becomes a ChangeLogEntry. An insert carries the full row. An update carries
+the new and old values of the changed fields only. A delete keeps the
+deleted row in ``previous``. Single saves and deletes are logged by the
+model signals. The bulk paths (importer, corrections, care index
+derivation) bypass the signals, so they wrap their writes in ``capture()``,
+which diffs a snapshot of the affected rows from before and after the
+writes and logs the differences with one bulk_create. Synthetic benchmark
+studies (study_id starting with synthetic.PREFIX) and their strata are
+never logged, so they stay out of replicas.
+
+Entries are written inside the transaction that made the change, so the
+change and its entry commit or roll back together (the two models' save()
+opens a transaction for the post_save entry). Ids are taken when an entry
+is written, not when it commits, so the feed (/api/v1/changes/) holds back
+entries younger than CHANGES_SETTLE_SECONDS: a reader must not pass an id
+whose transaction is still open and miss it for good. The bulk paths and
+the signals write their entries at the end of their work, so the window
+only has to cover the commit; raise it if write transactions stay open
+long after their last change. The feed carries whole rows, so it needs a
+staff session or the CHANGES_FEED_TOKEN bearer token.
+
+``apply()`` is the consumer (``manage.py sync_from``). It writes entries
+with the source's primary keys, so a replica starts from a copy of the
+source database and is not written to locally. It refreshes the rollups
+and search index of the studies it touched, and bumps the data version.
+"""
+import contextlib
+import datetime
+
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+
+from . import caching, rollups, search, synthetic
+from .models import CariesData, ChangeLogEntry, DataExtractionNote, DentalCariesStudy
+
+
+MODELS = {'study': DentalCariesStudy, 'stratum': CariesData}
+MODEL_NAMES = {model: name for name, model in MODELS.items()}
+
+# Left out of the log: derived columns rebuilt on every instance
+IGNORED_FIELDS = {'search_vector'}
+# Logged with a change but never a change on their own
+TIMESTAMP_FIELDS = {'created_at', 'updated_at'}
+
+DEFAULT_LIMIT = 500
+MAX_LIMIT = 5000
+# Largest id of the BigAutoField, and so the largest valid ?since= cursor
+MAX_CURSOR = 2 ** 63 - 1
+
+
+def tracked_fields(model):
+    """Attribute names of the logged columns (foreign keys as ``<name>_id``)"""
+    return [
+        field.attname for field in model._meta.concrete_fields
+        if not field.primary_key and field.name not in IGNORED_FIELDS
+    ]
+
+
+def row(instance):
+    return {name: getattr(instance, name) for name in tracked_fields(type(instance))}
+
+
+def logged(queryset):
+    """``queryset`` without synthetic studies and their strata"""
+    if queryset.model is DentalCariesStudy:
+        return queryset.exclude(study_id__startswith=synthetic.PREFIX)
+    return queryset.exclude(study__study_id__startswith=synthetic.PREFIX)
+
+
+def is_logged(instance):
+    study = instance if isinstance(instance, DentalCariesStudy) else instance.study
+    return not study.study_id.startswith(synthetic.PREFIX)
+
+
+def snapshot(queryset):
+    """{pk: row} of the logged columns of every row in ``queryset``"""
+    names = tracked_fields(queryset.model)
+    return {values.pop('id'): values for values in queryset.order_by().values('id', *names)}
+
+
+def entry(model, pk, before, after):
+    """Unsaved ChangeLogEntry turning row ``before`` into ``after`` (None for a missing row), or None if unchanged"""
+    name = MODEL_NAMES[model]
+    if before is None and after is None:
+        return None
+    if before is None:
+        return ChangeLogEntry(model=name, object_id=pk, action='insert', data=after)
+    if after is None:
+        return ChangeLogEntry(model=name, object_id=pk, action='delete', data={}, previous=before)
+    changed = [key for key, value in after.items() if key not in TIMESTAMP_FIELDS and before.get(key) != value]
+    if not changed:
+        return None
+    data = {key: after[key] for key in changed}
+    if 'updated_at' in after:
+        data['updated_at'] = after['updated_at']
+    return ChangeLogEntry(
+        model=name, object_id=pk, action='update', data=data, previous={key: before.get(key) for key in changed}
+    )
+
+
+def diff(model, before, after):
+    """Entries for the rows that were inserted, updated or deleted between two snapshots"""
+    entries = [entry(model, pk, before.get(pk), after.get(pk)) for pk in sorted(before.keys() | after.keys())]
+    return [item for item in entries if item is not None]
+
+
+@contextlib.contextmanager
+def capture(*querysets):
+    """Log every change the enclosed bulk writes make to the rows of ``querysets``
+
+    Each queryset must select the affected rows both before and after the
+    writes (e.g. by natural key or pk). Inserts and updates are logged in
+    argument order, and deletes in reverse order. Pass studies before their
+    strata, so a replica always sees a parent before its children and the
+    children deleted before the parent.
+    """
+    querysets = [logged(queryset) for queryset in querysets]
+    before = [snapshot(queryset) for queryset in querysets]
+    yield
+    after = [snapshot(queryset) for queryset in querysets]
+    entries, deletes = [], []
+    for queryset, old, new in zip(querysets, before, after):
+        changes = diff(queryset.model, old, new)
+        entries += [item for item in changes if item.action != 'delete']
+        deletes.insert(0, [item for item in changes if item.action == 'delete'])
+    entries += [item for group in deletes for item in group]
+    ChangeLogEntry.objects.bulk_create(entries, batch_size=1000)
+
+
+def remember(instance):
+    """Stored row of ``instance`` before a save (pre_save), for the update diff"""
+    model = type(instance)
+    instance._logged_row = snapshot(model.objects.filter(pk=instance.pk)).get(instance.pk) if instance.pk else None
+
+
+def log_save(instance, created):
+    """Log a save (post_save)"""
+    before = None if created else getattr(instance, '_logged_row', None)
+    if (before is None and not created) or not is_logged(instance):
+        return
+    item = entry(type(instance), instance.pk, before, row(instance))
+    if item is not None:
+        item.save()
+
+
+def log_delete(instance):
+    """Log a delete (post_delete)"""
+    if not is_logged(instance):
+        return
+    ChangeLogEntry.objects.create(
+        model=MODEL_NAMES[type(instance)], object_id=instance.pk, action='delete', data={}, previous=row(instance)
+    )
+
+
+def feed(since=0, limit=DEFAULT_LIMIT):
+    """Settled entries after cursor ``since`` as feed dicts, and whether another full page follows
+
+    Entries are returned in id order up to the first one younger than
+    CHANGES_SETTLE_SECONDS. The reader therefore never moves past an id
+    whose transaction may still be committing.
+    """
+    settle = datetime.timedelta(seconds=getattr(settings, 'CHANGES_SETTLE_SECONDS', 5))
+    cutoff = timezone.now() - settle
+    rows = list(ChangeLogEntry.objects.filter(pk__gt=since).order_by('pk').values(
+        'id', 'model', 'object_id', 'action', 'data', 'previous', 'created_at'
+    )[:limit + 1])
+    settled = []
+    for values in rows[:limit]:
+        if values['created_at'] > cutoff:
+            break
+        settled.append(values)
+    # A page cut short by an unsettled entry is not "more": the reader polls again later
+    return settled, len(settled) == limit and len(rows) > limit
+
+
+def _decode(model, data):
+    """Feed JSON values back to Python values of the model fields"""
+    return {name: model._meta.get_field(name).to_python(value) for name, value in data.items()}
+
+
+def apply(entries):
+    """Apply feed entries to this database; returns the number applied
+
+    Raises ValueError for an update of a row this database does not have,
+    which means the replica was not started from a copy of the source.
+    """
+    strata_pks = [item['object_id'] for item in entries if item['model'] == 'stratum']
+    study_pks = {item['object_id'] for item in entries if item['model'] == 'study'}
+    study_pks |= set(CariesData.objects.filter(pk__in=strata_pks).values_list('study_id', flat=True))
+    for item in entries:
+        if item['model'] == 'stratum':
+            study_pks.update(
+                values['study_id'] for values in (item['data'], item['previous'] or {}) if 'study_id' in values
+            )
+
+    with transaction.atomic():
+        cells = rollups.study_cells(study_pks)
+        deleted = set()
+        for item in entries:
+            model = MODELS[item['model']]
+            pk = item['object_id']
+            # Raw writes: the source already logged these, and derived tables are refreshed below
+            if item['action'] == 'delete':
+                if model is DentalCariesStudy:
+                    # Notes are not in the log; they go with their study, as in the source's cascade
+                    DataExtractionNote.objects.filter(study_id=pk)._raw_delete(DataExtractionNote.objects.db)
+                    deleted.add(pk)
+                model.objects.filter(pk=pk)._raw_delete(model.objects.db)
+                continue
+            fields = _decode(model, item['data'])
+            if model.objects.filter(pk=pk).update(**fields):
+                continue
+            if item['action'] != 'insert':
+                raise ValueError(
+                    f"Entry {item['id']} updates {item['model']} {pk}, which this database does not have; "
+                    "start the replica from a copy of the source database"
+                )
+            model.objects.bulk_create([model(pk=pk, **fields)])
+            # bulk_create stamps auto_now(_add) fields with the current time; keep the source's
+            model.objects.filter(pk=pk).update(**{name: fields[name] for name in TIMESTAMP_FIELDS if name in fields})
+            if model is DentalCariesStudy:
+                deleted.discard(pk)
+        rollups.schedule_refresh(*cells, *rollups.study_cells(study_pks))
+        backend = search.get_backend()
+        if deleted:
+            backend.remove(list(deleted))
+        if study_pks - deleted:
+            backend.index(list(study_pks - deleted))
+        transaction.on_commit(caching.bump_data_version)
+    return len(entries)
@@ -0,0 +1,187 @@
+"""Compositional analysis of the decayed / missing / filled parts of dmft/DMFT
+
+Each stratum's mean D, M and F form a 3-part composition. Everything is
+computed on whole arrays: closure, multiplicative zero replacement
+(Martín-Fernández et al. 2003), and ilr coordinates on a sequential binary
+partition. The first balance sets untreated (D, M) against filled teeth. The
+second sets decayed against missing. Group summaries average the ilr
+coordinates and map the mean back, which gives the closed geometric mean
+composition. The care index F / (D + M + F) x 100 is derived from the same
+parts.
+
+Strata need D and F. An unreported M (indices without a missing component)
+counts as zero and goes through zero replacement with the other zeros.
+"""
+import hashlib
+
+import numpy as np
+from django.core.cache import cache
+
+from . import analytics, caching, meta
+
+
+PARTS = ('mean_decayed', 'mean_missing', 'mean_filled')
+PART_NAMES = ('decayed', 'missing', 'filled')
+BALANCES = ('untreated_vs_filled', 'decayed_vs_missing')
+
+# Orthonormal ilr basis (parts x balances) from the partition (D, M | F), then (D | M)
+ILR_BASIS = np.array([
+    [1 / np.sqrt(6), 1 / np.sqrt(2)],
+    [1 / np.sqrt(6), -1 / np.sqrt(2)],
+    [-2 / np.sqrt(6), 0.0],
+])
+
+# Zeros are replaced by this share of the composition (below any reported part)
+ZERO_SHARE = 0.005
+
+
+def components(strata):
+    """(strata x 3) array of mean D, M, F and a mask of strata with a usable composition"""
+    columns = strata.columns
+    parts = np.stack([columns[name] for name in PARTS], axis=1).astype(np.float64)
+    parts[:, 1] = np.where(np.isnan(parts[:, 1]), 0.0, parts[:, 1])
+    valid = np.isfinite(parts).all(axis=1) & (parts >= 0).all(axis=1) & (parts.sum(axis=1) > 0)
+    return parts, valid
+
+
+def closure(parts):
+    """Rescale each row to sum to 1"""
+    return parts / parts.sum(axis=-1, keepdims=True)
+
+
+def care_index(parts):
+    """F / (D + M + F) x 100 per row; NaN where the total is zero or a part is missing"""
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return np.where(parts.sum(axis=-1) > 0, parts[..., 2] / parts.sum(axis=-1) * 100, np.nan)
+
+
+def replace_zeros(parts, share=ZERO_SHARE):
+    """Multiplicative replacement: zeros become ``share``, the other parts shrink to keep the total 1"""
+    composition = closure(parts)
+    zeros = composition <= 0
+    scale = 1 - share * zeros.sum(axis=-1, keepdims=True)
+    return np.where(zeros, share, composition * scale)
+
+
+def clr(composition):
+    logs = np.log(composition)
+    return logs - logs.mean(axis=-1, keepdims=True)
+
+
+def ilr(composition):
+    """ilr coordinates (rows x 2) of strictly positive compositions"""
+    return clr(composition) @ ILR_BASIS
+
+
+def ilr_inverse(coordinates):
+    """Compositions (rows x 3) from ilr coordinates"""
+    return closure(np.exp(coordinates @ ILR_BASIS.T))
+
+
+def stratum_compositions(strata):
+    """Per-stratum zero-replaced composition, ilr coordinates and care index (NaN where unusable)"""
+    parts, valid = components(strata)
+    composition = np.full(parts.shape, np.nan)
+    composition[valid] = replace_zeros(parts[valid])
+    coordinates = np.full((len(parts), len(BALANCES)), np.nan)
+    coordinates[valid] = ilr(composition[valid])
+    return {
+        'parts': parts,
+        'valid': valid,
+        'composition': composition,
+        'ilr': coordinates,
+        'care_index': np.where(valid, care_index(parts), np.nan),
+    }
+
+
+def summarize(groups, derived):
+    """Per-group compositional centre, ilr means and SDs and care index for an analytics.GroupBy
+
+    The centre and ilr moments weight strata by ``sample_size_group``. The care
+    index pools the parts as total F over total D + M + F across participants.
+    """
+    valid = derived['valid'][groups.mask]
+    n = np.where(valid, groups.values('sample_size_group').astype(np.float64), 0.0)
+    coordinates = np.where(valid[:, None], derived['ilr'][groups.mask], 0.0)
+    parts = np.where(valid[:, None], derived['parts'][groups.mask], 0.0)
+
+    def total(weights):
+        return np.bincount(groups.inverse, weights=weights, minlength=groups.size)
+
+    weight = total(n)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        means = np.stack([total(n * coordinates[:, j]) / weight for j in range(len(BALANCES))], axis=1)
+        variances = np.stack([
+            total(n * (coordinates[:, j] - means[groups.inverse, j]) ** 2) / weight
+            for j in range(len(BALANCES))
+        ], axis=1)
+        pooled_parts = np.stack([total(n * parts[:, j]) for j in range(3)], axis=1)
+        centre = ilr_inverse(np.nan_to_num(means)) * 100
+
+    empty = weight == 0
+    result = {
+        f'{name}_share': np.where(empty, np.nan, centre[:, j]) for j, name in enumerate(PART_NAMES)
+    }
+    for j, name in enumerate(BALANCES):
+        result[f'ilr_{name}'] = np.where(empty, np.nan, means[:, j])
+        result[f'ilr_{name}_sd'] = np.where(empty, np.nan, np.sqrt(variances[:, j]))
+    result['care_index'] = np.where(empty, np.nan, care_index(pooled_parts))
+    result['strata'] = total(valid.astype(np.float64)).astype(np.int64)
+    result['participants'] = weight.astype(np.int64)
+    return result
+
+
+def composition_table(by=('province',), harmonize=None):
+    """Compositional summary rows per group, memoized per data version; raises ValueError
+
+    ``harmonize`` keeps the strata a crosswalk can convert to that caries
+    index, with their parts rescaled to the converted total.
+    """
+    by = tuple(by)
+    unknown = [name for name in by if name not in meta.GROUP_FIELDS]
+    if unknown or not by:
+        raise ValueError(f"by must be a comma-separated subset of: {', '.join(meta.GROUP_FIELDS)}")
+    frame = analytics.frame(harmonize)
+    key = f"compositions:v{frame.version}:{hashlib.md5(str(by).encode()).hexdigest()}"
+    rows = cache.get(key)
+    if rows is None:
+        groups = frame.strata.group_by(*by)
+        derived = stratum_compositions(frame.strata)
+        rows = [row for row in groups.rows(**summarize(groups, derived)) if row['strata']]
+        cache.set(key, rows)
+    return rows
+
+
+def derive_care_index(batch_size=500):
+    """Set CariesData.care_index from D/M/F wherever the parts are reported; returns rows changed"""
+    from django.db import transaction
+    from django.utils import timezone
+
+    from . import changelog
+    from .models import CariesData
+
+    strata = analytics.frame().strata
+    derived = stratum_compositions(strata)
+    current = strata.columns['care_index']
+    computed = np.round(derived['care_index'], 2)
+    changed = derived['valid'] & ~np.isclose(current, computed, equal_nan=False)
+    ids = strata.columns['id'][changed]
+    now = timezone.now()
+    updates = [
+        CariesData(pk=int(pk), care_index=float(value), updated_at=now)
+        for pk, value in zip(ids, computed[changed])
+    ]
+    # bulk_update skips the save signals, so log the changes and bump the data version like the importer does
+    with transaction.atomic(), changelog.capture(CariesData.objects.filter(pk__in=[obj.pk for obj in updates])):
+        CariesData.objects.bulk_update(updates, ['care_index', 'updated_at'], batch_size=batch_size)
+    if updates:
+        caching.bump_data_version()
+    return len(updates)
+
+
+def stratum_care_index(decayed, missing, filled):
+    """Care index of one stratum, or None when D or F is not reported"""
+    if decayed is None or filled is None:
+        return None
+    total = decayed + (missing or 0) + filled
+    return round(filled / total * 100, 2) if total > 0 else None
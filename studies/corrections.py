@@ -0,0 +1,191 @@
+"""Batch edits: study verification, grid edits and CSV corrections of strata
+
+These paths write with ``update()`` / ``bulk_update()`` in a single
+transaction, so the model save signals do not run. Each function does what
+the signals would have done for the fields it writes: it derives the care
+index, refreshes the affected rollup cells and bumps the data version on
+commit.
+
+A corrections CSV has the ``stratum_id`` column of ``export_strata`` plus
+any of CORRECTABLE_FIELDS. Other columns (the study-level ones in an
+export) are ignored, so an edited export can be uploaded as it is. Empty
+cells mean NULL, as in the export. Rows are compared with the stored
+values, and only fields that differ are written.
+"""
+import csv
+import io
+import math
+from dataclasses import dataclass, field
+
+from django.core.exceptions import ValidationError
+from django.db import transaction
+from django.utils import timezone
+
+from . import caching, changelog, compositions, rollups
+from .models import CariesData, DentalCariesStudy
+
+
+# Study fields editable in the admin grid
+GRID_FIELDS = ['quality_score', 'risk_of_bias', 'verified_by', 'verification_date']
+
+# Stratum measurements a corrections CSV may change; the stratum's identity (study, sex, age, SES) may not
+CORRECTABLE_FIELDS = [
+    'sample_size_group', 'caries_prevalence', 'caries_prevalence_ci_lower', 'caries_prevalence_ci_upper',
+    'mean_dmft_DMFT', 'mean_dmft_DMFT_sd', 'mean_decayed', 'mean_missing', 'mean_filled', 'care_index',
+]
+KEY_COLUMN = 'stratum_id'
+
+
+@dataclass
+class Correction:
+    """Changed fields of one stratum: {field: (stored value, corrected value)}"""
+    pk: int
+    study_id: str
+    label: str
+    changes: dict = field(default_factory=dict)
+
+
+def _refresh(study_pks):
+    """Queue the rollup cells of ``study_pks`` and a data version bump for when the transaction commits"""
+    rollups.schedule_refresh(*rollups.study_cells(study_pks))
+    transaction.on_commit(caching.bump_data_version)
+
+
+def _by_pk(queryset):
+    """The rows of ``queryset`` by primary key, so they still match after their filtered fields change"""
+    return queryset.model.objects.filter(pk__in=list(queryset.values_list('pk', flat=True)))
+
+
+def verify_studies(queryset, verified_by, verification_date=None):
+    """Mark the studies in ``queryset`` verified by ``verified_by``; returns the number updated"""
+    with transaction.atomic():
+        queryset = _by_pk(queryset)
+        with changelog.capture(queryset):
+            count = queryset.update(
+                verified_by=verified_by,
+                verification_date=verification_date or timezone.localdate(),
+                updated_at=timezone.now(),
+            )
+        transaction.on_commit(caching.bump_data_version)
+    return count
+
+
+def clear_verification(queryset):
+    with transaction.atomic():
+        queryset = _by_pk(queryset)
+        with changelog.capture(queryset):
+            count = queryset.update(verified_by=None, verification_date=None, updated_at=timezone.now())
+        transaction.on_commit(caching.bump_data_version)
+    return count
+
+
+def update_studies(studies, fields):
+    """Write the grid-edited ``fields`` (a subset of GRID_FIELDS) of ``studies`` with one bulk_update"""
+    if not studies:
+        return 0
+    now = timezone.now()
+    for study in studies:
+        study.updated_at = now
+    changed = DentalCariesStudy.objects.filter(pk__in=[study.pk for study in studies])
+    with transaction.atomic(), changelog.capture(changed):
+        DentalCariesStudy.objects.bulk_update(studies, [*fields, 'updated_at'], batch_size=500)
+        # GRID_FIELDS feed no rollup or search column; only the cached API responses change
+        transaction.on_commit(caching.bump_data_version)
+    return len(studies)
+
+
+def _same(stored, value):
+    if isinstance(stored, float) and isinstance(value, float):
+        return math.isclose(stored, value, rel_tol=1e-9, abs_tol=1e-12)
+    return stored == value
+
+
+def read_corrections(handle):
+    """{stratum pk: {field: raw value}} from a corrections CSV; raises ValueError on a malformed file"""
+    reader = csv.DictReader(handle)
+    if not reader.fieldnames or KEY_COLUMN not in reader.fieldnames:
+        raise ValueError(f"The CSV needs a {KEY_COLUMN} column")
+    columns = [name for name in reader.fieldnames if name in CORRECTABLE_FIELDS]
+    if not columns:
+        raise ValueError(f"The CSV has none of the correctable columns: {', '.join(CORRECTABLE_FIELDS)}")
+    rows = {}
+    for number, row in enumerate(reader, start=2):
+        try:
+            pk = int(row[KEY_COLUMN])
+        except (TypeError, ValueError):
+            raise ValueError(f"Row {number}: {KEY_COLUMN} must be an integer")
+        if pk in rows:
+            raise ValueError(f"Row {number}: stratum {pk} appears more than once")
+        rows[pk] = {name: (row[name] or '').strip() for name in columns}
+    return rows
+
+
+def diff(rows):
+    """Corrections for the strata in ``rows`` whose values differ from the stored ones
+
+    Values are parsed and validated like the model fields. Raises
+    ValueError naming the stratum for an unknown id or an invalid value.
+    """
+    stored = CariesData.objects.select_related('study').in_bulk(list(rows))
+    missing = sorted(set(rows) - set(stored))
+    if missing:
+        raise ValueError(f"Unknown stratum_id: {', '.join(map(str, missing[:10]))}")
+    corrections = []
+    for pk, values in rows.items():
+        stratum = stored[pk]
+        correction = Correction(pk, stratum.study.study_id, f"{stratum.sex} {stratum.age_category}")
+        for name, raw in values.items():
+            model_field = CariesData._meta.get_field(name)
+            try:
+                value = model_field.to_python(raw) if raw != '' else None
+            except ValidationError as exc:
+                raise ValueError(f"Stratum {pk}, {name}: {'; '.join(exc.messages)}")
+            if not _same(getattr(stratum, name), value):
+                correction.changes[name] = (getattr(stratum, name), value)
+        if correction.changes:
+            for name, (_, value) in correction.changes.items():
+                setattr(stratum, name, value)
+            unchanged = [f.name for f in CariesData._meta.fields if f.name not in correction.changes]
+            try:
+                stratum.clean_fields(exclude=unchanged)
+            except ValidationError as exc:
+                raise ValueError(f"Stratum {pk}: {'; '.join(exc.messages)}")
+            corrections.append(correction)
+    return corrections
+
+
+def apply(corrections):
+    """Write ``corrections`` in one transaction, one bulk_update per set of changed fields; returns rows written"""
+    if not corrections:
+        return 0
+    stored = CariesData.objects.in_bulk([correction.pk for correction in corrections])
+    now = timezone.now()
+    groups = {}
+    for correction in corrections:
+        stratum = stored[correction.pk]
+        for name, (_, value) in correction.changes.items():
+            setattr(stratum, name, value)
+        fields = set(correction.changes)
+        # Derived from D/M/F like the pre_save signal; an entered care index only stands without them
+        derived = compositions.stratum_care_index(stratum.mean_decayed, stratum.mean_missing, stratum.mean_filled)
+        if derived is not None and derived != stratum.care_index:
+            stratum.care_index = derived
+            fields.add('care_index')
+        stratum.updated_at = now
+        groups.setdefault(tuple(sorted(fields)), []).append(stratum)
+    with transaction.atomic(), changelog.capture(CariesData.objects.filter(pk__in=list(stored))):
+        for fields, strata in groups.items():
+            CariesData.objects.bulk_update(strata, [*fields, 'updated_at'], batch_size=500)
+        _refresh({stratum.study_id for stratum in stored.values()})
+    return len(corrections)
+
+
+def apply_csv(text, dry_run=False):
+    """Diff a corrections CSV against the database and write the changes unless ``dry_run``
+
+    Returns the list of Correction; raises ValueError on a malformed file or value.
+    """
+    corrections = diff(read_corrections(io.StringIO(text)))
+    if not dry_run:
+        apply(corrections)
+    return corrections
@@ -0,0 +1,162 @@
+"""Crosswalks between caries indices, applied to the analytic arrays at query time
+
+Studies report dmft, DMFT, surface-level dmfs/DMFS or mixed-dentition
+indices under WHO or ICDAS criteria, so their raw means and prevalences are
+not comparable. A Crosswalk is a versioned set of linear rules (stored in the
+database and edited in the admin) that map an index, optionally under one
+examination criteria, onto a target index: prevalence on the logit scale,
+mean dmft/DMFT on its natural scale.
+
+``harmonize(frame, target)`` converts every stratum in one pass. Each
+stratum's (index, criteria) pair is looked up in a small rule table and the
+coefficients are applied as array operations. The sampling variance is
+propagated together with the uncertainty of the coefficients and the
+rule's residual SD. Strata already on the target index pass through
+unchanged unless a criteria-specific rule applies. Strata without a rule
+drop out of the outcome (NaN). The harmonized frame's version embeds the
+crosswalk version, so everything memoized on ``frame.version`` is cached
+per data version, crosswalk version and target.
+"""
+import threading
+from types import SimpleNamespace
+
+import numpy as np
+from django.core.exceptions import ValidationError
+from django.db import transaction
+from django.db.models import Max
+
+from . import analytics, caching, estimates, meta
+from .models import Crosswalk, CrosswalkRule, DentalCariesStudy
+
+
+INDICES = [code for code, _ in DentalCariesStudy._meta.get_field('caries_index_used').choices]
+COEFFICIENTS = ('intercept', 'slope', 'intercept_se', 'slope_se', 'covariance', 'residual_sd')
+IDENTITY = (0.0, 1.0, 0.0, 0.0, 0.0, 0.0)
+PARTS = ('mean_decayed', 'mean_missing', 'mean_filled')
+
+_active = {}
+_harmonized = {}
+_lock = threading.Lock()
+
+
+def active_crosswalk():
+    """Latest active Crosswalk and its rules, memoized per data version; (None, []) when there is none"""
+    version = caching.data_version()
+    if _active.get('data_version') != version:
+        crosswalk = Crosswalk.objects.filter(is_active=True).order_by('-version').first()
+        rules = list(crosswalk.rules.all()) if crosswalk else []
+        _active.update(data_version=version, crosswalk=crosswalk, rules=rules)
+    return _active['crosswalk'], _active['rules']
+
+
+def coefficient_arrays(strata, rules, outcome, target):
+    """(strata x 6) conversion coefficients to ``target`` and a mask of strata that can be converted
+
+    A rule for the stratum's exact criteria wins over a rule for any
+    criteria, which wins over the identity for strata already on ``target``.
+    """
+    index_labels = strata.labels['caries_index_used']
+    criteria_labels = strata.labels['examination_criteria']
+    # Rule table: row 0 is "no conversion", row 1 the identity, then one row per rule
+    table = [(np.nan,) * len(COEFFICIENTS), IDENTITY]
+    lookup = np.zeros((len(index_labels) or 1, len(criteria_labels) or 1), dtype=np.int64)
+    for i, index in enumerate(index_labels):
+        if index == target:
+            lookup[i, :] = 1
+    applicable = [rule for rule in rules if rule.outcome == outcome and rule.target_index == target]
+    # Criteria-specific rules are written last so they override the generic ones
+    for rule in sorted(applicable, key=lambda rule: bool(rule.source_criteria)):
+        if rule.source_index not in index_labels:
+            continue
+        table.append(tuple(getattr(rule, name) for name in COEFFICIENTS))
+        i = index_labels.index(rule.source_index)
+        if rule.source_criteria:
+            if rule.source_criteria in criteria_labels:
+                lookup[i, criteria_labels.index(rule.source_criteria)] = len(table) - 1
+        else:
+            lookup[i, :] = len(table) - 1
+    row = lookup[strata.columns['caries_index_used'], strata.columns['examination_criteria']] if len(strata) else \
+        np.zeros(0, dtype=np.int64)
+    return np.array(table)[row], row > 0
+
+
+def convert(values, variances, coefficients):
+    """Converted values and their variance: sampling error, coefficient uncertainty and residual SD
+
+    Returns (values, total variance, variance added by the conversion).
+    """
+    a, b, se_a, se_b, cov_ab, residual_sd = coefficients.T
+    converted = a + b * values
+    added = se_a ** 2 + values ** 2 * se_b ** 2 + 2 * values * cov_ab + se_b ** 2 * variances + residual_sd ** 2
+    return converted, b ** 2 * variances + added, added
+
+
+def harmonize(frame, target):
+    """Read-only view of ``frame`` with its strata outcomes converted to ``target`` by the active crosswalk
+
+    Raises ValueError for an unknown target or when no crosswalk is active.
+    """
+    if target not in INDICES:
+        raise ValueError(f"harmonize must be one of: {', '.join(INDICES)}")
+    crosswalk, rules = active_crosswalk()
+    if crosswalk is None:
+        raise ValueError("No active crosswalk; add one before harmonizing")
+    version = f"{frame.version}:cw{crosswalk.version}:{target}"
+    cached = _harmonized.get(target)
+    if cached is not None and cached.version == version:
+        return cached
+
+    with _lock:
+        strata = frame.strata
+        columns = dict(strata.columns)
+        n = columns['sample_size_group'].astype(np.float64)
+        with np.errstate(invalid='ignore', divide='ignore', over='ignore'):
+            # Mean dmft/DMFT: the SD column carries the propagated variance back to estimates/meta
+            coefficients, convertible = coefficient_arrays(strata, rules, 'dmft', target)
+            mean = columns['mean_dmft_DMFT']
+            converted, variance, _ = convert(mean, estimates.dmft_variance(strata), coefficients)
+            columns['mean_dmft_DMFT'] = np.where(convertible, converted, np.nan)
+            columns['mean_dmft_DMFT_sd'] = np.where(convertible, np.sqrt(variance * n), np.nan)
+            # D/M/F parts scale with their total, so compositions keep their shares
+            ratio = np.where(mean > 0, converted / mean, np.nan)
+            for part in PARTS:
+                columns[part] = np.where(convertible, columns[part] * ratio, np.nan)
+
+            # Prevalence on the logit scale; meta adds crosswalk_variance to the binomial variance
+            coefficients, convertible = coefficient_arrays(strata, rules, 'prevalence', target)
+            logit, sampling = meta._prevalence_effects(strata, 'logit')
+            converted, variance, added = convert(logit, sampling, coefficients)
+            half_width = estimates.Z_95 * np.sqrt(variance)
+            for name, value in (
+                ('caries_prevalence', converted),
+                ('caries_prevalence_ci_lower', converted - half_width),
+                ('caries_prevalence_ci_upper', converted + half_width),
+            ):
+                columns[name] = np.where(convertible, 100 / (1 + np.exp(-value)), np.nan)
+            columns['crosswalk_variance'] = np.where(convertible, added, 0.0)
+
+        table = analytics.Table(analytics.STRATUM_COLUMNS)
+        table.labels = strata.labels
+        table.columns = columns
+        harmonized = SimpleNamespace(
+            studies=frame.studies, strata=table, version=version, crosswalk=crosswalk.version, target=target,
+        )
+        _harmonized[target] = harmonized
+    return harmonized
+
+
+def create_crosswalk(name, rules, source='', description=''):
+    """New Crosswalk version from rule dicts (CrosswalkRule field names); raises ValueError on an invalid rule"""
+    with transaction.atomic():
+        version = (Crosswalk.objects.aggregate(last=Max('version'))['last'] or 0) + 1
+        crosswalk = Crosswalk.objects.create(version=version, name=name, source=source, description=description)
+        objects = []
+        for number, rule in enumerate(rules, start=1):
+            obj = CrosswalkRule(crosswalk=crosswalk, **rule)
+            try:
+                obj.full_clean()
+            except ValidationError as exc:
+                raise ValueError(f"Rule {number}: {'; '.join(exc.messages)}")
+            objects.append(obj)
+        CrosswalkRule.objects.bulk_create(objects)
+    return crosswalk
@@ -0,0 +1,115 @@
+"""Pooled (weighted) estimates of caries prevalence and mean dmft/DMFT per group
+
+Works on an analytics.GroupBy in one vectorized pass per grouping and returns
+two estimates per outcome, each with a standard error:
+
+- sample-size weighted: weights ``sample_size_group``, so a 40-child stratum
+  counts 1/1000th of a 40,000-child survey;
+- inverse-variance (fixed effect): weights 1/SE² of each stratum.
+
+Stratum variances come from the reported data: prevalence SEs from the 95% CI
+when present, otherwise the binomial variance; dmft SEs from
+``mean_dmft_DMFT_sd / sqrt(n)``, with a missing SD imputed from the median
+coefficient of variation of strata that report one.
+"""
+import numpy as np
+
+
+Z_95 = 1.959963984540054
+
+OUTCOMES = {
+    'prevalence': 'caries_prevalence',
+    'dmft': 'mean_dmft_DMFT',
+}
+
+
+def prevalence_variance(strata):
+    """Sampling variance of each stratum's prevalence (percentage scale)"""
+    columns = strata.columns
+    n = columns['sample_size_group'].astype(np.float64)
+    p = columns['caries_prevalence']
+    from_ci = ((columns['caries_prevalence_ci_upper'] - columns['caries_prevalence_ci_lower']) / (2 * Z_95)) ** 2
+    # Binomial variance with a half-case continuity correction so 0% / 100% strata keep finite weight
+    with np.errstate(invalid='ignore', divide='ignore'):
+        shrunk = (p / 100 * n + 0.5) / (n + 1) * 100
+        binomial = shrunk * (100 - shrunk) / n
+    return np.where(np.isnan(from_ci) | (from_ci <= 0), binomial, from_ci)
+
+
+def dmft_variance(strata):
+    """Sampling variance of each stratum's mean dmft/DMFT"""
+    columns = strata.columns
+    n = columns['sample_size_group'].astype(np.float64)
+    mean = columns['mean_dmft_DMFT']
+    sd = columns['mean_dmft_DMFT_sd']
+    with np.errstate(invalid='ignore', divide='ignore'):
+        cv = sd / mean
+    reported = cv[np.isfinite(cv) & (cv > 0)]
+    if len(reported):
+        sd = np.where(np.isnan(sd), mean * np.median(reported), sd)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return np.where(sd > 0, sd ** 2 / n, np.nan)
+
+
+VARIANCES = {
+    'prevalence': prevalence_variance,
+    'dmft': dmft_variance,
+}
+
+
+def _ratio(numerator, denominator):
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return np.where(denominator > 0, numerator / denominator, np.nan)
+
+
+def pooled(groups, outcome):
+    """Weighted means and SEs of ``outcome`` ('prevalence' or 'dmft') per group of ``groups``
+
+    Returns a dict of arrays aligned with ``groups.keys``: ``mean``/``se``
+    (sample-size weighted), ``iv_mean``/``iv_se`` (inverse-variance), the
+    number of strata contributing and their participants. The SEs use only
+    the strata with a variance, and are NaN for a group with none.
+    """
+    values = groups.values(OUTCOMES[outcome])
+    variance = VARIANCES[outcome](groups.table)[groups.mask]
+    n = groups.values('sample_size_group').astype(np.float64)
+
+    def total(weights):
+        return np.bincount(groups.inverse, weights=weights, minlength=groups.size)
+
+    has_value = ~np.isnan(values)
+    has_variance = has_value & np.isfinite(variance)
+    x = np.where(has_value, values, 0.0)
+    v = np.where(has_variance, variance, 0.0)
+    n = np.where(has_value, n, 0.0)
+
+    # Var(sum n_i x_i / sum n_i) = sum n_i^2 var_i / (sum n_i)^2, over the strata with a variance
+    participants = total(n)
+    mean = _ratio(total(n * x), participants)
+    se = _ratio(np.sqrt(total(n ** 2 * v)), total(np.where(has_variance, n, 0.0)))
+
+    w = np.where(v > 0, 1 / np.where(v > 0, v, 1.0), 0.0)
+    weight = total(w)
+    iv_mean = _ratio(total(w * x), weight)
+    iv_se = _ratio(np.ones(groups.size), np.sqrt(weight))
+
+    return {
+        'mean': mean,
+        'se': se,
+        'iv_mean': iv_mean,
+        'iv_se': iv_se,
+        'strata': total(has_value.astype(np.float64)).astype(np.int64),
+        'participants': participants.astype(np.int64),
+    }
+
+
+def estimate_columns(groups, outcomes=('prevalence', 'dmft')):
+    """Measures for GroupBy.rows(): ``avg_<outcome>`` (sample-size weighted) plus SEs and IV estimates"""
+    columns = {}
+    for outcome in outcomes:
+        result = pooled(groups, outcome)
+        columns[f'avg_{outcome}'] = result['mean']
+        columns[f'{outcome}_se'] = result['se']
+        columns[f'{outcome}_iv'] = result['iv_mean']
+        columns[f'{outcome}_iv_se'] = result['iv_se']
+    return columns
@@ -0,0 +1,175 @@
+"""Streaming export of the joined study x stratum table (CSV, Parquet, Arrow)
+
+Rows are read with a server-side cursor (``iterator(chunk_size=...)``) and
+encoded chunk by chunk, so memory use does not grow with the dataset.
+Parquet and Arrow output needs pyarrow.
+"""
+import csv
+
+from django.core.exceptions import ImproperlyConfigured
+
+from .models import CariesData
+
+
+DEFAULT_CHUNK_SIZE = 2000
+
+# (column name, ORM path from CariesData)
+EXPORT_COLUMNS = [
+    ('stratum_id', 'id'),
+    ('study_id', 'study__study_id'),
+    ('publication_year', 'study__publication_year'),
+    ('study_design', 'study__study_design'),
+    ('study_setting', 'study__study_setting'),
+    ('province', 'study__province'),
+    ('age_group', 'study__age_group'),
+    ('age_min', 'study__age_min'),
+    ('age_max', 'study__age_max'),
+    ('data_collection_start', 'study__data_collection_start'),
+    ('data_collection_end', 'study__data_collection_end'),
+    ('caries_index_used', 'study__caries_index_used'),
+    ('examination_criteria', 'study__examination_criteria'),
+    ('quality_score', 'study__quality_score'),
+    ('risk_of_bias', 'study__risk_of_bias'),
+    ('sex', 'sex'),
+    ('age_category', 'age_category'),
+    ('socioeconomic_status', 'socioeconomic_status'),
+    ('sample_size_group', 'sample_size_group'),
+    ('caries_prevalence', 'caries_prevalence'),
+    ('caries_prevalence_ci_lower', 'caries_prevalence_ci_lower'),
+    ('caries_prevalence_ci_upper', 'caries_prevalence_ci_upper'),
+    ('mean_dmft_DMFT', 'mean_dmft_DMFT'),
+    ('mean_dmft_DMFT_sd', 'mean_dmft_DMFT_sd'),
+    ('mean_decayed', 'mean_decayed'),
+    ('mean_missing', 'mean_missing'),
+    ('mean_filled', 'mean_filled'),
+    ('care_index', 'care_index'),
+]
+
+# format -> (content type, file extension)
+EXPORT_FORMATS = {
+    'csv': ('text/csv', 'csv'),
+    'parquet': ('application/vnd.apache.parquet', 'parquet'),
+    'arrow': ('application/vnd.apache.arrow.file', 'arrow'),
+}
+
+
+def export_rows(queryset=None, chunk_size=DEFAULT_CHUNK_SIZE):
+    """Yield export rows as tuples in EXPORT_COLUMNS order"""
+    if queryset is None:
+        queryset = CariesData.objects.all()
+    paths = [path for _, path in EXPORT_COLUMNS]
+    return queryset.values_list(*paths).order_by('id').iterator(chunk_size=chunk_size)
+
+
+class _Echo:
+    """File-like object whose write() hands the data straight back"""
+
+    def write(self, value):
+        return value
+
+
+def iter_csv(rows):
+    writer = csv.writer(_Echo())
+    yield writer.writerow([name for name, _ in EXPORT_COLUMNS])
+    for row in rows:
+        yield writer.writerow(row)
+
+
+class _Drain:
+    """Write-only sink that lets pyarrow writers be drained between batches"""
+
+    def __init__(self):
+        self.chunks = []
+        self.position = 0
+        self.closed = False
+
+    def write(self, data):
+        data = bytes(data)
+        self.chunks.append(data)
+        self.position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self.position
+
+    def flush(self):
+        pass
+
+    def close(self):
+        self.closed = True
+
+    def drain(self):
+        data, self.chunks = b''.join(self.chunks), []
+        return data
+
+
+def _pyarrow():
+    try:
+        import pyarrow
+        import pyarrow.parquet  # noqa: F401
+    except ImportError:
+        raise ImproperlyConfigured("Parquet and Arrow exports require the pyarrow package")
+    return pyarrow
+
+
+def _field(path):
+    """Model field at the end of an ORM path such as ``study__province``"""
+    model = CariesData
+    *relations, name = path.split('__')
+    for relation in relations:
+        model = model._meta.get_field(relation).related_model
+    return model._meta.get_field(name)
+
+
+def _schema(pa):
+    types = {
+        'AutoField': pa.int64(),
+        'BigAutoField': pa.int64(),
+        'IntegerField': pa.int32(),
+        'PositiveIntegerField': pa.int32(),
+        'FloatField': pa.float64(),
+        'DateField': pa.date32(),
+    }
+    return pa.schema([
+        (name, types.get(_field(path).get_internal_type(), pa.string()))
+        for name, path in EXPORT_COLUMNS
+    ])
+
+
+def iter_columnar(rows, fmt, batch_size=DEFAULT_CHUNK_SIZE):
+    """Yield Parquet (one row group per batch) or Arrow IPC file bytes"""
+    pa = _pyarrow()
+    schema = _schema(pa)
+    sink = _Drain()
+    if fmt == 'parquet':
+        writer = pa.parquet.ParquetWriter(sink, schema, compression='zstd')
+    else:
+        writer = pa.ipc.new_file(sink, schema)
+
+    def write(batch):
+        arrays = [pa.array(column, type=field.type) for column, field in zip(zip(*batch), schema)]
+        writer.write_table(pa.Table.from_arrays(arrays, schema=schema))
+
+    batch = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) >= batch_size:
+            write(batch)
+            batch = []
+            yield sink.drain()
+    if batch:
+        write(batch)
+    writer.close()
+    yield sink.drain()
+
+
+def iter_export(fmt, queryset=None, chunk_size=DEFAULT_CHUNK_SIZE):
+    """Byte/str chunks of the full export in ``fmt`` (one of EXPORT_FORMATS)"""
+    if fmt not in EXPORT_FORMATS:
+        raise ValueError(f"Unknown export format '{fmt}'")
+    rows = export_rows(queryset, chunk_size)
+    if fmt == 'csv':
+        return iter_csv(rows)
+    # Checked here rather than on the first next(), so callers can report a missing pyarrow
+    _pyarrow()
+    return iter_columnar(rows, fmt, chunk_size)
@@ -0,0 +1,59 @@
+"""Declared filter and sort spec for study listings
+
+Only these GET parameters reach the ORM. Sort keys are limited to non-null,
+indexed columns, and the filters line up with the composite indexes in
+DentalCariesStudy.Meta, so each list query is a single index range scan.
+"""
+
+# Accepted publication years for the year filters
+YEAR_RANGE = (1900, 2100)
+
+
+def year(value):
+    """Parse a year filter; raises ValueError for a non-integer or a year outside YEAR_RANGE"""
+    try:
+        parsed = int(value)
+    except ValueError:
+        parsed = None
+    if parsed is None or not YEAR_RANGE[0] <= parsed <= YEAR_RANGE[1]:
+        raise ValueError(f"must be a year from {YEAR_RANGE[0]} to {YEAR_RANGE[1]}")
+    return parsed
+
+
+# GET parameter -> (ORM lookup, value parser)
+STUDY_FILTERS = {
+    'province': ('province', str),
+    'age_group': ('age_group', str),
+    'caries_index': ('caries_index_used', str),
+    'year_from': ('publication_year__gte', year),
+    'year_to': ('publication_year__lte', year),
+}
+
+# Accepted ?sort= values (each also accepted with a leading '-')
+STUDY_SORTS = ['publication_year', 'study_id', 'province', 'age_group', 'caries_index_used']
+
+DEFAULT_STUDY_SORT = '-publication_year'
+
+
+def study_filters(params):
+    """ORM filter kwargs for the recognised parameters in ``params``
+
+    Raises ValueError naming the parameter when a value does not parse.
+    """
+    filters = {}
+    for name, (lookup, parse) in STUDY_FILTERS.items():
+        value = params.get(name)
+        if not value:
+            continue
+        try:
+            filters[lookup] = parse(value)
+        except ValueError as exc:
+            raise ValueError(f"{name} {exc}") from exc
+    return filters
+
+
+def study_ordering(value):
+    """Validated sort key, falling back to the default for anything not whitelisted"""
+    if value and value.lstrip('-') in STUDY_SORTS and value.count('-') <= 1:
+        return value
+    return DEFAULT_STUDY_SORT
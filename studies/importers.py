@@ -0,0 +1,509 @@
+"""Import the data extraction table (dmft_canada_DET.xlsx) into the study models"""
+import re
+from dataclasses import dataclass, field
+from datetime import date, datetime, timedelta
+
+from django.db import transaction
+
+from . import caching, changelog, compositions, rollups, search
+from .models import DentalCariesStudy, CariesData
+
+
+DET_SHEET = 'dmft_canada_DET'
+DESIGN_SHEET = 'Study design'
+
+MISSING_VALUES = {'', 'na', 'nr', 'n/a', '-'}
+
+PROVINCE_CODES = {
+    'alberta': 'AB',
+    'british columbia': 'BC',
+    'manitoba': 'MB',
+    'new brunswick': 'NB',
+    'newfoundland and labrador': 'NL',
+    'newfoundland': 'NL',
+    'nova scotia': 'NS',
+    'ontario': 'ON',
+    'prince edward island': 'PE',
+    'quebec': 'QC',
+    'saskatchewan': 'SK',
+    'northwest territories': 'NT',
+    'nunavut': 'NU',
+    'yukon': 'YT',
+    'canada': 'national',
+}
+
+SEX_VALUES = {
+    'both': 'mixed',
+    'all': 'mixed',
+    'mixed': 'mixed',
+    'male': 'male',
+    'men': 'male',
+    'boys': 'male',
+    'female': 'female',
+    'women': 'female',
+    'girls': 'female',
+}
+
+DESIGN_VALUES = {
+    'cross-sectional': 'cross_sectional',
+    'cross sectional': 'cross_sectional',
+    'longitudinal': 'longitudinal',
+    'cohort': 'cohort',
+    'case-control': 'case_control',
+    'rct': 'randomized_trial',
+    'randomized controlled trial': 'randomized_trial',
+}
+
+# DET column groups in order of preference: (index, mean, sd, decayed, missing, filled)
+INDEX_COLUMNS = [
+    ('dmft_DMFT', 'dmft/DMFT_mean', 'dmft/DMFT_sd', 'DT/dt_mean', None, 'FT/ft_mean'),
+    ('dmft', 'dmft_dec_mean', 'dmft_dec_sd', 'd_dec_mean', 'm_dec_mean', 'f_dec_mean'),
+    ('DMFT', 'DMFT_per_mean', 'DMFT_per_sd', 'D_per_mean', 'M_per_mean', 'F_per_mean'),
+    ('dmfs', 'dmfs_dec_mean', 'dmfs_dec_sd', 'ds_mean', 'ms_mean', 'fs_mean'),
+    ('DMFS', 'DMFS_per_mean', 'DMFS_per_sd', 'DS_mean', 'MS_mean', 'FS_mean'),
+]
+
+# Tooth and surface indices; a study's strata must all count the same unit
+TOOTH_INDICES = {'dmft', 'DMFT', 'dmft_DMFT'}
+SURFACE_INDICES = {'dmfs', 'DMFS'}
+
+# DET mean columns of indices the models have no code for (not comparable with dmft/DMFT
+# without a crosswalk); a row reporting only these is skipped with its own reason
+UNSUPPORTED_INDEX_COLUMNS = [
+    ('deft', 'deft_dec_mean'),
+    ('defs', 'defs_dec_mean'),
+    ('DFT', 'DFT_mean'),
+    ('dfs', 'dfs_mean'),
+    ('DFT/dft', 'DFT/dft_mean'),
+]
+
+# DET prevalence columns: (column, stored as caries-free proportion)
+PREVALENCE_COLUMNS = [
+    ('p_cariesmixed', False),
+    ('p_cariesdecidious', False),
+    ('p_cariespermanent', False),
+    ('p_cariesfreetotal', True),
+    ('p_cariesfreedecidious', True),
+    ('p_cariesfreepermanent', True),
+]
+
+STUDY_UPDATE_FIELDS = [
+    'title', 'authors', 'publication_year', 'study_design', 'study_setting',
+    'province', 'city_region', 'sample_size', 'age_group', 'age_min', 'age_max',
+    'data_collection_start', 'data_collection_end', 'caries_index_used',
+    'examination_criteria', 'extracted_by', 'updated_at',
+]
+
+CARIES_UPDATE_FIELDS = [
+    'sample_size_group', 'caries_prevalence', 'mean_dmft_DMFT', 'mean_dmft_DMFT_sd',
+    'mean_decayed', 'mean_missing', 'mean_filled', 'care_index', 'updated_at',
+]
+
+
+class RowError(ValueError):
+    """Raised when a DET row cannot be mapped onto the study models"""
+
+
+@dataclass
+class StudySummary:
+    """Study-level fields accumulated over all DET rows of one study"""
+    study_id: str
+    title: str
+    authors: str
+    publication_year: int
+    province: str
+    city_region: str = None
+    study_design: str = 'cross_sectional'
+    design_sample_size: int = None
+    row_sample_size: int = 0
+    age_min: float = None
+    age_max: float = None
+    data_collection_start: date = None
+    data_collection_end: date = None
+    indices: set = field(default_factory=set)
+    strata: set = field(default_factory=set)
+
+    def add_row(self, stratum):
+        self.row_sample_size = max(self.row_sample_size, stratum['sample_size_group'])
+        self.age_min = _min(self.age_min, stratum['age_min'])
+        self.age_max = _max(self.age_max, stratum['age_max'])
+        self.data_collection_start = _min(self.data_collection_start, stratum['start'])
+        self.data_collection_end = _max(self.data_collection_end, stratum['end'])
+        self.indices.add(stratum['index'])
+        if self.province != stratum['province']:
+            self.province = 'national'
+
+    @property
+    def age_group(self):
+        if self.age_max <= 5:
+            return 'preschool'
+        if self.age_min >= 6 and self.age_max <= 12:
+            return 'school_age'
+        if self.age_min >= 13 and self.age_max <= 18:
+            return 'adolescent'
+        if self.age_min >= 19 and self.age_max < 65:
+            return 'adult'
+        if self.age_min >= 65:
+            return 'elderly'
+        return 'mixed'
+
+    @property
+    def caries_index_used(self):
+        if len(self.indices) == 1:
+            return next(iter(self.indices))
+        if self.indices <= TOOTH_INDICES:
+            return 'dmft_DMFT'
+        if self.indices <= SURFACE_INDICES:
+            return 'dmfs_DMFS'
+        return 'other'
+
+    def as_model(self, extracted_by):
+        return DentalCariesStudy(
+            study_id=self.study_id,
+            title=self.title,
+            authors=self.authors,
+            publication_year=self.publication_year,
+            study_design=self.study_design,
+            study_setting='other',
+            province=self.province,
+            city_region=self.city_region,
+            sample_size=self.design_sample_size or self.row_sample_size,
+            age_group=self.age_group,
+            age_min=self.age_min,
+            age_max=self.age_max,
+            data_collection_start=self.data_collection_start,
+            data_collection_end=self.data_collection_end,
+            caries_index_used=self.caries_index_used,
+            examination_criteria='other',
+            extracted_by=extracted_by,
+        )
+
+
+@dataclass
+class ImportResult:
+    """Counters and per-row errors collected during an import"""
+    rows_read: int = 0
+    rows_imported: int = 0
+    studies: int = 0
+    chunks: int = 0
+    errors: list = field(default_factory=list)
+
+
+def _min(current, value):
+    if value is None:
+        return current
+    return value if current is None else min(current, value)
+
+
+def _max(current, value):
+    if value is None:
+        return current
+    return value if current is None else max(current, value)
+
+
+def _clean(value):
+    """Normalise a raw cell value, mapping the DET's NA/NR markers to None"""
+    if isinstance(value, str):
+        value = value.strip()
+        if value.lower() in MISSING_VALUES:
+            return None
+    return value
+
+
+def _float(value, column):
+    value = _clean(value)
+    if value is None:
+        return None
+    if isinstance(value, str):
+        value = value.rstrip('%+ ')
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        raise RowError(f"{column}: '{value}' is not a number")
+
+
+def _date(value, column, end=False):
+    """Parse a DET date cell: a real date, an Excel serial number or a bare year"""
+    value = _clean(value)
+    if value is None:
+        return None
+    if isinstance(value, datetime):
+        return value.date()
+    if isinstance(value, date):
+        return value
+    number = _float(value, column)
+    if 1900 <= number <= 2100:
+        return date(int(number), 12, 31) if end else date(int(number), 1, 1)
+    if number > 2100:
+        return date(1899, 12, 30) + timedelta(days=int(number))
+    raise RowError(f"{column}: '{value}' is not a date")
+
+
+def _row_index(row):
+    """(index, mean column, sd, decayed, missing, filled) of the preferred mean a DET row reports, or None"""
+    for columns in INDEX_COLUMNS:
+        if _float(row.get(columns[1]), columns[1]) is not None:
+            return columns
+    return None
+
+
+def _age_label(age_min, age_max):
+    if age_min is None and age_max is None:
+        return 'All ages'
+    if age_min is None or age_max is None or age_min == age_max:
+        return f"{age_min if age_min is not None else age_max:g} years"
+    return f"{age_min:g}-{age_max:g} years"
+
+
+class DETImporter:
+    """Stream rows from the DET workbook and write them in chunked transactions"""
+
+    def __init__(self, path, chunk_size=500, dry_run=False, extracted_by='DET import', progress=None):
+        self.path = path
+        self.chunk_size = chunk_size
+        self.dry_run = dry_run
+        self.extracted_by = extracted_by
+        self.progress = progress  # called with (rows read, total rows) after each chunk
+        self.studies = {}
+        self.indices = {}  # study label -> indices its rows report, read before the first chunk
+        self.result = ImportResult()
+
+    def run(self):
+        from openpyxl import load_workbook
+
+        workbook = load_workbook(self.path, read_only=True, data_only=True)
+        try:
+            designs = self._read_designs(workbook)
+            sheet = workbook[DET_SHEET]
+            self.indices = self._read_indices(sheet)
+            total_rows = max((sheet.max_row or 1) - 1, 0)
+            rows = sheet.iter_rows(values_only=True)
+            header = [str(_clean(name) or '') for name in next(rows)]
+            columns = {name: position for position, name in enumerate(header) if name}
+
+            chunk = []
+            for row_number, values in enumerate(rows, start=2):
+                row = {name: values[position] for name, position in columns.items() if position < len(values)}
+                if not _clean(row.get('study')):
+                    continue
+                self.result.rows_read += 1
+                try:
+                    chunk.append(self._parse_row(row, designs))
+                except RowError as exc:
+                    self.result.errors.append((row_number, _clean(row.get('study')), str(exc)))
+                if len(chunk) >= self.chunk_size:
+                    self._flush(chunk)
+                    chunk = []
+                    if self.progress:
+                        self.progress(row_number - 1, total_rows)
+            if chunk:
+                self._flush(chunk)
+        finally:
+            workbook.close()
+
+        # bulk_create bypasses the post_save handlers that maintain derived tables
+        if not self.dry_run and self.result.rows_imported:
+            rollups.rebuild()
+            search.get_backend().rebuild()
+            caching.bump_data_version()
+
+        self.result.studies = len(self.studies)
+        return self.result
+
+    def _read_designs(self, workbook):
+        """Map study labels to (design, total n) from the small 'Study design' sheet"""
+        if DESIGN_SHEET not in workbook.sheetnames:
+            return {}
+        rows = workbook[DESIGN_SHEET].iter_rows(values_only=True)
+        header = [str(_clean(name) or '') for name in next(rows)]
+        designs = {}
+        for values in rows:
+            row = dict(zip(header, values))
+            label = _clean(row.get('study'))
+            if not label:
+                continue
+            design = DESIGN_VALUES.get(str(_clean(row.get('design')) or '').lower(), 'other')
+            try:
+                total = _float(row.get('n'), 'n')
+            except RowError:
+                total = None
+            designs[str(label)] = (design, int(total) if total else None)
+        return designs
+
+    def _read_indices(self, sheet):
+        """Map study labels to the indices of their rows, so a surface row is judged against the whole study"""
+        rows = sheet.iter_rows(values_only=True)
+        header = [str(_clean(name) or '') for name in next(rows)]
+        indices = {}
+        for values in rows:
+            row = dict(zip(header, values))
+            label = _clean(row.get('study'))
+            if not label:
+                continue
+            try:
+                columns = _row_index(row)
+            except RowError:
+                continue  # reported with its row number by _parse_row
+            if columns:
+                indices.setdefault(str(label), set()).add(columns[0])
+        return indices
+
+    def _parse_row(self, row, designs):
+        label = str(_clean(row['study']))
+        year = re.search(r'(19|20)\d{2}', label)
+        if not year:
+            raise RowError(f"study: cannot find a publication year in '{label}'")
+
+        province_name = str(_clean(row.get('province')) or '').lower()
+        if not province_name:
+            raise RowError("province: missing")
+        province = PROVINCE_CODES.get(province_name)
+        if province is None:
+            matches = {code for name, code in PROVINCE_CODES.items() if name in province_name}
+            province = matches.pop() if len(matches) == 1 else 'national'
+
+        sex = SEX_VALUES.get(str(_clean(row.get('sex')) or 'both').lower())
+        if sex is None:
+            raise RowError(f"sex: unknown value '{row.get('sex')}'")
+
+        sample_size = _float(row.get('n'), 'n')
+        if not sample_size:
+            raise RowError("n: sample size missing")
+
+        age_min = _float(row.get('age_start'), 'age_start')
+        age_max = _float(row.get('age_end'), 'age_end')
+        if age_min is None and age_max is None:
+            raise RowError("age_start/age_end: age range missing")
+
+        start = _date(row.get('date_start'), 'date_start')
+        end = _date(row.get('date_end'), 'date_end', end=True)
+        if start is None and end is None:
+            raise RowError("date_start/date_end: data collection period missing")
+
+        columns = _row_index(row)
+        if columns is None:
+            reported = [
+                index for index, column in UNSUPPORTED_INDEX_COLUMNS if _float(row.get(column), column) is not None
+            ]
+            if reported:
+                raise RowError(f"unsupported index: only {', '.join(reported)} reported")
+            raise RowError("no dmft/DMFT mean reported")
+        index, mean_column, sd_column, d_column, m_column, f_column = columns
+        mean = _float(row.get(mean_column), mean_column)
+        if index in SURFACE_INDICES and self.indices.get(label, set()) & TOOTH_INDICES:
+            # Surface counts cannot be pooled with the study's tooth counts, and no crosswalk splits a study
+            raise RowError(f"unsupported index: {index} (surfaces) in a study that reports tooth indices")
+
+        prevalence = None
+        for column, caries_free in PREVALENCE_COLUMNS:
+            prevalence = _float(row.get(column), column)
+            if prevalence is not None:
+                if caries_free:
+                    prevalence = 100 - prevalence
+                break
+        if prevalence is None:
+            raise RowError("no caries prevalence reported")
+        if not 0 <= prevalence <= 100:
+            raise RowError(f"caries prevalence {prevalence:g} is outside 0-100")
+
+        summary = self.studies.get(label)
+        if summary is None:
+            design, total = designs.get(label, ('cross_sectional', None))
+            summary = self.studies[label] = StudySummary(
+                study_id=label[:50],
+                title=label,
+                authors=label[:year.start()].strip() or label,
+                publication_year=int(year.group()),
+                province=province,
+                city_region=(str(_clean(row.get('district_city')) or '')[:200] or None),
+                study_design=design,
+                design_sample_size=total,
+            )
+
+        stratum = {
+            'study_id': summary.study_id,
+            'province': province,
+            'age_min': age_min if age_min is not None else age_max,
+            'age_max': age_max if age_max is not None else age_min,
+            'start': start or end,
+            'end': end or start,
+            'index': index,
+            'sample_size_group': int(sample_size),
+            'sex': sex,
+            'age_category': self._stratum_label(summary, row, sex, age_min, age_max, start, end),
+            'caries_prevalence': prevalence,
+            'mean_dmft_DMFT': mean,
+            'mean_dmft_DMFT_sd': _float(row.get(sd_column), sd_column),
+            'mean_decayed': _float(row.get(d_column), d_column),
+            'mean_missing': _float(row.get(m_column), m_column) if m_column else None,
+            'mean_filled': _float(row.get(f_column), f_column),
+        }
+        summary.add_row(stratum)
+        return stratum
+
+    def _stratum_label(self, summary, row, sex, age_min, age_max, start, end):
+        """Build a unique age_category, disambiguating repeated ages by group and period"""
+        age = _age_label(age_min, age_max)
+        group = _clean(row.get('group_details')) or _clean(row.get('group'))
+        period = '-'.join(sorted({str(d.year) for d in (start, end) if d}))
+        candidates = [age]
+        if group:
+            candidates.append(f"{age}, {group}")
+        candidates.append(f"{age}, {period}")
+        if group:
+            candidates.append(f"{age}, {period}, {group}")
+        candidates.extend(f"{age} ({number})" for number in range(2, len(summary.strata) + 3))
+        for candidate in candidates:
+            key = (sex, candidate[:50])
+            if key not in summary.strata:
+                summary.strata.add(key)
+                return candidate[:50]
+
+    def _flush(self, chunk):
+        """Upsert the chunk's studies and strata inside a single transaction"""
+        self.result.chunks += 1
+        if self.dry_run:
+            self.result.rows_imported += len(chunk)
+            return
+
+        labels = {stratum['study_id'] for stratum in chunk}
+        summaries = [summary for summary in self.studies.values() if summary.study_id in labels]
+        with transaction.atomic(), changelog.capture(
+            DentalCariesStudy.objects.filter(study_id__in=labels),
+            CariesData.objects.filter(study__study_id__in=labels),
+        ):
+            DentalCariesStudy.objects.bulk_create(
+                [summary.as_model(self.extracted_by) for summary in summaries],
+                update_conflicts=True,
+                unique_fields=['study_id'],
+                update_fields=STUDY_UPDATE_FIELDS,
+            )
+            study_pks = dict(
+                DentalCariesStudy.objects.filter(study_id__in=labels).values_list('study_id', 'pk')
+            )
+            CariesData.objects.bulk_create(
+                [
+                    CariesData(
+                        study_id=study_pks[stratum['study_id']],
+                        sex=stratum['sex'],
+                        age_category=stratum['age_category'],
+                        socioeconomic_status='not_specified',
+                        sample_size_group=stratum['sample_size_group'],
+                        caries_prevalence=stratum['caries_prevalence'],
+                        mean_dmft_DMFT=stratum['mean_dmft_DMFT'],
+                        mean_dmft_DMFT_sd=stratum['mean_dmft_DMFT_sd'],
+                        mean_decayed=stratum['mean_decayed'],
+                        mean_missing=stratum['mean_missing'],
+                        mean_filled=stratum['mean_filled'],
+                        care_index=compositions.stratum_care_index(
+                            stratum['mean_decayed'], stratum['mean_missing'], stratum['mean_filled']
+                        ),
+                    )
+                    for stratum in chunk
+                ],
+                batch_size=self.chunk_size,
+                update_conflicts=True,
+                unique_fields=['study', 'sex', 'age_category', 'socioeconomic_status'],
+                update_fields=CARIES_UPDATE_FIELDS,
+            )
+        self.result.rows_imported += len(chunk)
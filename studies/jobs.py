@@ -0,0 +1,431 @@
+"""Database-backed job queue for long-running analyses
+
+Jobs are rows of the ``jobs`` table. ``submit()`` returns at once with a
+queued Job, or with an existing one when a job with the same input hash is
+queued, running or completed, so identical requests share one run and its
+cached result. The input hash covers the task, its params and, for tasks that
+read the study data, a signature of that data.
+
+``manage.py run_workers`` starts worker processes. Each claims one job at a
+time with a conditional UPDATE, which is safe on PostgreSQL and SQLite alike.
+Tasks are functions registered with ``@task(name)``: they receive a
+JobContext plus the job's params as keyword arguments and return a
+JSON-serializable result. ``context.progress()`` records progress and raises
+JobCancelled when cancellation was requested. Cancellation is cooperative:
+a running task stops at its next progress() or check_cancelled() call, and
+once more when it returns, before the job is marked completed. The
+projection, import and sensitivity tasks report after every unit of work.
+A model fit or meta-analysis is one long call (the optimiser, one pooling
+pass), so a cancel requested during it takes effect, and discards the
+result, only when that call returns. Failed jobs are retried with
+exponential backoff up to ``max_attempts``. Jobs whose worker stopped sending
+heartbeats are requeued.
+"""
+import hashlib
+import inspect
+import json
+import logging
+import os
+import socket
+import threading
+import time
+from datetime import timedelta
+
+from django.db import DatabaseError, connection
+from django.db.models import Count, F, Max
+from django.utils import timezone
+
+from .models import CariesData, DentalCariesStudy, Job
+
+
+logger = logging.getLogger(__name__)
+
+RETRY_DELAY = 30  # seconds before the first retry, doubled after every failed attempt
+HEARTBEAT_INTERVAL = 10
+STALE_AFTER = 300  # seconds without a heartbeat before a running job is requeued
+POLL_INTERVAL = 2.0
+ACTIVE_STATUSES = ('queued', 'running', 'completed')
+
+# Bad input fails at once; anything else (database hiccups, killed workers) is retried
+PERMANENT_ERRORS = (ValueError, TypeError, LookupError, FileNotFoundError)
+
+TASKS = {}
+
+
+class JobCancelled(Exception):
+    """Raised inside a task when cancellation of its job was requested"""
+
+
+def task(name, reads_data=True, cacheable=True, validate=None, prepare=None):
+    """Register a task function under ``name``
+
+    ``reads_data`` tasks get the study data signature in their input hash.
+    Completed runs of ``cacheable`` tasks are reused by later submissions.
+    ``validate(params)`` may raise ValueError to reject a submission early.
+    ``prepare(params)`` runs once when a new job is queued and returns the
+    params to store, e.g. with the pk of a row the task works on, so that
+    retries reuse it instead of creating another.
+    """
+    def register(func):
+        TASKS[name] = {
+            'func': func, 'reads_data': reads_data, 'cacheable': cacheable, 'validate': validate, 'prepare': prepare,
+        }
+        return func
+    return register
+
+
+def data_signature():
+    """Cheap fingerprint of the study data: row counts and latest update times"""
+    parts = []
+    for model in (DentalCariesStudy, CariesData):
+        stats = model.objects.order_by().aggregate(count=Count('pk'), latest=Max('updated_at'))
+        parts.append(f"{stats['count']}:{stats['latest'].isoformat() if stats['latest'] else ''}")
+    return '|'.join(parts)
+
+
+def input_hash(task_name, params):
+    """Hash identifying a task run; changes when the params or (for data tasks) the data change"""
+    payload = {'task': task_name, 'params': params}
+    if TASKS[task_name]['reads_data']:
+        payload['data'] = data_signature()
+    return hashlib.sha256(json.dumps(payload, sort_keys=True, default=str).encode()).hexdigest()
+
+
+def submit(task_name, params=None, created_by='', max_attempts=3, force=False):
+    """Queue a job, or return a matching queued/running/completed one; returns (job, created)
+
+    Raises ValueError for an unknown task or params it does not accept.
+    """
+    if task_name not in TASKS:
+        raise ValueError(f"task must be one of: {', '.join(sorted(TASKS))}")
+    params = dict(params or {})
+    entry = TASKS[task_name]
+    try:
+        inspect.signature(entry['func']).bind(None, **params)
+    except TypeError as exc:
+        raise ValueError(f"Invalid params for {task_name}: {exc}")
+    if entry['validate']:
+        entry['validate'](params)
+
+    digest = input_hash(task_name, params)
+    if not force:
+        statuses = ACTIVE_STATUSES if entry['cacheable'] else ('queued', 'running')
+        existing = Job.objects.filter(
+            task=task_name, input_hash=digest, status__in=statuses
+        ).order_by('-created_at').first()
+        if existing:
+            return existing, False
+    if entry['prepare']:
+        params = entry['prepare'](params)
+    job = Job.objects.create(
+        task=task_name, params=params, input_hash=digest, max_attempts=max_attempts, created_by=created_by
+    )
+    return job, True
+
+
+def cancel(job):
+    """Cancel a queued job at once, or ask the worker running it to stop; returns the refreshed job"""
+    now = timezone.now()
+    if not Job.objects.filter(pk=job.pk, status='queued').update(
+        status='cancelled', cancel_requested=True, finished_at=now
+    ):
+        Job.objects.filter(pk=job.pk, status='running').update(cancel_requested=True)
+    job.refresh_from_db()
+    return job
+
+
+def retry(job):
+    """Requeue a failed or cancelled job with a fresh attempt budget"""
+    return Job.objects.filter(pk=job.pk, status__in=('failed', 'cancelled')).update(
+        status='queued', attempts=0, cancel_requested=False, error='', progress=0,
+        progress_message='', run_after=timezone.now(), finished_at=None,
+    )
+
+
+class JobContext:
+    """Handle a task uses to report progress and notice cancellation"""
+
+    def __init__(self, job):
+        self.job = job
+
+    @property
+    def params(self):
+        return self.job.params
+
+    def progress(self, fraction=None, message=''):
+        """Record progress (0-1) and a message; raises JobCancelled if cancellation was requested"""
+        fields = {'heartbeat_at': timezone.now()}
+        if fraction is not None:
+            fields['progress'] = min(max(float(fraction), 0.0), 1.0)
+        if message:
+            fields['progress_message'] = message[:255]
+        Job.objects.filter(pk=self.job.pk).update(**fields)
+        self.check_cancelled()
+
+    def check_cancelled(self):
+        if Job.objects.filter(pk=self.job.pk, cancel_requested=True).exists():
+            raise JobCancelled()
+
+
+class Heartbeat(threading.Thread):
+    """Keeps a running job's heartbeat fresh while a task computes without reporting progress"""
+
+    def __init__(self, job_id, interval=HEARTBEAT_INTERVAL):
+        super().__init__(daemon=True)
+        self.job_id = job_id
+        self.interval = interval
+        self.stopped = threading.Event()
+
+    def run(self):
+        try:
+            while not self.stopped.wait(self.interval):
+                try:
+                    Job.objects.filter(pk=self.job_id, status='running').update(heartbeat_at=timezone.now())
+                except DatabaseError:
+                    logger.warning("Heartbeat for job %s failed", self.job_id, exc_info=True)
+        finally:
+            connection.close()
+
+    def stop(self):
+        self.stopped.set()
+        self.join()
+
+
+def worker_name():
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+
+def requeue_stale(stale_after=STALE_AFTER):
+    """Requeue (or fail, once out of attempts) running jobs whose worker stopped heartbeating"""
+    cutoff = timezone.now() - timedelta(seconds=stale_after)
+    stale = Job.objects.filter(status='running', heartbeat_at__lt=cutoff)
+    failed = stale.filter(attempts__gte=F('max_attempts')).update(
+        status='failed', error="Worker stopped responding", finished_at=timezone.now()
+    )
+    requeued = stale.update(status='queued', worker='', run_after=timezone.now())
+    return requeued + failed
+
+
+def claim(worker):
+    """Atomically take the next due queued job for ``worker``, or return None"""
+    now = timezone.now()
+    candidates = Job.objects.filter(status='queued', run_after__lte=now).order_by('run_after', 'pk')
+    for pk in candidates.values_list('pk', flat=True)[:10]:
+        claimed = Job.objects.filter(pk=pk, status='queued').update(
+            status='running', worker=worker, started_at=now, heartbeat_at=now, attempts=F('attempts') + 1
+        )
+        if claimed:
+            return Job.objects.get(pk=pk)
+    return None
+
+
+def execute(job):
+    """Run a claimed job's task and record its outcome"""
+    entry = TASKS.get(job.task)
+    heartbeat = Heartbeat(job.pk)
+    heartbeat.start()
+    try:
+        if entry is None:
+            raise LookupError(f"Unknown task '{job.task}'")
+        context = JobContext(job)
+        context.check_cancelled()
+        result = entry['func'](context, **job.params)
+        context.check_cancelled()
+    except JobCancelled:
+        _finish(job, status='cancelled', error="Cancelled")
+    except Exception as exc:
+        logger.exception("Job %s (%s) failed on attempt %s", job.pk, job.task, job.attempts)
+        error = f"{exc.__class__.__name__}: {exc}"
+        if isinstance(exc, PERMANENT_ERRORS) or job.attempts >= job.max_attempts:
+            _finish(job, status='failed', error=error)
+        else:
+            delay = RETRY_DELAY * 2 ** (job.attempts - 1)
+            Job.objects.filter(pk=job.pk).update(
+                status='queued', error=error, worker='', run_after=timezone.now() + timedelta(seconds=delay)
+            )
+    else:
+        _finish(job, status='completed', result=result, progress=1.0)
+    finally:
+        heartbeat.stop()
+    job.refresh_from_db()
+    return job
+
+
+def _finish(job, **fields):
+    Job.objects.filter(pk=job.pk).update(finished_at=timezone.now(), **fields)
+
+
+def work(worker=None, once=False, poll_interval=POLL_INTERVAL, should_stop=lambda: False):
+    """Worker loop: claim and execute jobs until ``should_stop()``, or the queue is empty with ``once``"""
+    worker = worker or worker_name()
+    processed = 0
+    last_sweep = 0.0
+    while not should_stop():
+        if time.monotonic() - last_sweep > HEARTBEAT_INTERVAL:
+            requeue_stale()
+            last_sweep = time.monotonic()
+        job = claim(worker)
+        if job is None:
+            if once:
+                break
+            time.sleep(poll_interval)
+            continue
+        logger.info("Worker %s running job %s (%s)", worker, job.pk, job.task)
+        execute(job)
+        processed += 1
+    return processed
+
+
+def job_payload(job):
+    """JSON representation of a job for the status endpoints"""
+    return {
+        'id': job.pk,
+        'task': job.task,
+        'params': job.params,
+        'status': job.status,
+        'progress': job.progress,
+        'progress_message': job.progress_message,
+        'attempts': job.attempts,
+        'max_attempts': job.max_attempts,
+        'cancel_requested': job.cancel_requested,
+        'error': job.error,
+        'result': job.result if job.status == 'completed' else None,
+        'created_at': job.created_at.isoformat() if job.created_at else None,
+        'started_at': job.started_at.isoformat() if job.started_at else None,
+        'finished_at': job.finished_at.isoformat() if job.finished_at else None,
+    }
+
+
+# Tasks ---------------------------------------------------------------------
+
+def _validate_meta(params):
+    from . import crosswalks, meta
+
+    meta._validate(
+        tuple(params.get('by', meta.DEFAULT_GROUPING)), params.get('outcome', 'prevalence'),
+        params.get('method', 'reml'), params.get('transform', 'logit'),
+    )
+    if params.get('harmonize') and params['harmonize'] not in crosswalks.INDICES:
+        raise ValueError(f"harmonize must be one of: {', '.join(crosswalks.INDICES)}")
+
+
+@task('meta_analysis', validate=_validate_meta)
+def run_meta_analysis(context, by=None, outcome='prevalence', method='reml', transform='logit', harmonize=None):
+    from . import meta
+
+    context.progress(0.1, "Pooling strata")
+    return meta.meta_analysis(by or meta.DEFAULT_GROUPING, outcome, method, transform, harmonize)
+
+
+def _validate_spec(params):
+    from . import bayes
+
+    if 'model_fit' in params:
+        raise ValueError("model_fit is assigned when the job is queued")
+    bayes.ModelSpec.from_dict(params.get('spec'))
+
+
+def _queue_model_fit(params):
+    from . import bayes
+
+    model_fit = bayes.queue_fit(params.get('spec'), name=params.get('name', 'reference'))
+    return {**params, 'model_fit': model_fit.pk}
+
+
+@task('fit_model', validate=_validate_spec, prepare=_queue_model_fit)
+def run_fit_model(context, spec=None, name='reference', model_fit=None):
+    """Fit the ModelFit queued with the job; every attempt fits that same version
+
+    A cancelled job's fit stays queued, for ``manage.py fit_model --pending``.
+    """
+    from . import bayes
+    from .models import ModelFit
+
+    if model_fit is None:
+        raise ValueError("The job has no queued model fit")
+    model_fit = ModelFit.objects.get(pk=model_fit)
+    if model_fit.status == 'failed' or (model_fit.status == 'running' and context.job.attempts > 1):
+        # Left by an earlier attempt of this job (failed, or its worker died); fit it again
+        ModelFit.objects.filter(pk=model_fit.pk).update(status='queued', message='', started_at=None, finished_at=None)
+    context.progress(0.05, f"Fitting model version {model_fit.version}")
+    if not bayes.run_fit(model_fit):
+        # Claimed by ``fit_model --pending``; wait for that run instead of fitting twice
+        while ModelFit.objects.filter(pk=model_fit.pk, status='running').exists():
+            context.progress(message=f"Waiting for model version {model_fit.version}")
+            time.sleep(POLL_INTERVAL)
+    model_fit.refresh_from_db()
+    if model_fit.status != 'completed':
+        raise RuntimeError(model_fit.message or f"Model version {model_fit.version} did not complete")
+    return {
+        'version': model_fit.version,
+        'n_strata': model_fit.n_strata,
+        'dic': model_fit.dic,
+        'waic': model_fit.waic,
+        'message': model_fit.message,
+    }
+
+
+def _validate_projection(params):
+    from . import projections
+
+    if params.get('parameters') and len(params.get('scenarios') or []) != 1:
+        raise ValueError("parameters needs exactly one scenario")
+    for scenario in params.get('scenarios') or list(projections.SCENARIOS):
+        projections.scenario_parameters(scenario, params.get('parameters'))
+
+
+@task('project', validate=_validate_projection)
+def run_projections(context, version=None, scenarios=None, parameters=None, horizon=2050, trajectories=4000):
+    from . import bayes, projections
+    from .models import ModelFit
+
+    if version:
+        model_fit = ModelFit.objects.get(version=version, status='completed')
+    else:
+        model_fit = bayes.latest_fit()
+        if model_fit is None:
+            raise LookupError("No completed model fit")
+        model_fit.refresh_from_db()
+    scenarios = scenarios or list(projections.SCENARIOS)
+    for done, scenario in enumerate(scenarios):
+        context.progress(done / len(scenarios), f"Projecting '{scenario}'")
+        projections.run_projection(model_fit, scenario, parameters, horizon=horizon, trajectories=trajectories)
+    return {'version': model_fit.version, 'scenarios': scenarios, 'horizon': horizon}
+
+
+@task('import_det', reads_data=False, cacheable=False)
+def run_import(context, path, chunk_size=500, dry_run=False, extracted_by='DET import'):
+    from .importers import DETImporter
+
+    def progress(rows, total):
+        context.progress(rows / total if total else None, f"{rows} of {total} rows read")
+
+    result = DETImporter(
+        path, chunk_size=chunk_size, dry_run=dry_run, extracted_by=extracted_by, progress=progress
+    ).run()
+    return {
+        'rows_read': result.rows_read,
+        'rows_imported': result.rows_imported,
+        'studies': result.studies,
+        'chunks': result.chunks,
+        'errors': [list(error) for error in result.errors[:200]],
+        'error_count': len(result.errors),
+    }
+
+
+def _validate_grid(params):
+    from . import sensitivity
+
+    if params.get('grid') is not None:
+        sensitivity.expand_grid(params['grid'])
+
+
+@task('sensitivity', validate=_validate_grid)
+def run_sensitivity(context, grid=None, name='protocol', processes=None):
+    from . import sensitivity
+
+    def progress(done, total):
+        context.progress(done / total, f"{done} of {total} specifications fitted")
+
+    run = sensitivity.run_grid(grid, name=name, processes=processes, progress=progress)
+    return {'run': run.pk, 'n_specs': run.n_specs, 'elapsed': run.elapsed, 'message': run.message}
@@ -0,0 +1,23 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from studies import corrections
+
+
+class Command(BaseCommand):
+    help = "Apply a CSV of stratum corrections (stratum_id plus corrected columns), writing only changed fields"
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help="CSV with a stratum_id column, e.g. an edited export_strata file")
+        parser.add_argument('--dry-run', action='store_true', help="List the changes without writing them")
+
+    def handle(self, *args, **options):
+        try:
+            with open(options['path'], newline='', encoding='utf-8-sig') as handle:
+                changes = corrections.apply_csv(handle.read(), dry_run=options['dry_run'])
+        except (OSError, ValueError) as exc:
+            raise CommandError(f"Cannot apply corrections {options['path']}: {exc}")
+        for change in changes:
+            fields = ', '.join(f"{name} {old} -> {new}" for name, (old, new) in change.changes.items())
+            self.stdout.write(f"  {change.pk} ({change.study_id}, {change.label}): {fields}")
+        verb = "Would correct" if options['dry_run'] else "Corrected"
+        self.stdout.write(self.style.SUCCESS(f"{verb} {len(changes)} strata"))
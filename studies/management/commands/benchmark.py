@@ -0,0 +1,63 @@
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+
+from studies import benchmark
+
+
+class Command(BaseCommand):
+    help = "Measure p50/p95 latency and query counts of every studies URL and write the results as JSON"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--iterations', type=int, default=20, help="Timed requests per URL")
+        parser.add_argument('--warmup', type=int, default=1, help="Untimed requests per URL before timing")
+        parser.add_argument(
+            '--mode', choices=benchmark.MODES, default='warm',
+            help="warm: response caches stay valid; cold: bump the data version before every request"
+        )
+        parser.add_argument('--only', help="Comma-separated URL names to benchmark (default: all)")
+        parser.add_argument('--login', help="Username to log the test client in as")
+        parser.add_argument('--output', help="Write the JSON results to this file")
+        parser.add_argument('--compare', help="Baseline JSON file to compare the p95 latency against")
+
+    def handle(self, *args, **options):
+        names = [name.strip() for name in options['only'].split(',')] if options['only'] else None
+        try:
+            results = benchmark.run(
+                iterations=options['iterations'],
+                warmup=options['warmup'],
+                mode=options['mode'],
+                names=names,
+                username=options['login'],
+                progress=self.report,
+            )
+        except ValueError as exc:
+            raise CommandError(str(exc))
+        if results['errors']:
+            self.stderr.write(self.style.WARNING(
+                f"{len(results['errors'])} URLs answered with an error status and are not comparable: "
+                + ', '.join(f"{error['url']} ({error['status']})" for error in results['errors'])
+            ))
+
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                json.dump(results, f, indent=2)
+            self.stdout.write(self.style.SUCCESS(f"Wrote {len(results['results'])} results to {options['output']}"))
+
+        if options['compare']:
+            with open(options['compare']) as f:
+                baseline = json.load(f)
+            self.stdout.write(f"p95 against {options['compare']} ({baseline.get('commit')}, {baseline.get('database')}):")
+            for row in benchmark.compare(baseline, results):
+                ratio = f"{row['ratio']:.2f}x" if row['ratio'] is not None else "n/a"
+                self.stdout.write(
+                    f"  {row['url']}: {row['before']:.1f} -> {row['after']:.1f} ms ({ratio}), "
+                    f"queries {row['queries_before']} -> {row['queries_after']}"
+                )
+
+    def report(self, done, total, row):
+        line = (
+            f"  [{done}/{total}] {row['url']}: {row['status']}, p50 {row['p50_ms']:.1f} ms, "
+            f"p95 {row['p95_ms']:.1f} ms, {row['queries']} queries"
+        )
+        self.stdout.write(line if row['ok'] else self.style.ERROR(f"{line} (error page, not measured)"))
@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from studies import compositions
+
+
+class Command(BaseCommand):
+    help = "Derive care_index from the decayed/missing/filled components of every stratum that reports them"
+
+    def handle(self, *args, **options):
+        changed = compositions.derive_care_index()
+        self.stdout.write(self.style.SUCCESS(f"Updated care_index on {changed} strata"))
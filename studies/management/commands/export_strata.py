@@ -0,0 +1,39 @@
+from django.core.exceptions import ImproperlyConfigured
+from django.core.management.base import BaseCommand, CommandError
+
+from studies import export
+
+
+class Command(BaseCommand):
+    help = "Stream the joined study x stratum table to CSV, Parquet or Arrow for the INLA models"
+
+    def add_arguments(self, parser):
+        parser.add_argument('output', help="Destination file")
+        parser.add_argument(
+            '--format', choices=list(export.EXPORT_FORMATS),
+            help="Output format (defaults to the output file extension, else csv)"
+        )
+        parser.add_argument(
+            '--chunk-size', type=int, default=export.DEFAULT_CHUNK_SIZE,
+            help="Rows fetched per server-side cursor round trip and per columnar batch"
+        )
+
+    def handle(self, *args, **options):
+        if options['chunk_size'] < 1:
+            raise CommandError("--chunk-size must be a positive integer")
+        fmt = options['format'] or options['output'].rsplit('.', 1)[-1].lower()
+        if fmt not in export.EXPORT_FORMATS:
+            fmt = 'csv'
+
+        try:
+            chunks = export.iter_export(fmt, chunk_size=options['chunk_size'])
+            size = 0
+            with open(options['output'], 'wb') as handle:
+                for chunk in chunks:
+                    data = chunk.encode() if isinstance(chunk, str) else chunk
+                    handle.write(data)
+                    size += len(data)
+        except ImproperlyConfigured as exc:
+            raise CommandError(str(exc))
+
+        self.stdout.write(self.style.SUCCESS(f"Wrote {size} bytes of {fmt} to {options['output']}"))
@@ -0,0 +1,48 @@
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+
+from studies import bayes
+from studies.models import ModelFit
+
+
+class Command(BaseCommand):
+    help = "Fit the BYM2 + RW2 hierarchical model and store its posterior summaries as a new model version"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--spec', default='{}',
+            help="JSON object overriding the reference model specification, e.g. '{\"temporal\": \"rw1\"}'"
+        )
+        parser.add_argument('--name', default='reference', help="Name stored with the model version")
+        parser.add_argument(
+            '--pending', action='store_true',
+            help="Run fits already queued (e.g. from the admin) instead of queueing a new one; suited to cron"
+        )
+
+    def handle(self, *args, **options):
+        if options['pending']:
+            fits = list(ModelFit.objects.filter(status='queued').order_by('version'))
+            if not fits:
+                self.stdout.write("No queued model fits")
+        else:
+            try:
+                spec = json.loads(options['spec'])
+                fits = [bayes.queue_fit(spec, name=options['name'])]
+            except (ValueError, TypeError) as exc:
+                raise CommandError(f"Invalid --spec: {exc}")
+
+        for model_fit in fits:
+            self.stdout.write(f"Fitting model version {model_fit.version} ({model_fit.name})...")
+            try:
+                if not bayes.run_fit(model_fit):
+                    self.stdout.write(f"Version {model_fit.version} was claimed by another worker")
+                    continue
+            except Exception as exc:
+                self.stderr.write(self.style.ERROR(f"Version {model_fit.version} failed: {exc}"))
+                continue
+            model_fit.refresh_from_db()
+            self.stdout.write(self.style.SUCCESS(
+                f"Version {model_fit.version}: {model_fit.n_strata} strata, "
+                f"DIC {model_fit.dic:.1f}, WAIC {model_fit.waic:.1f}"
+            ))
@@ -0,0 +1,57 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from studies import synthetic
+from studies.models import DentalCariesStudy
+
+
+class Command(BaseCommand):
+    help = "Fill the database with synthetic studies, strata and extraction notes for benchmarking"
+
+    def add_arguments(self, parser):
+        size = parser.add_mutually_exclusive_group()
+        size.add_argument('--studies', type=int, help="Number of synthetic studies to create")
+        size.add_argument(
+            '--scale', type=float,
+            help="Create this multiple of the current number of real studies (e.g. 10, 100, 1000)"
+        )
+        parser.add_argument('--strata-per-study', type=float, default=4, help="Mean strata per study")
+        parser.add_argument('--notes-per-study', type=float, default=0.6, help="Mean extraction notes per study")
+        parser.add_argument('--seed', type=int, help="Random seed for a reproducible dataset")
+        parser.add_argument('--batch-size', type=int, default=2000, help="Studies written per transaction")
+        parser.add_argument('--clear', action='store_true', help="Delete existing synthetic studies first")
+
+    def handle(self, *args, **options):
+        if options['batch_size'] < 1 or options['strata_per_study'] < 1 or options['notes_per_study'] < 0:
+            raise CommandError("--batch-size and --strata-per-study must be at least 1, --notes-per-study at least 0")
+
+        if options['clear']:
+            removed = synthetic.clear()
+            self.stdout.write(f"Removed {removed} synthetic studies")
+
+        if options['studies'] is not None:
+            studies = options['studies']
+        elif options['scale'] is not None:
+            real = DentalCariesStudy.objects.exclude(study_id__startswith=synthetic.PREFIX).count()
+            studies = int(round(max(real, 1) * options['scale']))
+        elif options['clear']:
+            return
+        else:
+            raise CommandError("Pass --studies or --scale")
+        if studies < 0:
+            raise CommandError("The number of studies must not be negative")
+
+        started = time.perf_counter()
+        created, strata, notes = synthetic.generate(
+            studies,
+            strata_per_study=options['strata_per_study'],
+            notes_per_study=options['notes_per_study'],
+            seed=options['seed'],
+            batch_size=options['batch_size'],
+            progress=lambda done, total: self.stdout.write(f"  {done}/{total} studies"),
+        )
+        self.stdout.write(self.style.SUCCESS(
+            f"Created {created} studies, {strata} strata and {notes} notes "
+            f"in {time.perf_counter() - started:.1f}s"
+        ))
@@ -0,0 +1,50 @@
+import csv
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from studies.importers import DETImporter
+
+
+class Command(BaseCommand):
+    help = "Import studies and caries strata from the data extraction table (dmft_canada_DET.xlsx)"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'path', nargs='?', default=str(settings.BASE_DIR / 'dmft_canada_DET.xlsx'),
+            help="Path to the DET workbook (defaults to the bundled dmft_canada_DET.xlsx)"
+        )
+        parser.add_argument('--chunk-size', type=int, default=500, help="Rows validated and written per transaction")
+        parser.add_argument('--dry-run', action='store_true', help="Validate the workbook without writing to the database")
+        parser.add_argument('--extracted-by', default='DET import', help="Value stored in DentalCariesStudy.extracted_by")
+        parser.add_argument('--errors-csv', help="Write the per-row error report to this CSV file")
+
+    def handle(self, *args, **options):
+        if options['chunk_size'] < 1:
+            raise CommandError("--chunk-size must be a positive integer")
+
+        importer = DETImporter(
+            options['path'],
+            chunk_size=options['chunk_size'],
+            dry_run=options['dry_run'],
+            extracted_by=options['extracted_by'],
+        )
+        try:
+            result = importer.run()
+        except (FileNotFoundError, KeyError, StopIteration) as exc:
+            raise CommandError(f"Cannot read DET workbook {options['path']}: {exc}")
+
+        for row_number, study, message in result.errors:
+            self.stderr.write(f"Row {row_number} ({study}): {message}")
+
+        if options['errors_csv']:
+            with open(options['errors_csv'], 'w', newline='') as handle:
+                writer = csv.writer(handle)
+                writer.writerow(['row', 'study', 'error'])
+                writer.writerows(result.errors)
+
+        verb = "Validated" if options['dry_run'] else "Imported"
+        self.stdout.write(self.style.SUCCESS(
+            f"{verb} {result.rows_imported} of {result.rows_read} rows for {result.studies} studies "
+            f"in {result.chunks} chunks ({len(result.errors)} rows rejected)"
+        ))
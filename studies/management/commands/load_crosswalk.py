@@ -0,0 +1,34 @@
+import csv
+
+from django.core.management.base import BaseCommand, CommandError
+
+from studies import crosswalks
+
+
+class Command(BaseCommand):
+    help = "Load a CSV of index conversion rules as a new crosswalk version"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'path',
+            help="CSV with columns outcome, source_index, source_criteria, target_index, intercept, slope "
+                 "and optionally intercept_se, slope_se, covariance, residual_sd, notes"
+        )
+        parser.add_argument('--name', required=True, help="Name of the crosswalk")
+        parser.add_argument('--source', default='', help="Citation for the conversion coefficients")
+        parser.add_argument('--description', default='')
+
+    def handle(self, *args, **options):
+        numeric = {'intercept', 'slope', 'intercept_se', 'slope_se', 'covariance', 'residual_sd'}
+        try:
+            with open(options['path'], newline='') as handle:
+                rules = [
+                    {key: float(value) if key in numeric else value for key, value in row.items() if value != ''}
+                    for row in csv.DictReader(handle)
+                ]
+            crosswalk = crosswalks.create_crosswalk(
+                options['name'], rules, source=options['source'], description=options['description']
+            )
+        except (OSError, ValueError, TypeError) as exc:
+            raise CommandError(f"Cannot load crosswalk {options['path']}: {exc}")
+        self.stdout.write(self.style.SUCCESS(f"Created {crosswalk} with {len(rules)} rules"))
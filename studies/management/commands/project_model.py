@@ -0,0 +1,55 @@
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+
+from studies import bayes, projections
+from studies.models import ModelFit
+
+
+class Command(BaseCommand):
+    help = "Simulate projections to 2050 from a model version's posterior draws and store their quantiles"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--scenario', action='append', dest='scenarios',
+            help=f"Scenario name, repeatable (defaults to all of: {', '.join(projections.SCENARIOS)})"
+        )
+        parser.add_argument(
+            '--parameters', default='{}',
+            help="JSON object of scenario parameters, e.g. '{\"coverage_change\": {\"AB\": 0.5}}'; "
+                 "needs exactly one --scenario, whose stored run it replaces"
+        )
+        parser.add_argument('--model-version', type=int, help="Model version (defaults to the latest completed fit)")
+        parser.add_argument('--horizon', type=int, default=projections.HORIZON)
+        parser.add_argument('--trajectories', type=int, default=projections.DEFAULT_TRAJECTORIES)
+
+    def handle(self, *args, **options):
+        try:
+            parameters = json.loads(options['parameters'])
+        except ValueError as exc:
+            raise CommandError(f"Invalid --parameters: {exc}")
+        if parameters and len(options['scenarios'] or []) != 1:
+            # Each scenario's run is stored under its name; overrides must not replace every named run
+            raise CommandError("--parameters needs exactly one --scenario")
+
+        if options['model_version']:
+            model_fit = ModelFit.objects.filter(version=options['model_version'], status='completed').first()
+        else:
+            model_fit = bayes.latest_fit()
+        if model_fit is None:
+            raise CommandError("No completed model fit; run fit_model first")
+        # latest_fit() defers the draws
+        model_fit.refresh_from_db()
+
+        for scenario in options['scenarios'] or list(projections.SCENARIOS):
+            try:
+                run = projections.run_projection(
+                    model_fit, scenario, parameters, horizon=options['horizon'],
+                    trajectories=options['trajectories'],
+                )
+            except (ValueError, TypeError) as exc:
+                raise CommandError(f"{scenario}: {exc}")
+            self.stdout.write(self.style.SUCCESS(
+                f"Projected '{scenario}' from model version {model_fit.version} to {run.horizon} "
+                f"({run.trajectories} trajectories)"
+            ))
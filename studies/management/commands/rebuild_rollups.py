@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+
+from studies import caching, rollups
+
+
+class Command(BaseCommand):
+    help = "Rebuild the StudyRollup summary table from scratch"
+
+    def handle(self, *args, **options):
+        cells = rollups.rebuild()
+        caching.bump_data_version()
+        self.stdout.write(self.style.SUCCESS(
+            f"Rebuilt {cells} rollup cells"
+        ))
@@ -0,0 +1,15 @@
+from django.core.management.base import BaseCommand
+
+from studies import search
+
+
+class Command(BaseCommand):
+    help = "Create the full-text search structures and re-index every study"
+
+    def handle(self, *args, **options):
+        backend = search.get_backend()
+        backend.ensure_schema()
+        count = backend.rebuild()
+        self.stdout.write(self.style.SUCCESS(
+            f"Indexed {count} studies with {backend.__class__.__name__}"
+        ))
@@ -0,0 +1,69 @@
+import multiprocessing
+import os
+import signal
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+
+from studies import jobs
+
+
+def _worker(index, once, poll_interval):
+    """Entry point of one worker process: finish the current job on SIGTERM/SIGINT, then exit"""
+    stopping = []
+    signal.signal(signal.SIGTERM, lambda signum, frame: stopping.append(signum))
+    signal.signal(signal.SIGINT, lambda signum, frame: stopping.append(signum))
+    try:
+        jobs.work(
+            worker=f"{jobs.worker_name()}/{index}", once=once, poll_interval=poll_interval,
+            should_stop=lambda: bool(stopping),
+        )
+    finally:
+        connections.close_all()
+
+
+class Command(BaseCommand):
+    help = "Run worker processes that execute queued analysis jobs (model fits, projections, meta-analyses, imports)"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--processes', type=int, default=os.cpu_count() or 1,
+            help="Number of worker processes (defaults to the number of CPUs)"
+        )
+        parser.add_argument('--once', action='store_true', help="Exit when the queue is empty (for cron)")
+        parser.add_argument(
+            '--poll-interval', type=float, default=jobs.POLL_INTERVAL,
+            help="Seconds to wait before polling an empty queue again"
+        )
+
+    def handle(self, *args, **options):
+        if options['processes'] < 1:
+            raise CommandError("--processes must be a positive integer")
+        self.stdout.write(
+            f"Starting {options['processes']} worker(s) for tasks: {', '.join(sorted(jobs.TASKS))}"
+        )
+
+        if options['processes'] == 1:
+            _worker(0, options['once'], options['poll_interval'])
+            return
+
+        # Forked children must not share the parent's database connections
+        connections.close_all()
+        context = multiprocessing.get_context('fork')
+        workers = [
+            context.Process(target=_worker, args=(index, options['once'], options['poll_interval']))
+            for index in range(options['processes'])
+        ]
+        for worker in workers:
+            worker.start()
+
+        def forward(signum, frame):
+            for worker in workers:
+                if worker.is_alive():
+                    os.kill(worker.pid, signal.SIGTERM)
+
+        signal.signal(signal.SIGTERM, forward)
+        signal.signal(signal.SIGINT, forward)
+        for worker in workers:
+            worker.join()
+        self.stdout.write(self.style.SUCCESS("Workers stopped"))
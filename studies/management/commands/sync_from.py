@@ -0,0 +1,73 @@
+import json
+import os
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from studies import changelog
+from studies.models import SyncCursor
+
+
+class Command(BaseCommand):
+    help = "Replicate studies and strata from another DCPS instance by applying its change feed"
+
+    def add_arguments(self, parser):
+        parser.add_argument('source', help="Base URL of the source instance, e.g. https://dcps.example.org")
+        parser.add_argument('--since', type=int, help="Start from this cursor instead of the stored one")
+        parser.add_argument('--limit', type=int, default=changelog.DEFAULT_LIMIT, help="Entries per request")
+        parser.add_argument('--follow', action='store_true', help="Keep polling for new changes")
+        parser.add_argument('--interval', type=float, default=5, help="Seconds between polls with --follow")
+        parser.add_argument('--timeout', type=float, default=30, help="HTTP timeout in seconds")
+        parser.add_argument(
+            '--token', default=os.getenv('CHANGES_FEED_TOKEN', ''),
+            help="The source's CHANGES_FEED_TOKEN (default: the CHANGES_FEED_TOKEN environment variable)"
+        )
+
+    def handle(self, *args, **options):
+        source = options['source'].rstrip('/')
+        state, _ = SyncCursor.objects.get_or_create(source=source)
+        if options['since'] is not None:
+            state.cursor = options['since']
+            state.save(update_fields=['cursor', 'updated_at'])
+
+        total = 0
+        while True:
+            page = self.fetch(source, state.cursor, options['limit'], options['timeout'], options['token'])
+            entries = page['results']
+            if entries:
+                started = time.perf_counter()
+                # The page and the cursor move together, so a failed page is retried from the same place
+                with transaction.atomic():
+                    try:
+                        changelog.apply(entries)
+                    except ValueError as exc:
+                        raise CommandError(str(exc))
+                    state.cursor = page['next_cursor']
+                    state.entries_applied += len(entries)
+                    state.save(update_fields=['cursor', 'entries_applied', 'updated_at'])
+                total += len(entries)
+                self.stdout.write(
+                    f"  applied {len(entries)} changes up to {state.cursor} "
+                    f"in {(time.perf_counter() - started) * 1000:.0f} ms"
+                )
+            if page['has_more']:
+                continue
+            if not options['follow']:
+                break
+            time.sleep(options['interval'])
+
+        self.stdout.write(self.style.SUCCESS(f"Applied {total} changes; {source} is at cursor {state.cursor}"))
+
+    def fetch(self, source, since, limit, timeout, token):
+        query = urllib.parse.urlencode({'since': since, 'limit': limit})
+        url = f"{source}/api/v1/changes/?{query}"
+        request = urllib.request.Request(url, headers={'Authorization': f"Bearer {token}"} if token else {})
+        try:
+            with urllib.request.urlopen(request, timeout=timeout) as response:
+                return json.load(response)
+        except (urllib.error.URLError, ValueError) as exc:
+            raise CommandError(f"Cannot read the change feed at {url}: {exc}")
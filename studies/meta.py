@@ -0,0 +1,204 @@
+"""Random-effects meta-analysis of caries strata, vectorized across subgroups
+
+Every cell of a grouping (province x age group by default) is pooled at once:
+per-stratum effects and variances are computed as flat arrays and every sum
+is a bincount over the cell index, including each REML iteration. Results are
+memoized in the cache under the current data version, so repeat requests
+cost nothing until the data changes.
+
+Methods: DerSimonian-Laird (``dl``) and restricted maximum likelihood
+(``reml``). Prevalence can be pooled on the logit, Freeman-Tukey double
+arcsine or raw proportion scale and is back-transformed to a percentage.
+Mean dmft/DMFT is pooled on its natural scale.
+"""
+import hashlib
+
+import numpy as np
+from django.core.cache import cache
+from scipy import stats
+
+from . import analytics, estimates
+
+
+METHODS = ('reml', 'dl')
+TRANSFORMS = ('logit', 'freeman_tukey', 'raw')
+OUTCOMES = ('prevalence', 'dmft')
+GROUP_FIELDS = (
+    'province', 'age_group', 'caries_index_used', 'sex', 'age_category',
+    'socioeconomic_status', 'publication_year', 'collection_year',
+)
+DEFAULT_GROUPING = ('province', 'age_group')
+
+REML_MAX_ITER = 100
+REML_TOLERANCE = 1e-10
+
+
+def _prevalence_effects(strata, transform):
+    """Per-stratum effect and sampling variance of prevalence on the pooling scale"""
+    n = strata.columns['sample_size_group'].astype(np.float64)
+    p = strata.columns['caries_prevalence'] / 100
+    events = p * n
+    with np.errstate(invalid='ignore', divide='ignore'):
+        if transform == 'logit':
+            # Add 0.5 to both cells only where a stratum has 0% or 100% prevalence
+            c = np.where((events <= 0) | (events >= n), 0.5, 0.0)
+            y = np.log((events + c) / (n - events + c))
+            v = 1 / (events + c) + 1 / (n - events + c)
+        elif transform == 'freeman_tukey':
+            y = np.arcsin(np.sqrt(events / (n + 1))) + np.arcsin(np.sqrt((events + 1) / (n + 1)))
+            v = 1 / (n + 0.5)
+        else:
+            y = p
+            v = estimates.prevalence_variance(strata) / 100 ** 2
+        # Harmonized strata carry the variance their crosswalk added, on the logit scale
+        # (the raw scale already has it through the converted CI)
+        added = strata.columns.get('crosswalk_variance')
+        if added is not None and transform != 'raw':
+            v = v + added * (1.0 if transform == 'logit' else p * (1 - p))
+    return y, v
+
+
+def _back_transform(values, transform, n_harmonic):
+    """Map pooled prevalence values back to a percentage"""
+    with np.errstate(invalid='ignore', divide='ignore', over='ignore'):
+        if transform == 'logit':
+            p = 1 / (1 + np.exp(-values))
+        elif transform == 'freeman_tukey':
+            # Miller (1978) inversion using the harmonic mean sample size of the cell
+            t = np.clip(values, 0, np.pi)
+            sin_t = np.sin(t)
+            inner = 1 - (sin_t + (sin_t - 1 / sin_t) / n_harmonic) ** 2
+            p = 0.5 * (1 - np.sign(np.cos(t)) * np.sqrt(np.clip(inner, 0, 1)))
+            p = np.where(t == 0, 0.0, np.where(t == np.pi, 1.0, p))
+        else:
+            p = values
+    return np.clip(p, 0, 1) * 100
+
+
+def _effects(strata, outcome, transform):
+    if outcome == 'prevalence':
+        return _prevalence_effects(strata, transform)
+    return strata.columns['mean_dmft_DMFT'], estimates.dmft_variance(strata)
+
+
+def _reml(y, v, cell, size, tau2):
+    """Fisher-scoring REML for τ² in every cell simultaneously, started at the DL estimate"""
+    for _ in range(REML_MAX_ITER):
+        w = 1 / (v + tau2[cell])
+        sum_w = np.bincount(cell, weights=w, minlength=size)
+        mu = np.bincount(cell, weights=w * y, minlength=size) / sum_w
+        sum_w2 = np.bincount(cell, weights=w ** 2, minlength=size)
+        score = np.bincount(cell, weights=w ** 2 * ((y - mu[cell]) ** 2 - v), minlength=size)
+        updated = np.maximum(score / sum_w2 + 1 / sum_w, 0)
+        converged = np.nanmax(np.abs(updated - tau2)) < REML_TOLERANCE if size else True
+        tau2 = updated
+        if converged:
+            break
+    return tau2
+
+
+def random_effects(y, v, cell, size, method='reml'):
+    """Pool effects ``y`` with sampling variances ``v`` within each of ``size`` cells
+
+    ``cell`` holds each effect's cell index. Returns a dict of per-cell
+    arrays: k, mu, se, tau2, q and i2 (percent).
+    """
+    def total(weights):
+        return np.bincount(cell, weights=weights, minlength=size)
+
+    k = total(np.ones(len(y)))
+    with np.errstate(invalid='ignore', divide='ignore'):
+        # Fixed-effect pieces shared by DL and the heterogeneity statistics
+        w = 1 / v
+        sum_w = total(w)
+        mu_fixed = total(w * y) / sum_w
+        q = total(w * (y - mu_fixed[cell]) ** 2)
+        df = k - 1
+        c = sum_w - total(w ** 2) / sum_w
+        tau2 = np.where(c > 0, np.maximum((q - df) / c, 0), 0.0)
+        if method == 'reml':
+            tau2 = _reml(y, v, cell, size, np.nan_to_num(tau2))
+
+        w_random = 1 / (v + tau2[cell])
+        sum_w_random = total(w_random)
+        mu = total(w_random * y) / sum_w_random
+        se = 1 / np.sqrt(sum_w_random)
+        i2 = np.where(q > 0, np.maximum((q - df) / q, 0) * 100, np.where(df > 0, 0.0, np.nan))
+    return {'k': k, 'mu': mu, 'se': se, 'tau2': tau2, 'q': q, 'i2': i2}
+
+
+def pool(groups, outcome='prevalence', method='reml', transform='logit', level=0.95):
+    """Random-effects pooled estimate per group of an analytics.GroupBy
+
+    Returns a dict of arrays aligned with ``groups.keys``. Strata missing the
+    outcome or a usable variance are left out of their cell.
+    """
+    y, v = _effects(groups.table, outcome, transform)
+    y, v = y[groups.mask], v[groups.mask]
+    n = groups.values('sample_size_group').astype(np.float64)
+    usable = np.isfinite(y) & np.isfinite(v) & (v > 0)
+    y, v, n, cell = y[usable], v[usable], n[usable], groups.inverse[usable]
+
+    fit = random_effects(y, v, cell, groups.size, method)
+    k, mu, se, tau2 = fit['k'], fit['mu'], fit['se'], fit['tau2']
+    participants = np.bincount(cell, weights=n, minlength=groups.size)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        n_harmonic = k / np.bincount(cell, weights=1 / n, minlength=groups.size)
+
+    z = stats.norm.ppf(0.5 + level / 2)
+    # Prediction interval (Higgins et al. 2009) needs at least three strata
+    t = np.where(k >= 3, stats.t.ppf(0.5 + level / 2, np.maximum(k - 2, 1)), np.nan)
+    half_width = t * np.sqrt(tau2 + se ** 2)
+    bounds = {
+        'estimate': mu,
+        'ci_lower': mu - z * se,
+        'ci_upper': mu + z * se,
+        'pi_lower': mu - half_width,
+        'pi_upper': mu + half_width,
+    }
+    if outcome == 'prevalence':
+        bounds = {name: _back_transform(value, transform, n_harmonic) for name, value in bounds.items()}
+
+    empty = k == 0
+    result = {name: np.where(empty, np.nan, value) for name, value in bounds.items()}
+    result.update({
+        'se': np.where(empty, np.nan, se),
+        'tau2': np.where(empty, np.nan, tau2),
+        'i2': np.where(empty, np.nan, fit['i2']),
+        'q': np.where(empty, np.nan, fit['q']),
+        'strata': k.astype(np.int64),
+        'participants': participants.astype(np.int64),
+    })
+    return result
+
+
+def _validate(by, outcome, method, transform):
+    unknown = [name for name in by if name not in GROUP_FIELDS]
+    if unknown or not by:
+        raise ValueError(f"by must be a comma-separated subset of: {', '.join(GROUP_FIELDS)}")
+    if outcome not in OUTCOMES:
+        raise ValueError(f"outcome must be one of: {', '.join(OUTCOMES)}")
+    if method not in METHODS:
+        raise ValueError(f"method must be one of: {', '.join(METHODS)}")
+    if transform not in TRANSFORMS:
+        raise ValueError(f"transform must be one of: {', '.join(TRANSFORMS)}")
+
+
+def meta_analysis(by=DEFAULT_GROUPING, outcome='prevalence', method='reml', transform='logit', harmonize=None):
+    """Stratified meta-analysis table as a list of row dicts, memoized per data version
+
+    ``harmonize`` converts the strata to one caries index first (see
+    analytics.frame). Raises ValueError for an unknown grouping field,
+    outcome, method, transform or harmonization target.
+    """
+    by = tuple(by)
+    _validate(by, outcome, method, transform)
+    frame = analytics.frame(harmonize)
+    signature = f"{by}|{outcome}|{method}|{transform}"
+    key = f"meta:v{frame.version}:{hashlib.md5(signature.encode()).hexdigest()}"
+    rows = cache.get(key)
+    if rows is None:
+        groups = frame.strata.group_by(*by)
+        rows = [row for row in groups.rows(**pool(groups, outcome, method, transform)) if row['strata']]
+        cache.set(key, rows)
+    return rows
@@ -1,7 +1,10 @@
-from django.db import models
+from django.db import models, transaction
 from django.urls import reverse
 from django.utils import timezone
 from django.core.validators import MinValueValidator, MaxValueValidator
+from django.contrib.postgres.search import SearchVectorField
+from django.core.serializers.json import DjangoJSONEncoder
+import datetime
 import json
 
 
@@ -103,6 +106,7 @@ class DentalCariesStudy(models.Model):
             ('DMFT', 'DMFT (permanent teeth)'),
             ('DMFS', 'DMFS (permanent teeth surfaces)'),
             ('dmft_DMFT', 'dmft + DMFT (mixed dentition)'),
+            ('dmfs_DMFS', 'dmfs + DMFS (mixed dentition surfaces)'),
             ('other', 'Other index'),
         ],
         help_text="Primary dental caries index used"
@@ -149,6 +153,9 @@ class DentalCariesStudy(models.Model):
     # Additional notes
     notes = models.TextField(blank=True, null=True, help_text="Additional notes about the study")
     
+    # Full-text search (maintained by studies.search; GIN-indexed on PostgreSQL)
+    search_vector = SearchVectorField(null=True, editable=False)
+    
     # Timestamps
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
@@ -159,14 +166,30 @@ class DentalCariesStudy(models.Model):
         indexes = [
             models.Index(fields=['study_id']),
             models.Index(fields=['publication_year']),
-            models.Index(fields=['province']),
             models.Index(fields=['age_group']),
             models.Index(fields=['caries_index_used']),
+            # Composite indexes for the StudyListView filter combinations
+            # (equality columns first, publication_year range last)
+            models.Index(fields=['province', 'age_group', 'caries_index_used', 'publication_year']),
+            models.Index(fields=['province', 'publication_year']),
+            models.Index(fields=['age_group', 'publication_year']),
+            models.Index(fields=['caries_index_used', 'publication_year']),
+            # Covers the ExtractYear grouping used to build rollup cells
+            models.Index(
+                fields=['data_collection_start'],
+                include=['province', 'age_group', 'caries_index_used', 'publication_year', 'sample_size'],
+                name='study_collection_start_idx',
+            ),
         ]
     
     def __str__(self):
         return f"{self.title[:100]}... ({self.publication_year})"
     
+    def save(self, *args, **kwargs):
+        # One transaction with the change log entry written by post_save (see studies.changelog)
+        with transaction.atomic(using=kwargs.get('using')):
+            super().save(*args, **kwargs)
+    
     def get_absolute_url(self):
         return reverse('studies:detail', kwargs={'study_id': self.study_id})
     
@@ -259,7 +282,7 @@ class CariesData(models.Model):
         validators=[MinValueValidator(0), MaxValueValidator(100)],
         blank=True,
         null=True,
-        help_text="Care index (filled/(decayed+missing+filled) * 100)"
+        help_text="Care index (filled/(decayed+missing+filled) * 100), derived from the components when they are reported"
     )
     
     # Timestamps
@@ -273,6 +296,11 @@ class CariesData(models.Model):
     
     def __str__(self):
         return f"{self.study.title[:50]}... - {self.sex} {self.age_category}"
+    
+    def save(self, *args, **kwargs):
+        # One transaction with the change log entry written by post_save (see studies.changelog)
+        with transaction.atomic(using=kwargs.get('using')):
+            super().save(*args, **kwargs)
 
 
 class DataExtractionNote(models.Model):
@@ -329,4 +357,347 @@ class ProjectMetadata(models.Model):
         verbose_name_plural = "Project metadata"
     
     def __str__(self):
-        return f"{self.project_name} (v{self.protocol_version})" 
\ No newline at end of file
+        return f"{self.project_name} (v{self.protocol_version})" 
+
+
+class StudyRollup(models.Model):
+    """Precomputed study and stratum aggregates per province x age group x index x year cell"""
+    
+    province = models.CharField(max_length=100)
+    age_group = models.CharField(max_length=50)
+    caries_index_used = models.CharField(max_length=50)
+    publication_year = models.PositiveIntegerField()
+    collection_year = models.PositiveIntegerField(help_text="Year of data_collection_start")
+    
+    # Study-level aggregates
+    study_count = models.PositiveIntegerField(default=0)
+    total_participants = models.PositiveBigIntegerField(default=0)
+    
+    # Stratum-level aggregates (sums, so cells can be combined and averaged)
+    studies_with_data = models.PositiveIntegerField(default=0)
+    strata_count = models.PositiveIntegerField(default=0)
+    strata_participants = models.PositiveBigIntegerField(default=0)
+    prevalence_sum = models.FloatField(default=0)
+    dmft_sum = models.FloatField(default=0)
+    
+    class Meta:
+        db_table = 'study_rollups'
+        unique_together = ['province', 'age_group', 'caries_index_used', 'publication_year', 'collection_year']
+        indexes = [
+            models.Index(fields=['collection_year']),
+        ]
+    
+    def __str__(self):
+        return f"{self.province} / {self.age_group} / {self.caries_index_used} / {self.publication_year}"
+
+
+class ModelFit(models.Model):
+    """One versioned fit of the Bayesian hierarchical model (see studies.bayes)"""
+    
+    STATUS_CHOICES = [
+        ('queued', 'Queued'),
+        ('running', 'Running'),
+        ('completed', 'Completed'),
+        ('failed', 'Failed'),
+    ]
+    
+    version = models.PositiveIntegerField(unique=True, help_text="Model version, increasing with each fit")
+    name = models.CharField(max_length=100, default='reference', help_text="Label for this specification")
+    spec = models.JSONField(default=dict, help_text="ModelSpec options (empty for the reference model)")
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='queued')
+    
+    # Data and fit diagnostics
+    data_hash = models.CharField(max_length=64, blank=True, help_text="Fingerprint of the strata the model saw")
+    n_strata = models.PositiveIntegerField(default=0)
+    log_marginal_likelihood = models.FloatField(null=True, blank=True)
+    dic = models.FloatField(null=True, blank=True)
+    p_dic = models.FloatField(null=True, blank=True)
+    waic = models.FloatField(null=True, blank=True)
+    p_waic = models.FloatField(null=True, blank=True)
+    hyperparameters = models.JSONField(default=dict, blank=True)
+    draws = models.BinaryField(null=True, editable=False, help_text="Compressed posterior draws (.npz)")
+    message = models.TextField(blank=True)
+    
+    created_at = models.DateTimeField(auto_now_add=True)
+    started_at = models.DateTimeField(null=True, blank=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+    
+    class Meta:
+        db_table = 'model_fits'
+        ordering = ['-version']
+        indexes = [
+            models.Index(fields=['status', 'version']),
+        ]
+    
+    def __str__(self):
+        return f"v{self.version} {self.name} ({self.status})"
+
+
+class PosteriorSummary(models.Model):
+    """Posterior mean, SD and quantiles of one model effect or fitted value"""
+    
+    fit = models.ForeignKey(ModelFit, on_delete=models.CASCADE, related_name='summaries')
+    component = models.CharField(max_length=50, help_text="Effect name, e.g. 'spatial' or 'fitted_province'")
+    label = models.CharField(max_length=100, help_text="Level of the effect, e.g. a province code or year")
+    mean = models.FloatField()
+    sd = models.FloatField()
+    q025 = models.FloatField()
+    q50 = models.FloatField()
+    q975 = models.FloatField()
+    
+    class Meta:
+        db_table = 'posterior_summaries'
+        ordering = ['fit', 'component', 'id']
+        unique_together = ['fit', 'component', 'label']
+    
+    def __str__(self):
+        return f"v{self.fit.version} {self.component}[{self.label}]"
+
+
+class ProjectionRun(models.Model):
+    """Quantiles of one named projection scenario simulated from a model version (see studies.projections)"""
+    
+    fit = models.ForeignKey(ModelFit, on_delete=models.CASCADE, related_name='projections')
+    scenario = models.CharField(max_length=100, help_text="Scenario name, e.g. 'baseline'")
+    parameters = models.JSONField(default=dict, help_text="Scenario parameters (fluoridation effect, coverage change, ...)")
+    horizon = models.PositiveIntegerField(default=2050)
+    trajectories = models.PositiveIntegerField(default=0)
+    quantiles = models.BinaryField(editable=False, help_text="Compressed quantile arrays (.npz)")
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+    
+    class Meta:
+        db_table = 'projection_runs'
+        ordering = ['-fit__version', 'scenario']
+        unique_together = ['fit', 'scenario']
+    
+    def __str__(self):
+        return f"v{self.fit.version} {self.scenario} to {self.horizon}"
+
+
+class Job(models.Model):
+    """A long-running analysis task executed by `manage.py run_workers` (see studies.jobs)"""
+    
+    STATUS_CHOICES = [
+        ('queued', 'Queued'),
+        ('running', 'Running'),
+        ('completed', 'Completed'),
+        ('failed', 'Failed'),
+        ('cancelled', 'Cancelled'),
+    ]
+    
+    task = models.CharField(max_length=50, help_text="Registered task name, e.g. 'fit_model'")
+    params = models.JSONField(default=dict, blank=True)
+    input_hash = models.CharField(max_length=64, db_index=True, help_text="Hash of task, params and data version")
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='queued')
+    
+    # Progress reporting
+    progress = models.FloatField(default=0, help_text="Fraction complete, 0 to 1")
+    progress_message = models.CharField(max_length=255, blank=True)
+    result = models.JSONField(null=True, blank=True)
+    error = models.TextField(blank=True)
+    
+    # Scheduling, retries and cancellation
+    attempts = models.PositiveIntegerField(default=0)
+    max_attempts = models.PositiveIntegerField(default=3)
+    run_after = models.DateTimeField(default=timezone.now, help_text="Not picked up before this time (retry backoff)")
+    cancel_requested = models.BooleanField(default=False)
+    worker = models.CharField(max_length=100, blank=True)
+    created_by = models.CharField(max_length=150, blank=True)
+    
+    created_at = models.DateTimeField(auto_now_add=True)
+    started_at = models.DateTimeField(null=True, blank=True)
+    heartbeat_at = models.DateTimeField(null=True, blank=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+    
+    class Meta:
+        db_table = 'jobs'
+        ordering = ['-created_at']
+        indexes = [
+            models.Index(fields=['status', 'run_after']),
+            models.Index(fields=['task', 'input_hash']),
+        ]
+    
+    def __str__(self):
+        return f"#{self.pk} {self.task} ({self.status})"
+
+
+class SensitivityRun(models.Model):
+    """One sensitivity analysis: a grid of model specifications fitted in parallel (see studies.sensitivity)"""
+    
+    STATUS_CHOICES = [
+        ('running', 'Running'),
+        ('completed', 'Completed'),
+        ('failed', 'Failed'),
+    ]
+    
+    name = models.CharField(max_length=100, default='protocol')
+    grid = models.JSONField(default=dict, help_text="Option lists or spec objects that were expanded")
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='running')
+    n_specs = models.PositiveIntegerField(default=0)
+    processes = models.PositiveIntegerField(default=1)
+    elapsed = models.FloatField(null=True, blank=True, help_text="Wall-clock seconds for the whole grid")
+    message = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+    
+    class Meta:
+        db_table = 'sensitivity_runs'
+        ordering = ['-created_at']
+    
+    def __str__(self):
+        return f"{self.name} ({self.n_specs} specs, {self.status})"
+
+
+class SensitivityResult(models.Model):
+    """Fit criteria and key posteriors of one specification in a sensitivity run"""
+    
+    run = models.ForeignKey(SensitivityRun, on_delete=models.CASCADE, related_name='results')
+    label = models.CharField(max_length=255, help_text="Options that differ from the reference specification")
+    spec = models.JSONField(default=dict)
+    status = models.CharField(max_length=20, default='completed')
+    dic = models.FloatField(null=True, blank=True)
+    p_dic = models.FloatField(null=True, blank=True)
+    waic = models.FloatField(null=True, blank=True)
+    p_waic = models.FloatField(null=True, blank=True)
+    delta_dic = models.FloatField(null=True, blank=True, help_text="DIC minus the lowest DIC in the run")
+    delta_waic = models.FloatField(null=True, blank=True, help_text="WAIC minus the lowest WAIC in the run")
+    log_marginal_likelihood = models.FloatField(null=True, blank=True)
+    converged = models.BooleanField(default=False)
+    hyperparameters = models.JSONField(default=dict, blank=True)
+    posteriors = models.JSONField(default=dict, blank=True, help_text="Baseline rate and fitted province means")
+    error = models.TextField(blank=True)
+    elapsed = models.FloatField(default=0, help_text="Seconds spent fitting this specification")
+    
+    class Meta:
+        db_table = 'sensitivity_results'
+        ordering = ['run', 'dic']
+    
+    def __str__(self):
+        return f"{self.run.name}: {self.label}"
+
+
+class Crosswalk(models.Model):
+    """Versioned set of rules converting caries indices and criteria to a common index (see studies.crosswalks)"""
+    
+    version = models.PositiveIntegerField(unique=True, help_text="Crosswalk version, increasing with each release")
+    name = models.CharField(max_length=100)
+    description = models.TextField(blank=True)
+    source = models.CharField(max_length=500, blank=True, help_text="Citation for the conversion coefficients")
+    is_active = models.BooleanField(default=True, help_text="The latest active version is applied by ?harmonize=")
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+    
+    class Meta:
+        db_table = 'crosswalks'
+        ordering = ['-version']
+    
+    def __str__(self):
+        return f"{self.name} v{self.version}"
+
+
+class CrosswalkRule(models.Model):
+    """Linear conversion of one index (optionally under one examination criteria) to a target index
+    
+    Prevalence rules act on the logit scale and mean dmft/DMFT rules on the
+    natural scale: target = intercept + slope * source.
+    """
+    
+    OUTCOME_CHOICES = [
+        ('prevalence', 'Caries prevalence (logit scale)'),
+        ('dmft', 'Mean dmft/DMFT'),
+    ]
+    
+    crosswalk = models.ForeignKey(Crosswalk, on_delete=models.CASCADE, related_name='rules')
+    outcome = models.CharField(max_length=20, choices=OUTCOME_CHOICES)
+    source_index = models.CharField(
+        max_length=50, choices=DentalCariesStudy._meta.get_field('caries_index_used').choices
+    )
+    source_criteria = models.CharField(
+        max_length=100, blank=True,
+        choices=DentalCariesStudy._meta.get_field('examination_criteria').choices,
+        help_text="Blank applies the rule under any examination criteria"
+    )
+    target_index = models.CharField(
+        max_length=50, choices=DentalCariesStudy._meta.get_field('caries_index_used').choices
+    )
+    
+    # Coefficients and their uncertainty
+    intercept = models.FloatField(default=0)
+    slope = models.FloatField(default=1)
+    intercept_se = models.FloatField(default=0)
+    slope_se = models.FloatField(default=0)
+    covariance = models.FloatField(default=0, help_text="Covariance of the intercept and slope estimates")
+    residual_sd = models.FloatField(default=0, help_text="Residual SD of the conversion (prediction error)")
+    notes = models.TextField(blank=True)
+    
+    class Meta:
+        db_table = 'crosswalk_rules'
+        ordering = ['crosswalk', 'outcome', 'target_index', 'source_index', 'source_criteria']
+        unique_together = ['crosswalk', 'outcome', 'source_index', 'source_criteria', 'target_index']
+    
+    def __str__(self):
+        criteria = f" ({self.source_criteria})" if self.source_criteria else ''
+        return f"{self.outcome}: {self.source_index}{criteria} -> {self.target_index}"
+
+
+class ChangeLogEncoder(DjangoJSONEncoder):
+    """DjangoJSONEncoder keeping microseconds, so replicated timestamps match the source exactly"""
+    
+    def default(self, o):
+        if isinstance(o, datetime.datetime):
+            return o.isoformat()
+        return super().default(o)
+
+
+class ChangeLogEntry(models.Model):
+    """Append-only record of one insert, update or delete of a study or stratum (see studies.changelog)"""
+    
+    MODEL_CHOICES = [
+        ('study', 'Study'),
+        ('stratum', 'Stratum'),
+    ]
+    ACTION_CHOICES = [
+        ('insert', 'Insert'),
+        ('update', 'Update'),
+        ('delete', 'Delete'),
+    ]
+    
+    id = models.BigAutoField(primary_key=True, help_text="Position in the change feed (the ?since= cursor)")
+    model = models.CharField(max_length=20, choices=MODEL_CHOICES)
+    object_id = models.BigIntegerField(help_text="Primary key of the changed row")
+    action = models.CharField(max_length=10, choices=ACTION_CHOICES)
+    data = models.JSONField(
+        default=dict, encoder=ChangeLogEncoder,
+        help_text="Inserted row, or the new values of the changed fields"
+    )
+    previous = models.JSONField(
+        blank=True, null=True, encoder=ChangeLogEncoder,
+        help_text="Old values of the changed fields, or the deleted row"
+    )
+    created_at = models.DateTimeField(auto_now_add=True)
+    
+    class Meta:
+        db_table = 'change_log'
+        ordering = ['id']
+        indexes = [
+            models.Index(fields=['model', 'object_id']),
+        ]
+    
+    def __str__(self):
+        return f"#{self.pk} {self.action} {self.model} {self.object_id}"
+
+
+class SyncCursor(models.Model):
+    """Position of this database in another instance's change feed (``manage.py sync_from``)"""
+    
+    source = models.URLField(unique=True, help_text="Base URL of the instance this database replicates")
+    cursor = models.BigIntegerField(default=0, help_text="Last change log entry applied")
+    entries_applied = models.BigIntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+    
+    class Meta:
+        db_table = 'sync_cursors'
+    
+    def __str__(self):
+        return f"{self.source} @ {self.cursor}"
@@ -0,0 +1,173 @@
+"""Pagination helpers: cached filtered counts, estimated counts and keyset (cursor) pages"""
+import base64
+import hashlib
+import json
+import math
+
+from django.core.cache import cache
+from django.core.exceptions import ValidationError
+from django.core.paginator import Paginator
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import connections
+from django.db.models import Q
+from django.utils.functional import cached_property
+
+from . import caching
+
+
+def count_cache_key(name, filters):
+    """Cache key for the row count of one filter signature at the current data version"""
+    signature = json.dumps(sorted(filters.items()), cls=DjangoJSONEncoder)
+    digest = hashlib.md5(signature.encode()).hexdigest()
+    return f"count:{name}:v{caching.data_version()}:{digest}"
+
+
+class CachedCountPaginator(Paginator):
+    """Paginator that reuses the COUNT(*) of a filter signature until the data changes"""
+
+    def __init__(self, *args, count_key=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.count_key = count_key
+
+    @cached_property
+    def count(self):
+        if self.count_key is None:
+            return super().count
+        count = cache.get(self.count_key)
+        if count is None:
+            count = super().count
+            cache.set(self.count_key, count)
+        return count
+
+
+class EstimatedCountPaginator(Paginator):
+    """Paginator for large admin changelists that reads the planner's row estimate on PostgreSQL
+
+    An unfiltered queryset over a table the statistics put above
+    ESTIMATE_THRESHOLD rows uses ``pg_class.reltuples`` instead of a full
+    COUNT(*) scan. Filtered querysets, small tables, tables never analyzed
+    and other databases get the exact count.
+    """
+    ESTIMATE_THRESHOLD = 100000
+
+    @cached_property
+    def count(self):
+        estimate = self.estimate()
+        if estimate is not None and estimate >= self.ESTIMATE_THRESHOLD:
+            return estimate
+        return super().count
+
+    def estimate(self):
+        queryset = self.object_list
+        query = getattr(queryset, 'query', None)
+        if query is None or query.where or query.distinct:
+            return None
+        connection = connections[queryset.db]
+        if connection.vendor != 'postgresql':
+            return None
+        with connection.cursor() as cursor:
+            cursor.execute(
+                "SELECT reltuples FROM pg_class WHERE oid = to_regclass(%s)", [queryset.model._meta.db_table]
+            )
+            row = cursor.fetchone()
+        # reltuples is -1 (PostgreSQL 14+) or 0 until the table is analyzed
+        return int(row[0]) if row and row[0] > 0 else None
+
+
+def encode_cursor(values):
+    payload = json.dumps(values, cls=DjangoJSONEncoder, separators=(',', ':'))
+    return base64.urlsafe_b64encode(payload.encode()).decode().rstrip('=')
+
+
+# Cursor values must fit the 64-bit integer columns they are compared with
+MAX_CURSOR_INT = 2 ** 63 - 1
+
+
+def _scalar(value):
+    if isinstance(value, bool):
+        return False
+    if isinstance(value, int):
+        return -MAX_CURSOR_INT <= value <= MAX_CURSOR_INT
+    if isinstance(value, float):
+        return math.isfinite(value)
+    return isinstance(value, str)
+
+
+def decode_cursor(token, field=None):
+    """Decode a cursor token into [sort value, id]; raises ValueError when malformed
+
+    With ``field`` (the sort field), the sort value is converted to that
+    field's Python type, and a value it does not accept is malformed too.
+    """
+    try:
+        padded = token + '=' * (-len(token) % 4)
+        values = json.loads(base64.urlsafe_b64decode(padded.encode()))
+    except (TypeError, ValueError) as exc:
+        raise ValueError("Invalid cursor") from exc
+    if (
+        not isinstance(values, list) or len(values) != 2 or not _scalar(values[0])
+        or not _scalar(values[1]) or not isinstance(values[1], int)
+    ):
+        raise ValueError("Invalid cursor")
+    if field is not None:
+        try:
+            values[0] = field.to_python(values[0])
+        except ValidationError as exc:
+            raise ValueError("Invalid cursor") from exc
+        if values[0] is None:
+            raise ValueError("Invalid cursor")
+    return values
+
+
+class KeysetPage:
+    """A page of a keyset-paginated queryset, shaped like a Django Page for templates"""
+
+    def __init__(self, object_list, next_cursor, is_first):
+        self.object_list = object_list
+        self.next_cursor = next_cursor
+        self.is_first = is_first
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def __len__(self):
+        return len(self.object_list)
+
+    def has_next(self):
+        return self.next_cursor is not None
+
+    def has_previous(self):
+        return not self.is_first
+
+    def has_other_pages(self):
+        return self.has_next() or self.has_previous()
+
+
+def keyset_paginate(queryset, ordering, page_size, cursor=None):
+    """Return the page after ``cursor`` ordered by ``ordering`` then id
+
+    Each page is a single range scan on (sort column, id), so deep pages cost
+    the same as the first one. ``ordering`` must name a non-null field; rows
+    from a values() queryset must include it and ``id``.
+    """
+    name = ordering.lstrip('-')
+    descending = ordering.startswith('-')
+    lookup = 'lt' if descending else 'gt'
+    queryset = queryset.order_by(ordering, '-id' if descending else 'id')
+
+    if cursor:
+        value, last_id = decode_cursor(cursor, queryset.model._meta.get_field(name))
+        queryset = queryset.filter(
+            Q(**{f'{name}__{lookup}': value}) | Q(**{name: value, f'id__{lookup}': last_id})
+        )
+
+    rows = list(queryset[:page_size + 1])
+    next_cursor = None
+    if len(rows) > page_size:
+        rows = rows[:page_size]
+        last = rows[-1]
+        if isinstance(last, dict):
+            next_cursor = encode_cursor([last[name], last['id']])
+        else:
+            next_cursor = encode_cursor([getattr(last, name), last.pk])
+    return KeysetPage(rows, next_cursor, is_first=not cursor)
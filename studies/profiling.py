@@ -0,0 +1,157 @@
+"""Per-request profiling: SQL count and time, template render time and Python time
+
+``ProfilingMiddleware`` wraps a sampled share of requests (PROFILING_SAMPLE_RATE)
+in a database execute wrapper and times the template rendering. Each
+profiled response gets a ``Server-Timing`` header (sql, template, python,
+total), which the browser's network panel shows. Requests slower than
+PROFILING_SLOW_REQUEST_MS are logged to the ``studies.profiling`` logger.
+
+Views declare a query budget with a ``query_budget`` attribute (class-based
+views) or the ``@query_budget(n)`` decorator. A request over its budget is
+logged. With PROFILING_ENFORCE_BUDGETS (on under DEBUG, or set it in a test
+with ``override_settings``) it raises QueryBudgetExceeded instead, which the
+test client re-raises, so the test fails (see studies/tests.py). Server
+errors are not held to the budget, so the original exception surfaces.
+Budgeted requests are always profiled while enforcement is on, whatever
+the sample rate.
+"""
+import contextlib
+import logging
+import random
+import time
+
+from django.conf import settings
+from django.db import connections
+
+
+logger = logging.getLogger(__name__)
+
+
+class QueryBudgetExceeded(AssertionError):
+    """A view ran more SQL queries than its declared budget"""
+
+
+def query_budget(limit):
+    """Declare the SQL query budget of a function-based view"""
+    def decorate(view):
+        view.query_budget = limit
+        return view
+    return decorate
+
+
+def view_budget(view_func):
+    """Budget declared on a view function or its class-based view, or None"""
+    budget = getattr(view_func, 'query_budget', None)
+    view_class = getattr(view_func, 'view_class', None)
+    if budget is None and view_class is not None:
+        budget = getattr(view_class, 'query_budget', None)
+    return budget
+
+
+class RequestProfile:
+    """Counters of one request, fed by the execute wrapper and the render callbacks"""
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.queries = 0
+        self.sql_time = 0.0
+        self.template_time = 0.0
+        self.template_sql_time = 0.0
+        self.render_started = None
+        self.budget = None
+        self.view = None
+
+    def __call__(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.sql_time += time.perf_counter() - started
+            self.queries += 1
+
+    def start_render(self):
+        self.render_started = (time.perf_counter(), self.sql_time)
+
+    def end_render(self, response):
+        if self.render_started is not None:
+            started, sql_time = self.render_started
+            self.template_time += time.perf_counter() - started
+            self.template_sql_time += self.sql_time - sql_time
+            self.render_started = None
+
+    def timings(self):
+        """Milliseconds spent in SQL, templates (excluding their SQL), other Python code and in total"""
+        total = time.perf_counter() - self.started
+        template = self.template_time - self.template_sql_time
+        return {
+            'sql': self.sql_time * 1000,
+            'template': template * 1000,
+            'python': max(total - self.sql_time - template, 0) * 1000,
+            'total': total * 1000,
+        }
+
+    def server_timing(self):
+        timings = self.timings()
+        return ', '.join([
+            f'sql;dur={timings["sql"]:.1f};desc="{self.queries} queries"',
+            f'template;dur={timings["template"]:.1f}',
+            f'python;dur={timings["python"]:.1f}',
+            f'total;dur={timings["total"]:.1f}',
+        ])
+
+
+def enforce_budgets():
+    return getattr(settings, 'PROFILING_ENFORCE_BUDGETS', settings.DEBUG)
+
+
+class ProfilingMiddleware:
+    """Record SQL, template and Python time of sampled requests; check per-view query budgets"""
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        sample_rate = getattr(settings, 'PROFILING_SAMPLE_RATE', 1.0)
+        if not (enforce_budgets() or (sample_rate > 0 and random.random() < sample_rate)):
+            return self.get_response(request)
+
+        profile = request.profile = RequestProfile()
+        with contextlib.ExitStack() as stack:
+            for connection in connections.all():
+                stack.enter_context(connection.execute_wrapper(profile))
+            response = self.get_response(request)
+
+        if getattr(settings, 'PROFILING_SERVER_TIMING', True):
+            response['Server-Timing'] = profile.server_timing()
+        self.check(request, response, profile)
+        return response
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        profile = getattr(request, 'profile', None)
+        if profile is not None:
+            view = getattr(view_func, 'view_class', view_func)
+            profile.view = f"{view.__module__}.{view.__qualname__}"
+            profile.budget = view_budget(view_func)
+
+    def process_template_response(self, request, response):
+        profile = getattr(request, 'profile', None)
+        if profile is not None:
+            profile.start_render()
+            response.add_post_render_callback(profile.end_render)
+        return response
+
+    def check(self, request, response, profile):
+        timings = profile.timings()
+        summary = (
+            f"{request.method} {request.get_full_path()} -> {response.status_code} ({profile.view}): "
+            f"{profile.queries} queries, sql {timings['sql']:.1f} ms, template {timings['template']:.1f} ms, "
+            f"python {timings['python']:.1f} ms, total {timings['total']:.1f} ms"
+        )
+        # A failed request's query count says nothing about the view, and raising would hide its error
+        if profile.budget is not None and profile.queries > profile.budget and response.status_code < 500:
+            message = f"Query budget of {profile.budget} exceeded: {summary}"
+            if enforce_budgets():
+                raise QueryBudgetExceeded(message)
+            logger.warning("%s", message)
+        elif timings['total'] >= getattr(settings, 'PROFILING_SLOW_REQUEST_MS', 500):
+            logger.warning("Slow request: %s", summary)
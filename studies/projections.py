@@ -0,0 +1,248 @@
+"""Projections of mean dmft/DMFT to 2050 from the posterior draws of a ModelFit
+
+Each posterior draw of the intercept, spatial, age and temporal effects seeds
+one or more trajectories. The temporal effect is carried forward from the last
+observed year by its own random walk: an RW2 keeps the draw's latest slope and
+accumulates N(0, 1/tau) second differences, an RW1 accumulates first
+differences. tau is drawn per trajectory from the Laplace approximation of its
+hyperparameter. All trajectories of a province are simulated as one array
+operation (trajectories x age bands x years).
+
+Scenarios scale the projected rate by 1 - effect x coverage change, phased in
+over ``ramp_years``; ``coverage_change`` may be one number or a per-province
+mapping. Each scenario is stored as a named ProjectionRun holding only the
+quantiles (float32 .npz), so fan charts are read without re-simulating.
+Projections cover the main effects; the iid interactions are not carried
+forward.
+"""
+import io
+
+import numpy as np
+
+from . import bayes, spatial
+
+
+HORIZON = 2050
+DEFAULT_TRAJECTORIES = 4000
+QUANTILES = (0.025, 0.1, 0.25, 0.5, 0.75, 0.9, 0.975)
+NATIONAL = 'CA'
+ALL_AGES = 'all'
+
+# Community water fluoridation lowers dmft by about 35% (Iheozor-Ejiofor et al., Cochrane 2015)
+SCENARIO_DEFAULTS = {
+    'fluoridation_effect': 0.35,
+    'coverage_change': 0.0,
+    'ramp_years': 5,
+    'effect_sd': 0.0,
+}
+
+SCENARIOS = {
+    'baseline': {},
+    'fluoridation_expansion': {'coverage_change': 0.25},
+    'fluoridation_cessation': {'coverage_change': -0.25},
+}
+
+
+def scenario_parameters(scenario, overrides=None):
+    """Parameters of a named scenario with ``overrides`` applied; raises ValueError when invalid"""
+    overrides = dict(overrides or {})
+    if scenario not in SCENARIOS and not overrides:
+        raise ValueError(f"Unknown scenario '{scenario}'; pass parameters or use one of: {', '.join(SCENARIOS)}")
+    unknown = set(overrides) - set(SCENARIO_DEFAULTS)
+    if unknown:
+        raise ValueError(f"Unknown scenario parameters: {', '.join(sorted(unknown))}")
+    parameters = {**SCENARIO_DEFAULTS, **SCENARIOS.get(scenario, {}), **overrides}
+
+    coverage = parameters['coverage_change']
+    changes = coverage.values() if isinstance(coverage, dict) else [coverage]
+    if isinstance(coverage, dict) and set(coverage) - set(spatial.PROVINCES):
+        raise ValueError(f"coverage_change keys must be province codes: {', '.join(spatial.PROVINCES)}")
+    if not all(isinstance(value, (int, float)) and -1 <= value <= 1 for value in changes):
+        raise ValueError("coverage_change must be between -1 and 1")
+    if not 0 <= parameters['fluoridation_effect'] < 1:
+        raise ValueError("fluoridation_effect must be in [0, 1)")
+    if parameters['ramp_years'] < 0 or parameters['effect_sd'] < 0:
+        raise ValueError("ramp_years and effect_sd must be non-negative")
+    return parameters
+
+
+def _coverage(parameters, provinces):
+    """Coverage change per province (index 0 is the national level)"""
+    coverage = parameters['coverage_change']
+    if isinstance(coverage, dict):
+        national = float(np.mean([coverage.get(code, 0.0) for code in provinces[1:]]))
+        return np.array([national] + [float(coverage.get(code, 0.0)) for code in provinces[1:]])
+    return np.full(len(provinces), float(coverage))
+
+
+def _log_precision(archive, name, size, rng):
+    """Draws of a log precision from its Laplace approximation (the mode if its SD is unknown)"""
+    names = [str(value) for value in archive['theta_names']]
+    index = names.index(name)
+    mode = archive['theta'][index]
+    sd = np.sqrt(archive['theta_covariance'][index, index])
+    if not np.isfinite(sd) or sd <= 0:
+        return np.full(size, mode)
+    return rng.normal(mode, sd, size)
+
+
+def forward_temporal(temporal, log_tau, steps, order, rng):
+    """Extend temporal draws (trajectories x years) by ``steps`` years of RW1/RW2 innovations"""
+    if steps <= 0:
+        return temporal
+    innovations = rng.standard_normal((len(temporal), steps)) * np.exp(-log_tau / 2)[:, None]
+    last = temporal[:, -1:]
+    if order == 1:
+        return np.hstack([temporal, last + np.cumsum(innovations, axis=1)])
+    slope = temporal[:, -1:] - temporal[:, -2:-1] if temporal.shape[1] > 1 else np.zeros_like(last)
+    slopes = slope + np.cumsum(innovations, axis=1)
+    return np.hstack([temporal, last + np.cumsum(slopes, axis=1)])
+
+
+def _quantiles(values, levels):
+    """np.quantile (linear) over the last axis from a single sort, with the levels first"""
+    ordered = np.sort(values, axis=-1)
+    position = np.asarray(levels) * (values.shape[-1] - 1)
+    low = np.floor(position).astype(np.int64)
+    high = np.minimum(low + 1, values.shape[-1] - 1)
+    fraction = (position - low).astype(values.dtype)
+    result = ordered[..., low] * (1 - fraction) + ordered[..., high] * fraction
+    return np.moveaxis(result, -1, 0)
+
+
+def simulate(archive, spec, parameters, horizon=HORIZON, trajectories=DEFAULT_TRAJECTORIES, seed=None):
+    """Quantiles of projected mean dmft/DMFT per province x age band x year
+
+    ``archive`` is a loaded draws archive (bayes.load_draws). Returns a dict
+    with the axis labels and ``quantiles`` (len(QUANTILES) x provinces x ages
+    x years). Province 0 is the national level (no spatial effect) and age 0
+    averages the rate over age bands.
+    """
+    spec = spec if isinstance(spec, bayes.ModelSpec) else bayes.ModelSpec.from_dict(spec)
+    rng = np.random.default_rng(spec.seed if seed is None else seed)
+    years = [int(year) for year in archive['years']]
+    future = list(range(years[-1] + 1, horizon + 1))
+    all_years = np.array(years + future)
+
+    # Trajectory t reuses posterior draw t mod samples
+    samples = len(archive['intercept'])
+    source = np.arange(trajectories) % samples
+    log_tau = _log_precision(archive, 'log_precision_temporal', trajectories, rng)
+    order = 2 if spec.temporal == 'rw2' else 1
+    temporal = forward_temporal(archive['temporal'][source].astype(np.float64), log_tau, len(future), order, rng)
+    base = archive['intercept'][source, :1] + temporal  # trajectories x years
+
+    provinces = [NATIONAL] + [str(code) for code in archive['provinces']]
+    spatial_effect = np.hstack([np.zeros((trajectories, 1)), archive['spatial'][source]])
+    age = archive['age'][source]  # trajectories x age bands
+
+    # Scenario multiplier (trajectories x provinces x years), phased in after the last observed year
+    ramp = np.clip((all_years - years[-1]) / max(parameters['ramp_years'], 1), 0, 1)
+    effect = parameters['fluoridation_effect'] + parameters['effect_sd'] * rng.standard_normal(trajectories)
+    change = _coverage(parameters, provinces)
+    multiplier = np.clip(1 - effect[:, None, None] * change[None, :, None] * ramp[None, None, :], 0.05, None)
+
+    # Trajectories on the last (contiguous) axis so the per-cell quantile partitions stay cheap
+    base = np.ascontiguousarray(base.T, dtype=np.float32)  # years x trajectories
+    age = np.ascontiguousarray(age.T, dtype=np.float32)  # age bands x trajectories
+    multiplier = multiplier.transpose(1, 2, 0).astype(np.float32)  # provinces x years x trajectories
+    quantiles = np.empty((len(QUANTILES), len(provinces), age.shape[0] + 1, len(all_years)), dtype=np.float32)
+    for p in range(len(provinces)):
+        # age bands x years x trajectories
+        rate = np.exp(age[:, None, :] + (base + spatial_effect[:, p].astype(np.float32))[None, :, :])
+        rate *= multiplier[p][None, :, :]
+        rate = np.concatenate([rate.mean(axis=0, keepdims=True), rate], axis=0)
+        quantiles[:, p] = _quantiles(rate, QUANTILES)
+
+    return {
+        'levels': np.array(QUANTILES),
+        'provinces': np.array(provinces),
+        'ages': np.array([ALL_AGES] + [str(label) for label in archive['age_labels']]),
+        'years': all_years,
+        'observed_until': np.array(years[-1]),
+        'quantiles': quantiles,
+    }
+
+
+def pack(result):
+    """Compressed .npz bytes of a simulate() result"""
+    buffer = io.BytesIO()
+    np.savez_compressed(buffer, **result)
+    return buffer.getvalue()
+
+
+def unpack(data):
+    with np.load(io.BytesIO(bytes(data))) as npz:
+        return {name: npz[name] for name in npz.files}
+
+
+def run_projection(model_fit, scenario='baseline', parameters=None, horizon=HORIZON,
+                   trajectories=DEFAULT_TRAJECTORIES):
+    """Simulate a scenario from a completed ModelFit and store it as its named ProjectionRun"""
+    from django.db import transaction
+
+    from . import caching
+    from .models import ProjectionRun
+
+    if model_fit.status != 'completed' or not model_fit.draws:
+        raise ValueError(f"Model version {model_fit.version} has no posterior draws")
+    if trajectories < 10:
+        raise ValueError("trajectories must be at least 10")
+    parameters = scenario_parameters(scenario, parameters)
+    archive = bayes.load_draws(model_fit.draws)
+    if horizon <= int(archive['years'][-1]):
+        raise ValueError(f"horizon must be after the last observed year ({int(archive['years'][-1])})")
+
+    result = simulate(archive, model_fit.spec, parameters, horizon, trajectories)
+    with transaction.atomic():
+        run, _ = ProjectionRun.objects.update_or_create(
+            fit=model_fit, scenario=scenario,
+            defaults={
+                'parameters': parameters,
+                'horizon': horizon,
+                'trajectories': trajectories,
+                'quantiles': pack(result),
+            },
+        )
+        transaction.on_commit(caching.bump_data_version)
+    return run
+
+
+def _quantile_name(level):
+    """'q025', 'q10', 'q50', 'q975', ... as in PosteriorSummary"""
+    percent = level * 100
+    if float(percent).is_integer():
+        return f"q{int(percent):02d}"
+    return "q" + f"{percent:.1f}".replace('.', '').zfill(3)
+
+
+def fan_chart(run, province=NATIONAL, age=ALL_AGES):
+    """Fan chart rows (year, observed and each quantile) of a ProjectionRun; raises KeyError"""
+    result = unpack(run.quantiles)
+    provinces, ages = result['provinces'].tolist(), result['ages'].tolist()
+    if province not in provinces:
+        raise KeyError(f"province must be one of: {', '.join(provinces)}")
+    if age not in ages:
+        raise KeyError(f"age must be one of: {', '.join(ages)}")
+    p, a = provinces.index(province), ages.index(age)
+    observed_until = int(result['observed_until'])
+    names = [_quantile_name(level) for level in result['levels']]
+    values = result['quantiles'][:, p, a, :]
+    return [
+        {
+            'year': int(year),
+            'observed': int(year) <= observed_until,
+            **{name: float(values[q, i]) for q, name in enumerate(names)},
+        }
+        for i, year in enumerate(result['years'])
+    ]
+
+
+def latest_runs():
+    """ProjectionRuns of the newest completed model version that has any"""
+    from .models import ProjectionRun
+
+    latest = ProjectionRun.objects.filter(fit__status='completed').order_by('-fit__version').first()
+    if latest is None:
+        return ProjectionRun.objects.none()
+    return ProjectionRun.objects.filter(fit=latest.fit).order_by('scenario')
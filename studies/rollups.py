@@ -0,0 +1,123 @@
+"""Maintain the StudyRollup summary table read by the public views"""
+import threading
+
+from django.db import transaction
+from django.db.models import Count, F, Sum
+from django.db.models.functions import ExtractYear
+
+from .models import DentalCariesStudy, CariesData, StudyRollup
+
+
+CELL_FIELDS = ['province', 'age_group', 'caries_index_used', 'publication_year', 'collection_year']
+
+_pending = threading.local()
+
+
+def cell_key(study):
+    """Rollup cell of a study instance (or of a values() dict with the same keys)"""
+    if isinstance(study, dict):
+        return tuple(study[name] for name in CELL_FIELDS)
+    return (
+        study.province,
+        study.age_group,
+        study.caries_index_used,
+        study.publication_year,
+        study.data_collection_start.year,
+    )
+
+
+def study_cells(study_pks):
+    """Rollup cells of the stored studies in ``study_pks``"""
+    rows = DentalCariesStudy.objects.filter(pk__in=study_pks).annotate(
+        collection_year=ExtractYear('data_collection_start')
+    ).values(*CELL_FIELDS).order_by().distinct()
+    return [cell_key(row) for row in rows]
+
+
+def _study_rows(studies):
+    return studies.annotate(
+        collection_year=ExtractYear('data_collection_start')
+    ).values(*CELL_FIELDS).annotate(
+        study_count=Count('id'),
+        total_participants=Sum('sample_size'),
+    ).order_by()
+
+
+def _strata_rows(strata):
+    return strata.annotate(
+        province=F('study__province'),
+        age_group=F('study__age_group'),
+        caries_index_used=F('study__caries_index_used'),
+        publication_year=F('study__publication_year'),
+        collection_year=ExtractYear('study__data_collection_start'),
+    ).values(*CELL_FIELDS).annotate(
+        studies_with_data=Count('study', distinct=True),
+        strata_count=Count('id'),
+        strata_participants=Sum('sample_size_group'),
+        prevalence_sum=Sum('caries_prevalence'),
+        dmft_sum=Sum('mean_dmft_DMFT'),
+    ).order_by()
+
+
+def _build(studies, strata):
+    """Build unsaved rollup rows from filtered study and stratum querysets"""
+    cells = {}
+    for row in _study_rows(studies):
+        cells[cell_key(row)] = StudyRollup(
+            **{name: row[name] for name in CELL_FIELDS},
+            study_count=row['study_count'],
+            total_participants=row['total_participants'] or 0,
+        )
+    for row in _strata_rows(strata):
+        rollup = cells[cell_key(row)]
+        rollup.studies_with_data = row['studies_with_data']
+        rollup.strata_count = row['strata_count']
+        rollup.strata_participants = row['strata_participants'] or 0
+        rollup.prevalence_sum = row['prevalence_sum'] or 0
+        rollup.dmft_sum = row['dmft_sum'] or 0
+    return list(cells.values())
+
+
+def rebuild():
+    """Recompute every rollup row from the base tables"""
+    rollups = _build(DentalCariesStudy.objects.all(), CariesData.objects.all())
+    with transaction.atomic():
+        StudyRollup.objects.all().delete()
+        StudyRollup.objects.bulk_create(rollups, batch_size=1000)
+    return len(rollups)
+
+
+def refresh_cells(keys):
+    """Recompute only the given rollup cells"""
+    with transaction.atomic():
+        for key in keys:
+            cell = dict(zip(CELL_FIELDS, key))
+            study_filter = {name: value for name, value in cell.items() if name != 'collection_year'}
+            studies = DentalCariesStudy.objects.filter(
+                data_collection_start__year=cell['collection_year'], **study_filter
+            )
+            strata = CariesData.objects.filter(
+                study__data_collection_start__year=cell['collection_year'],
+                **{f'study__{name}': value for name, value in study_filter.items()}
+            )
+            StudyRollup.objects.filter(**cell).delete()
+            StudyRollup.objects.bulk_create(_build(studies, strata))
+
+
+def schedule_refresh(*keys):
+    """Queue cells for refresh once the current transaction commits
+
+    Cells queued within one transaction (e.g. a study delete cascading to its
+    strata) are deduplicated: the first callback refreshes them all and the
+    rest find nothing left to do.
+    """
+    if not hasattr(_pending, 'keys'):
+        _pending.keys = set()
+    _pending.keys.update(key for key in keys if key is not None)
+    transaction.on_commit(_flush_pending)
+
+
+def _flush_pending():
+    keys, _pending.keys = _pending.keys, set()
+    if keys:
+        refresh_cells(keys)
@@ -0,0 +1,252 @@
+"""Full-text search over studies
+
+PostgreSQL keeps a weighted tsvector in DentalCariesStudy.search_vector with a
+GIN index. SQLite keeps an FTS5 shadow table keyed on the study id. Both expose
+the same search_studies() API: ranked results with a highlighted ``snippet``.
+Fields are weighted title > authors > journal > notes.
+
+The database marks matches in the snippet with control characters; the
+snippet is HTML-escaped when it is read and only then are the markers turned
+into ``<mark>`` tags, so it is safe to render as HTML on every backend.
+"""
+import re
+
+from django.db import connection, models
+from django.db.models import ExpressionWrapper, F, Q, Value
+from django.db.models.expressions import RawSQL
+from django.db.models.functions import Coalesce, Concat
+from django.utils.html import escape
+from django.utils.safestring import mark_safe
+
+from .models import DentalCariesStudy
+
+
+SEARCH_CONFIG = 'english'
+SEARCH_MODES = ('websearch', 'phrase', 'prefix')
+
+# (field, PostgreSQL weight, FTS5 bm25 weight)
+SEARCH_FIELDS = [
+    ('title', 'A', 10.0),
+    ('authors', 'B', 5.0),
+    ('journal', 'C', 2.0),
+    ('notes', 'D', 1.0),
+]
+
+FTS_TABLE = 'study_search_fts'
+GIN_INDEX = 'study_search_vector_gin'
+# Match delimiters as the database writes them, and the HTML they become
+MARKERS = ('\x02', '\x03')
+HIGHLIGHT = ('<mark>', '</mark>')
+
+TOKEN_RE = re.compile(r'"([^"]+)"|(\w+)', re.UNICODE)
+
+
+class SnippetField(models.TextField):
+    """Snippet from the database, escaped with the match markers turned into HIGHLIGHT"""
+
+    def from_db_value(self, value, expression, connection):
+        if value is None:
+            return value
+        html = escape(value)
+        for marker, tag in zip(MARKERS, HIGHLIGHT):
+            html = html.replace(marker, tag)
+        return mark_safe(html)
+
+
+def _terms(query):
+    """Split a user query into (text, is_phrase) terms, dropping operators and punctuation"""
+    terms = []
+    for phrase, word in TOKEN_RE.findall(query):
+        if phrase:
+            words = re.findall(r'\w+', phrase, re.UNICODE)
+            if words:
+                terms.append((' '.join(words), True))
+        else:
+            terms.append((word, False))
+    return terms
+
+
+class PostgresSearchBackend:
+    """tsvector column maintained on save, GIN-indexed, ranked with ts_rank"""
+
+    def ensure_schema(self):
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f"CREATE INDEX IF NOT EXISTS {GIN_INDEX} "
+                f"ON {DentalCariesStudy._meta.db_table} USING gin (search_vector)"
+            )
+
+    def _vector(self):
+        from django.contrib.postgres.search import SearchVector
+
+        vector = None
+        for name, weight, _ in SEARCH_FIELDS:
+            part = SearchVector(Coalesce(name, Value('')), weight=weight, config=SEARCH_CONFIG)
+            vector = part if vector is None else vector + part
+        return vector
+
+    def index(self, pks):
+        DentalCariesStudy.objects.filter(pk__in=pks).update(search_vector=self._vector())
+
+    def remove(self, pks):
+        pass  # the vector lives on the study row itself
+
+    def rebuild(self):
+        return DentalCariesStudy.objects.update(search_vector=self._vector())
+
+    def _query(self, query, mode):
+        from django.contrib.postgres.search import SearchQuery
+
+        if mode == 'phrase':
+            return SearchQuery(query, search_type='phrase', config=SEARCH_CONFIG)
+        if mode == 'prefix':
+            words = [word for text, _ in _terms(query) for word in text.split()]
+            if not words:
+                return None
+            raw = ' & '.join(f"{word}:*" for word in words)
+            return SearchQuery(raw, search_type='raw', config=SEARCH_CONFIG)
+        return SearchQuery(query, search_type='websearch', config=SEARCH_CONFIG)
+
+    def search(self, queryset, query, mode):
+        from django.contrib.postgres.search import SearchHeadline, SearchRank
+
+        search_query = self._query(query, mode)
+        if search_query is None:
+            return None
+        document = Concat(
+            'title', Value(' '), 'authors', Value(' '),
+            Coalesce('journal', Value('')), Value(' '), Coalesce('notes', Value('')),
+        )
+        return queryset.filter(search_vector=search_query).annotate(
+            rank=SearchRank(F('search_vector'), search_query),
+            snippet=ExpressionWrapper(
+                SearchHeadline(
+                    document, search_query, config=SEARCH_CONFIG,
+                    start_sel=MARKERS[0], stop_sel=MARKERS[1], max_words=30, min_words=10,
+                ),
+                output_field=SnippetField(),
+            ),
+        )
+
+
+class SQLiteSearchBackend:
+    """FTS5 shadow table keyed on the study id, ranked with bm25"""
+
+    columns = [name for name, _, _ in SEARCH_FIELDS]
+
+    def ensure_schema(self):
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f"CREATE VIRTUAL TABLE IF NOT EXISTS {FTS_TABLE} "
+                f"USING fts5({', '.join(self.columns)}, tokenize='porter unicode61')"
+            )
+
+    def _copy_sql(self):
+        source = ', '.join(f"COALESCE({name}, '')" for name in self.columns)
+        return (
+            f"INSERT INTO {FTS_TABLE} (rowid, {', '.join(self.columns)}) "
+            f"SELECT id, {source} FROM {DentalCariesStudy._meta.db_table}"
+        )
+
+    def index(self, pks):
+        pks = list(pks)
+        placeholders = ', '.join(['%s'] * len(pks))
+        with connection.cursor() as cursor:
+            cursor.execute(f"DELETE FROM {FTS_TABLE} WHERE rowid IN ({placeholders})", pks)
+            cursor.execute(f"{self._copy_sql()} WHERE id IN ({placeholders})", pks)
+
+    def remove(self, pks):
+        pks = list(pks)
+        placeholders = ', '.join(['%s'] * len(pks))
+        with connection.cursor() as cursor:
+            cursor.execute(f"DELETE FROM {FTS_TABLE} WHERE rowid IN ({placeholders})", pks)
+
+    def rebuild(self):
+        with connection.cursor() as cursor:
+            cursor.execute(f"DELETE FROM {FTS_TABLE}")
+            cursor.execute(self._copy_sql())
+            return cursor.rowcount
+
+    def _match(self, query, mode):
+        terms = _terms(query)
+        if not terms:
+            return None
+        if mode == 'phrase':
+            return '"{}"'.format(' '.join(text for text, _ in terms))
+        if mode == 'prefix':
+            return ' '.join(f'"{word}"*' for text, _ in terms for word in text.split())
+        # websearch: AND of quoted terms, with a bare OR between terms kept as an operator
+        parts = []
+        for text, is_phrase in terms:
+            if text == 'OR' and not is_phrase:
+                if parts and parts[-1] != 'OR':
+                    parts.append('OR')
+                continue
+            parts.append(f'"{text}"')
+        if parts and parts[-1] == 'OR':
+            parts.pop()
+        return ' '.join(parts) if parts else None
+
+    def search(self, queryset, query, mode):
+        match = self._match(query, mode)
+        if match is None:
+            return None
+        table = DentalCariesStudy._meta.db_table
+        weights = ', '.join(str(weight) for _, _, weight in SEARCH_FIELDS)
+        correlated = f"FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH %s AND {FTS_TABLE}.rowid = {table}.id"
+        return queryset.filter(
+            pk__in=RawSQL(f"SELECT rowid FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH %s", (match,))
+        ).annotate(
+            # bm25() is lower-is-better; negate it so rank sorts like ts_rank
+            rank=RawSQL(f"SELECT -bm25({FTS_TABLE}, {weights}) {correlated}", (match,)),
+            snippet=RawSQL(
+                f"SELECT snippet({FTS_TABLE}, -1, %s, %s, '…', 16) {correlated}",
+                (*MARKERS, match), output_field=SnippetField(),
+            ),
+        )
+
+
+class IContainsSearchBackend:
+    """Fallback for other databases: unranked substring matching"""
+
+    def ensure_schema(self):
+        pass
+
+    def index(self, pks):
+        pass
+
+    def remove(self, pks):
+        pass
+
+    def rebuild(self):
+        return 0
+
+    def search(self, queryset, query, mode):
+        condition = Q()
+        for name, _, _ in SEARCH_FIELDS:
+            condition |= Q(**{f'{name}__icontains': query})
+        return queryset.filter(condition).annotate(
+            rank=Value(0.0), snippet=ExpressionWrapper(F('title'), output_field=SnippetField()),
+        )
+
+
+BACKENDS = {
+    'postgresql': PostgresSearchBackend,
+    'sqlite': SQLiteSearchBackend,
+}
+
+
+def get_backend():
+    return BACKENDS.get(connection.vendor, IContainsSearchBackend)()
+
+
+def search_studies(query, mode='websearch', queryset=None):
+    """Studies matching ``query``, annotated with ``rank`` and ``snippet``, best first"""
+    if mode not in SEARCH_MODES:
+        mode = 'websearch'
+    if queryset is None:
+        queryset = DentalCariesStudy.objects.all()
+    results = get_backend().search(queryset, query, mode) if _terms(query) else None
+    if results is None:
+        return queryset.none()
+    return results.order_by('-rank', '-publication_year')
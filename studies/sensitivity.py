@@ -0,0 +1,234 @@
+"""Sensitivity analyses: refits of the hierarchical model over a grid of specifications
+
+The protocol's sensitivity analyses vary the priors, the neighbourhood graph,
+the temporal smoothness and the likelihood. ``run_grid()`` expands a grid
+into ModelSpecs and fits them in a ProcessPoolExecutor. The stratum columns
+are copied once into shared memory blocks, and every worker attaches them
+read-only when it starts, so the strata are not pickled per task. Each fit
+becomes a SensitivityResult row holding DIC/WAIC, hyperparameters and key
+posteriors, and the rows form the comparison table of their SensitivityRun.
+"""
+import itertools
+import multiprocessing
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from multiprocessing import shared_memory
+from types import SimpleNamespace
+
+import numpy as np
+
+from . import analytics, bayes
+
+
+# Priors, neighbourhood structure, smoothness and likelihood family (24 fits)
+PROTOCOL_GRID = {
+    'likelihood': ['nbinomial', 'poisson'],
+    'graph': ['default', 'land_only'],
+    'temporal': ['rw2', 'rw1'],
+    'pc_u': [0.5, 1.0, 2.0],
+}
+
+REFERENCE = bayes.ModelSpec().to_dict()
+
+
+def expand_grid(grid):
+    """Validated spec dicts from a grid (option -> list of values) or a list of spec dicts
+
+    Raises ValueError for unknown options or invalid values.
+    """
+    if isinstance(grid, dict):
+        names = list(grid)
+        values = [value if isinstance(value, list) else [value] for value in grid.values()]
+        specs = [dict(zip(names, combination)) for combination in itertools.product(*values)]
+    elif isinstance(grid, list) and all(isinstance(spec, dict) for spec in grid):
+        specs = grid
+    else:
+        raise ValueError("grid must be an object of option lists or a list of spec objects")
+    expanded = []
+    for spec in specs:
+        full = bayes.ModelSpec.from_dict(spec).to_dict()
+        if full not in expanded:
+            expanded.append(full)
+    if not expanded:
+        raise ValueError("grid is empty")
+    return expanded
+
+
+def spec_label(spec):
+    """Options that differ from the reference specification, e.g. 'graph=land_only, pc_u=2.0'"""
+    changed = [f"{name}={value}" for name, value in spec.items() if REFERENCE.get(name) != value]
+    return ', '.join(changed) or 'reference'
+
+
+class SharedColumns:
+    """Copies of an analytics.Table's columns in shared memory; use as a context manager"""
+
+    def __init__(self, table):
+        self.blocks = []
+        self.descriptor = {'labels': table.labels, 'columns': {}}
+        for name, column in table.columns.items():
+            block = shared_memory.SharedMemory(create=True, size=max(column.nbytes, 1))
+            np.ndarray(column.shape, column.dtype, buffer=block.buf)[:] = column
+            self.blocks.append(block)
+            self.descriptor['columns'][name] = (block.name, column.dtype.str, column.shape)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        for block in self.blocks:
+            block.close()
+            block.unlink()
+
+
+def attach(descriptor):
+    """Read-only analytics.Table over shared columns; returns (table, blocks to keep open)"""
+    table = analytics.Table(analytics.STRATUM_COLUMNS)
+    table.labels = descriptor['labels']
+    columns, blocks = {}, []
+    for name, (block_name, dtype, shape) in descriptor['columns'].items():
+        block = shared_memory.SharedMemory(name=block_name)
+        column = np.ndarray(shape, np.dtype(dtype), buffer=block.buf)
+        column.flags.writeable = False
+        columns[name] = column
+        blocks.append(block)
+    table.columns = columns
+    return table, blocks
+
+
+_worker_state = {}
+
+
+def _init_worker(descriptor):
+    table, blocks = attach(descriptor)
+    _worker_state['frame'] = SimpleNamespace(strata=table)
+    _worker_state['blocks'] = blocks
+
+
+def comparison_row(result):
+    """Fit criteria, hyperparameters and key posteriors of a bayes.FitResult"""
+    baseline = bayes.summarize(np.exp(result.block_draws('intercept')))
+    fitted = bayes.summarize(np.exp(result.block_draws('intercept') + result.block_draws('spatial')))
+    return {
+        'dic': float(result.dic),
+        'p_dic': float(result.p_dic),
+        'waic': float(result.waic),
+        'p_waic': float(result.p_waic),
+        'log_marginal_likelihood': float(result.log_mlik),
+        'converged': bool(result.converged),
+        'hyperparameters': result.hyperparameters(),
+        'posteriors': {
+            'baseline_rate': {key: float(values[0]) for key, values in baseline.items()},
+            'fitted_province': {
+                code: {key: float(fitted[key][i]) for key in ('mean', 'q025', 'q975')}
+                for i, code in enumerate(bayes.spatial.PROVINCES)
+            },
+        },
+    }
+
+
+def _fit_spec(spec, frame=None):
+    """Fit one spec in a worker; failures are returned, not raised, so the grid carries on"""
+    started = time.perf_counter()
+    try:
+        row = comparison_row(bayes.fit(spec, frame=frame or _worker_state['frame']))
+    except Exception as exc:
+        row = {'error': f"{exc.__class__.__name__}: {exc}"}
+    row['elapsed'] = time.perf_counter() - started
+    return spec, row
+
+
+def run_grid(grid=None, name='protocol', processes=None, progress=None):
+    """Fit every spec of ``grid`` (PROTOCOL_GRID by default) in parallel and store a SensitivityRun
+
+    ``progress(done, total)`` is called after each fit. Raises ValueError for
+    an invalid grid.
+    """
+    from django.db import connections
+    from django.utils import timezone
+
+    from .models import SensitivityResult, SensitivityRun
+
+    specs = expand_grid(grid or PROTOCOL_GRID)
+    processes = max(1, min(processes or os.cpu_count() or 1, len(specs)))
+    run = SensitivityRun.objects.create(
+        name=name, grid=grid or PROTOCOL_GRID, n_specs=len(specs), processes=processes, status='running'
+    )
+    started = time.perf_counter()
+    rows = []
+    try:
+        strata = analytics.frame().strata
+        with SharedColumns(strata) as shared:
+            # Forked workers must not inherit the parent's database connections
+            connections.close_all()
+            with ProcessPoolExecutor(
+                max_workers=processes, mp_context=multiprocessing.get_context('fork'),
+                initializer=_init_worker, initargs=(shared.descriptor,),
+            ) as pool:
+                futures = [pool.submit(_fit_spec, spec) for spec in specs]
+                for done, future in enumerate(as_completed(futures), start=1):
+                    rows.append(future.result())
+                    if progress:
+                        progress(done, len(specs))
+    except Exception as exc:
+        SensitivityRun.objects.filter(pk=run.pk).update(
+            status='failed', message=f"{exc.__class__.__name__}: {exc}", finished_at=timezone.now()
+        )
+        raise
+
+    fitted = [row for _, row in rows if 'error' not in row]
+    best_dic = min((row['dic'] for row in fitted), default=None)
+    best_waic = min((row['waic'] for row in fitted), default=None)
+    results = []
+    for spec, row in rows:
+        failed = 'error' in row
+        results.append(SensitivityResult(
+            run=run,
+            label=spec_label(spec)[:255],
+            spec=spec,
+            status='failed' if failed else 'completed',
+            dic=row.get('dic'),
+            p_dic=row.get('p_dic'),
+            waic=row.get('waic'),
+            p_waic=row.get('p_waic'),
+            delta_dic=None if failed else row['dic'] - best_dic,
+            delta_waic=None if failed else row['waic'] - best_waic,
+            log_marginal_likelihood=row.get('log_marginal_likelihood'),
+            converged=row.get('converged', False),
+            hyperparameters=row.get('hyperparameters', {}),
+            posteriors=row.get('posteriors', {}),
+            error=row.get('error', ''),
+            elapsed=row['elapsed'],
+        ))
+    SensitivityResult.objects.bulk_create(results)
+    run.status = 'completed'
+    run.elapsed = time.perf_counter() - started
+    run.message = f"{len(rows) - len(fitted)} of {len(rows)} fits failed" if len(fitted) < len(rows) else ''
+    run.finished_at = timezone.now()
+    run.save()
+    return run
+
+
+def comparison_table(run):
+    """Rows of a SensitivityRun ordered by DIC, for the API and admin"""
+    return [
+        {
+            'label': result.label,
+            'spec': result.spec,
+            'status': result.status,
+            'dic': result.dic,
+            'delta_dic': result.delta_dic,
+            'p_dic': result.p_dic,
+            'waic': result.waic,
+            'delta_waic': result.delta_waic,
+            'p_waic': result.p_waic,
+            'log_marginal_likelihood': result.log_marginal_likelihood,
+            'converged': result.converged,
+            'hyperparameters': result.hyperparameters,
+            'posteriors': result.posteriors,
+            'error': result.error,
+            'elapsed': result.elapsed,
+        }
+        for result in run.results.order_by('status', 'dic')
+    ]
@@ -0,0 +1,127 @@
+"""Signal handlers keeping derived tables in step with study and stratum edits"""
+from django.db import transaction
+from django.db.models.signals import pre_save, post_save, post_delete
+from django.dispatch import receiver
+
+from . import caching, changelog, compositions, rollups, search
+from .models import DentalCariesStudy, CariesData, Crosswalk, CrosswalkRule
+
+
+def _stored_cell(study_pk):
+    """Rollup cell of the study as currently stored in the database"""
+    row = DentalCariesStudy.objects.filter(pk=study_pk).values(
+        'province', 'age_group', 'caries_index_used', 'publication_year', 'data_collection_start'
+    ).first()
+    if row is None:
+        return None
+    row['collection_year'] = row.pop('data_collection_start').year
+    return rollups.cell_key(row)
+
+
+@receiver(pre_save, sender=DentalCariesStudy)
+def remember_study_cell(sender, instance, raw=False, **kwargs):
+    instance._previous_cell = _stored_cell(instance.pk) if instance.pk and not raw else None
+
+
+@receiver(pre_save, sender=CariesData)
+def remember_stratum_study(sender, instance, raw=False, **kwargs):
+    previous = None
+    if instance.pk and not raw:
+        previous = CariesData.objects.filter(pk=instance.pk).values_list('study_id', flat=True).first()
+    instance._previous_study_id = previous
+
+
+@receiver(pre_save, sender=CariesData)
+def derive_care_index(sender, instance, raw=False, **kwargs):
+    # Derived from D/M/F when they are reported; otherwise the entered value stands
+    derived = compositions.stratum_care_index(instance.mean_decayed, instance.mean_missing, instance.mean_filled)
+    if derived is not None:
+        instance.care_index = derived
+
+
+@receiver(post_save, sender=DentalCariesStudy)
+def refresh_study_rollup(sender, instance, raw=False, **kwargs):
+    if raw:
+        return
+    rollups.schedule_refresh(getattr(instance, '_previous_cell', None), rollups.cell_key(instance))
+
+
+@receiver(post_delete, sender=DentalCariesStudy)
+def refresh_deleted_study_rollup(sender, instance, **kwargs):
+    rollups.schedule_refresh(rollups.cell_key(instance))
+
+
+@receiver(post_save, sender=CariesData)
+def refresh_stratum_rollup(sender, instance, raw=False, **kwargs):
+    if raw:
+        return
+    previous = getattr(instance, '_previous_study_id', None)
+    if previous and previous != instance.study_id:
+        rollups.schedule_refresh(_stored_cell(previous))
+    rollups.schedule_refresh(_stored_cell(instance.study_id))
+
+
+@receiver(post_delete, sender=CariesData)
+def refresh_deleted_stratum_rollup(sender, instance, **kwargs):
+    # If the parent study is already gone this is a no-op; the study's own
+    # post_delete handler covers that cell.
+    rollups.schedule_refresh(_stored_cell(instance.study_id))
+
+
+@receiver(post_save, sender=DentalCariesStudy)
+@receiver(post_delete, sender=DentalCariesStudy)
+@receiver(post_save, sender=CariesData)
+@receiver(post_delete, sender=CariesData)
+def invalidate_cached_responses(sender, raw=False, **kwargs):
+    # Registered after the rollup handlers, so the version moves only once
+    # the refreshed rollups are committed and visible to readers.
+    if not raw:
+        transaction.on_commit(caching.bump_data_version)
+
+
+@receiver(post_save, sender=Crosswalk)
+@receiver(post_delete, sender=Crosswalk)
+@receiver(post_save, sender=CrosswalkRule)
+@receiver(post_delete, sender=CrosswalkRule)
+def invalidate_harmonized_responses(sender, raw=False, **kwargs):
+    # Harmonized results are keyed on the crosswalk version, but edits within a version must show too
+    if not raw:
+        transaction.on_commit(caching.bump_data_version)
+
+
+@receiver(post_save, sender=DentalCariesStudy)
+def index_study_for_search(sender, instance, raw=False, **kwargs):
+    if not raw:
+        search.get_backend().index([instance.pk])
+
+
+@receiver(post_delete, sender=DentalCariesStudy)
+def remove_study_from_search(sender, instance, **kwargs):
+    search.get_backend().remove([instance.pk])
+
+
+@receiver(pre_save, sender=DentalCariesStudy)
+@receiver(pre_save, sender=CariesData)
+def remember_logged_row(sender, instance, raw=False, **kwargs):
+    if not raw:
+        changelog.remember(instance)
+
+
+@receiver(post_save, sender=DentalCariesStudy)
+@receiver(post_save, sender=CariesData)
+def log_save(sender, instance, created, raw=False, **kwargs):
+    if not raw:
+        changelog.log_save(instance, created)
+
+
+@receiver(post_delete, sender=DentalCariesStudy)
+@receiver(post_delete, sender=CariesData)
+def log_delete(sender, instance, **kwargs):
+    changelog.log_delete(instance)
+
+
+def build_search_index(sender, **kwargs):
+    """Create the backend's search structures (GIN index or FTS5 table) after migrate"""
+    backend = search.get_backend()
+    backend.ensure_schema()
+    backend.rebuild()
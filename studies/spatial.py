@@ -0,0 +1,334 @@
+"""Neighbourhood structure of the Canadian provinces and territories
+
+Provinces and territories are neighbours when they share a land border.
+Following the protocol, the island provinces are linked by their fixed and
+ferry crossings (PE-NB Confederation Bridge, PE-NS and NL-NS ferries) so
+the graph is connected. ``land_only`` drops those maritime links and leaves
+PE and the island of Newfoundland attached only where land allows.
+
+Other geographies (health regions, say) plug in through ``register_graph()``
+with their own node list. Adjacency and weight matrices are built once per
+graph and reused. On top of the graphs sit the spatial statistics the
+protocol asks for: Moran's I with a permutation test, where all permutations
+are evaluated as one matrix product; Marshall empirical-Bayes rates (global
+or over each node's neighbourhood); and Gaussian ICAR smoothing of area
+estimates, with the smoothing precision picked by restricted likelihood over
+a grid evaluated as a batch of small linear systems.
+"""
+import functools
+import hashlib
+
+import numpy as np
+from django.core.cache import cache
+from scipy import sparse
+from scipy.sparse import csgraph
+
+from . import analytics, estimates, meta
+
+
+PROVINCES = ['BC', 'AB', 'SK', 'MB', 'ON', 'QC', 'NB', 'NS', 'PE', 'NL', 'YT', 'NT', 'NU']
+
+LAND_BORDERS = [
+    ('BC', 'AB'), ('BC', 'YT'), ('BC', 'NT'),
+    ('AB', 'SK'), ('AB', 'NT'),
+    ('SK', 'MB'), ('SK', 'NT'),
+    ('MB', 'ON'), ('MB', 'NU'),
+    ('ON', 'QC'),
+    ('QC', 'NB'), ('QC', 'NL'),
+    ('NB', 'NS'),
+    ('YT', 'NT'),
+    ('NT', 'NU'),
+]
+
+MARITIME_LINKS = [('PE', 'NB'), ('PE', 'NS'), ('NL', 'NS')]
+
+GRAPHS = {
+    'default': LAND_BORDERS + MARITIME_LINKS,
+    'land_only': LAND_BORDERS,
+}
+
+# Node list of every graph that is not over PROVINCES
+NODES = {}
+
+PERMUTATIONS = 9999
+PERMUTATION_CHUNK = 20000  # permutations evaluated per matrix product
+TAU_GRID = np.logspace(-3, 4, 141)
+
+
+def register_graph(name, edges, nodes=None):
+    """Add a neighbourhood graph, e.g. of health regions, given its edges and node codes
+
+    ``nodes`` defaults to PROVINCES. Raises ValueError for an edge between
+    unknown nodes.
+    """
+    nodes = list(nodes or PROVINCES)
+    unknown = {code for edge in edges for code in edge} - set(nodes)
+    if unknown:
+        raise ValueError(f"edges reference unknown nodes: {', '.join(sorted(unknown))}")
+    GRAPHS[name] = list(edges)
+    if nodes == PROVINCES:
+        NODES.pop(name, None)
+    else:
+        NODES[name] = nodes
+    _adjacency.cache_clear()
+
+
+def graph_nodes(graph='default'):
+    """Node codes of ``graph``, in matrix order"""
+    return NODES.get(graph, PROVINCES)
+
+
+@functools.lru_cache(maxsize=None)
+def _adjacency(graph):
+    nodes = graph_nodes(graph)
+    index = {code: i for i, code in enumerate(nodes)}
+    rows, cols = [], []
+    for a, b in GRAPHS[graph]:
+        rows += [index[a], index[b]]
+        cols += [index[b], index[a]]
+    size = len(nodes)
+    adjacency = sparse.csr_matrix((np.ones(len(rows)), (rows, cols)), shape=(size, size))
+    adjacency.data.flags.writeable = False
+    return adjacency
+
+
+def adjacency_matrix(graph='default'):
+    """Symmetric 0/1 adjacency matrix (CSR) over the graph's nodes, built once per graph; do not modify"""
+    return _adjacency(graph)
+
+
+def weights_matrix(adjacency):
+    """Row-standardized spatial weights (dense); nodes without neighbours get a zero row"""
+    adjacency = adjacency.toarray() if sparse.issparse(adjacency) else np.asarray(adjacency, dtype=np.float64)
+    degree = adjacency.sum(axis=1, keepdims=True)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return np.where(degree > 0, adjacency / degree, 0.0)
+
+
+def icar_structure(adjacency):
+    """ICAR structure matrix R = D - W (precision up to the scale τ)"""
+    degree = np.asarray(adjacency.sum(axis=1)).ravel()
+    return (sparse.diags(degree) - adjacency).tocsr()
+
+
+def scaled_icar_structure(adjacency):
+    """ICAR structure scaled so the geometric mean of the marginal variances is 1
+
+    Sørbye & Rue (2014) scaling, as used by BYM2: τ then means the same
+    thing whatever the graph. Isolated nodes (a disconnected graph) get an
+    independent unit-variance term instead of an improper one.
+    """
+    structure = icar_structure(adjacency).toarray()
+    isolated = np.diag(structure) == 0
+    connected = ~isolated
+    scaled = np.zeros_like(structure)
+    if connected.any():
+        block = structure[np.ix_(connected, connected)]
+        variances = np.diag(np.linalg.pinv(block))
+        scale = np.exp(np.mean(np.log(variances)))
+        scaled[np.ix_(connected, connected)] = block * scale
+    scaled[isolated, isolated] = 1.0
+    return sparse.csr_matrix(scaled)
+
+
+def component_labels(adjacency):
+    """Connected component index of every node"""
+    _, labels = csgraph.connected_components(adjacency, directed=False)
+    return labels
+
+
+def morans_i(values, graph='default', permutations=PERMUTATIONS, seed=None):
+    """Global Moran's I of node ``values`` with row-standardized weights and a permutation test
+
+    NaN values drop their node (and its links) from the graph. The
+    permutations are drawn as one (permutations x nodes) index array and
+    scored together: z'Wz is a row-wise product of permuted z with permuted
+    zW, and z'z does not change under permutation. The p-value is two-sided,
+    (1 + #{|I_perm - E| >= |I - E|}) / (1 + permutations). Raises ValueError
+    with fewer than three linked nodes.
+    """
+    values = np.asarray(values, dtype=np.float64)
+    observed = np.isfinite(values)
+    adjacency = adjacency_matrix(graph).toarray()[np.ix_(observed, observed)]
+    weights = weights_matrix(adjacency)
+    n, s0 = int(observed.sum()), weights.sum()
+    if n < 3 or s0 == 0:
+        raise ValueError("Moran's I needs at least three observed nodes with neighbours")
+
+    z = values[observed] - values[observed].mean()
+    scale = n / s0 / (z @ z) if z @ z > 0 else np.nan
+    statistic = scale * (z @ weights @ z)
+    expected = -1 / (n - 1)
+
+    rng = np.random.default_rng(seed)
+    simulated = np.empty(permutations)
+    for start in range(0, permutations, PERMUTATION_CHUNK):
+        count = min(PERMUTATION_CHUNK, permutations - start)
+        shuffled = z[rng.permuted(np.tile(np.arange(n), (count, 1)), axis=1)]
+        simulated[start:start + count] = scale * np.einsum('pi,pi->p', shuffled @ weights.T, shuffled)
+
+    with np.errstate(invalid='ignore', divide='ignore'):
+        extreme = np.abs(simulated - expected) >= np.abs(statistic - expected) - 1e-12
+        sd = simulated.std(ddof=1) if permutations > 1 else np.nan
+        return {
+            'i': float(statistic),
+            'expected': expected,
+            'permutation_mean': float(simulated.mean()) if permutations else None,
+            'permutation_sd': float(sd),
+            'z_score': float((statistic - simulated.mean()) / sd) if permutations > 1 else None,
+            'p_value': float((1 + extreme.sum()) / (1 + permutations)),
+            'permutations': permutations,
+            'nodes': n,
+        }
+
+
+def empirical_bayes(events, population, graph=None):
+    """Marshall (1991) empirical-Bayes rates shrunk towards the global mean, or the local mean over
+    each node and its neighbours when ``graph`` is given
+
+    ``events`` and ``population`` are arrays over the graph's nodes (PROVINCES
+    for the global estimator); nodes with no population get the prior mean.
+    Returns (rates, prior means).
+    """
+    events = np.nan_to_num(np.asarray(events, dtype=np.float64))
+    population = np.nan_to_num(np.asarray(population, dtype=np.float64))
+    with np.errstate(invalid='ignore', divide='ignore'):
+        rate = np.where(population > 0, events / population, 0.0)
+        if graph is None:
+            neighbourhood = np.ones((len(events), len(events)))
+        else:
+            neighbourhood = adjacency_matrix(graph).toarray() + np.eye(len(events))
+        # Neighbourhood moments of the rates, weighted by population, for every node at once
+        weight = neighbourhood @ population
+        mean = neighbourhood @ events / weight
+        areas = neighbourhood @ (population > 0)
+        spread = (neighbourhood @ (population * rate ** 2) - 2 * mean * (neighbourhood @ (population * rate))
+                  + mean ** 2 * weight) / weight
+        variance = np.maximum(spread - mean / (weight / areas), 0)
+        shrinkage = np.where(population > 0, variance / (variance + mean / population), 0.0)
+        return mean + np.nan_to_num(shrinkage) * (rate - mean), mean
+
+
+def icar_smooth(estimates, variances, graph='default', tau_grid=TAU_GRID):
+    """Gaussian ICAR smoothing of area ``estimates`` with sampling ``variances``
+
+    Model: y_i ~ N(θ_i, v_i), θ ~ ICAR(τ) with a flat level per connected
+    component. Nodes without an estimate are filled in from their
+    neighbours. τ maximizes the restricted likelihood over ``tau_grid``; all
+    grid points are solved as one batch. Returns a dict of ``estimate`` and
+    ``sd`` arrays over the graph's nodes (NaN for components with no data)
+    and the chosen ``tau``.
+    """
+    y = np.asarray(estimates, dtype=np.float64)
+    v = np.asarray(variances, dtype=np.float64)
+    observed = np.isfinite(y) & np.isfinite(v) & (v > 0)
+    adjacency = adjacency_matrix(graph)
+    labels = component_labels(adjacency)
+    # Components with no observed node have no level to anchor them
+    keep = np.isin(labels, labels[observed])
+    estimate, sd = np.full(len(y), np.nan), np.full(len(y), np.nan)
+    if not keep.any():
+        return {'estimate': estimate, 'sd': sd, 'tau': None}
+
+    structure = icar_structure(adjacency).toarray()[np.ix_(keep, keep)]
+    precision = np.where(observed, 1 / np.where(observed, v, 1.0), 0.0)[keep]
+    data = np.where(observed, y, 0.0)[keep]
+    rank = keep.sum() - len(np.unique(labels[keep]))
+
+    tau = np.asarray(tau_grid, dtype=np.float64)
+    posterior = np.diag(precision)[None] + tau[:, None, None] * structure[None]
+    b = precision * data
+    mean = np.linalg.solve(posterior, np.broadcast_to(b, (len(tau), len(b)))[..., None])[..., 0]
+    _, logdet = np.linalg.slogdet(posterior)
+    log_likelihood = 0.5 * rank * np.log(tau) - 0.5 * logdet + 0.5 * (mean @ b)
+    best = int(np.argmax(log_likelihood))
+
+    estimate[keep] = mean[best]
+    sd[keep] = np.sqrt(np.diag(np.linalg.inv(posterior[best])))
+    return {'estimate': estimate, 'sd': sd, 'tau': float(tau[best])}
+
+
+def province_map(outcome='prevalence', graph='default', permutations=PERMUTATIONS, seed=2050, harmonize=None):
+    """Raw, empirical-Bayes and ICAR-smoothed estimates per province with Moran's I, memoized per data version
+
+    Raw estimates are random-effects pools of each province's strata
+    (prevalence on the logit scale, reported as a percentage). Moran's I is
+    given for the raw estimates and for the residuals from the smoothed
+    surface. ``harmonize`` converts the strata to one caries index first.
+    Raises ValueError for an unknown outcome, graph or harmonization target.
+    """
+    if outcome not in meta.OUTCOMES:
+        raise ValueError(f"outcome must be one of: {', '.join(meta.OUTCOMES)}")
+    if graph not in GRAPHS or graph_nodes(graph) != PROVINCES:
+        raise ValueError(f"graph must be a province graph: {', '.join(g for g in GRAPHS if g not in NODES)}")
+    frame = analytics.frame(harmonize)
+    signature = f"{outcome}|{graph}|{permutations}|{seed}"
+    key = f"spatial:v{frame.version}:{hashlib.md5(signature.encode()).hexdigest()}"
+    result = cache.get(key)
+    if result is not None:
+        return result
+
+    strata = frame.strata
+    index = {code: i for i, code in enumerate(PROVINCES)}
+    codes = np.array(strata.decode('province', strata.columns['province']), dtype=object)
+    province = np.array([index.get(code, -1) for code in codes], dtype=np.int64)
+    y, v = meta._effects(strata, outcome, 'logit')
+    n = strata.columns['sample_size_group'].astype(np.float64)
+    usable = (province >= 0) & np.isfinite(y) & np.isfinite(v) & (v > 0) & (n > 0)
+    size = len(PROVINCES)
+    fit = meta.random_effects(y[usable], v[usable], province[usable], size)
+    observed = fit['k'] > 0
+    raw = np.where(observed, fit['mu'], np.nan)
+    smoothed = icar_smooth(raw, np.where(observed, fit['se'] ** 2, np.nan), graph)
+
+    # Events per province for the empirical-Bayes rates (children with caries, or dmft teeth)
+    value = strata.columns['caries_prevalence'] / 100 if outcome == 'prevalence' else strata.columns['mean_dmft_DMFT']
+    counted = (province >= 0) & np.isfinite(value) & (n > 0)
+    events = np.bincount(province[counted], weights=(value * n)[counted], minlength=size)
+    population = np.bincount(province[counted], weights=n[counted], minlength=size)
+    eb_global, _ = empirical_bayes(events, population)
+    eb_local, _ = empirical_bayes(events, population, graph)
+
+    def report(values):
+        if outcome == 'prevalence':
+            return 100 / (1 + np.exp(-values))
+        return values
+
+    scale = 100 if outcome == 'prevalence' else 1
+    lower = smoothed['estimate'] - estimates.Z_95 * smoothed['sd']
+    upper = smoothed['estimate'] + estimates.Z_95 * smoothed['sd']
+    rows = []
+    for i, code in enumerate(PROVINCES):
+        rows.append({
+            'province': code,
+            'strata': int(fit['k'][i]),
+            'participants': int(population[i]),
+            'raw': _clean(report(raw[i])),
+            'empirical_bayes': _clean(eb_global[i] * scale),
+            'empirical_bayes_local': _clean(eb_local[i] * scale),
+            'smoothed': _clean(report(smoothed['estimate'][i])),
+            'smoothed_lower': _clean(report(lower[i])),
+            'smoothed_upper': _clean(report(upper[i])),
+        })
+
+    def moran(values):
+        try:
+            return morans_i(values, graph, permutations, seed)
+        except ValueError:
+            return None
+
+    result = {
+        'outcome': outcome,
+        'graph': graph,
+        'tau': smoothed['tau'],
+        'provinces': rows,
+        'morans_i': moran(raw),
+        'morans_i_residual': moran(raw - smoothed['estimate']),
+    }
+    cache.set(key, result)
+    return result
+
+
+def _clean(value):
+    value = float(value)
+    return value if np.isfinite(value) else None
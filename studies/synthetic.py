@@ -0,0 +1,262 @@
+"""Synthetic studies, caries strata and extraction notes for benchmarking at scale
+
+The distributions follow the shape of the extracted Canadian literature.
+Provinces are drawn by population share, and publication years skew
+towards recent decades. Each age group has its own caries index, age
+categories and prevalence level. Prevalence declines over time and varies
+by province and socioeconomic status. Mean dmft/DMFT follows prevalence,
+and the D/M/F split moves towards filled teeth in later years. Everything
+is drawn as NumPy arrays per batch and written with bulk_create. Every
+synthetic study_id starts with PREFIX, so ``clear()`` removes them without
+touching real data, and studies.changelog leaves them out of the change
+feed that replicas copy.
+"""
+import itertools
+import re
+
+import numpy as np
+from django.db import transaction
+from django.db.models.functions import Length
+
+from . import caching, rollups, search
+from .models import CariesData, DataExtractionNote, DentalCariesStudy
+
+
+PREFIX = 'SYN-'
+
+PROVINCE_WEIGHTS = {
+    'ON': 0.385, 'QC': 0.22, 'BC': 0.135, 'AB': 0.115, 'MB': 0.036, 'SK': 0.03, 'NS': 0.026,
+    'NB': 0.021, 'NL': 0.013, 'PE': 0.004, 'NT': 0.002, 'NU': 0.002, 'YT': 0.001, 'national': 0.01,
+}
+# Territories and the Atlantic provinces report more caries; the prairies sit near the mean
+PROVINCE_EFFECTS = {'NU': 1.2, 'NT': 0.8, 'YT': 0.4, 'NL': 0.3, 'NB': 0.2, 'NS': 0.1, 'PE': 0.1, 'MB': 0.25,
+                    'SK': 0.2, 'QC': 0.1, 'AB': 0.0, 'ON': -0.1, 'BC': -0.15, 'national': 0.0}
+
+# age group: (weight, age range, age categories, logit prevalence in 2000, dmft when affected, indices)
+AGE_GROUPS = {
+    'preschool': (0.25, (2, 5), ['3 years', '4 years', '5 years', '3-5 years'], -0.6, 4.5,
+                  {'dmft': 0.8, 'dmfs': 0.2}),
+    'school_age': (0.35, (6, 12), ['6 years', '8 years', '10 years', '12 years', '6-12 years'], 0.2, 3.5,
+                   {'dmft_DMFT': 0.45, 'dmft': 0.3, 'DMFT': 0.25}),
+    'adolescent': (0.18, (13, 18), ['13 years', '15 years', '15-17 years', '13-18 years'], 0.5, 4.0,
+                   {'DMFT': 0.8, 'DMFS': 0.2}),
+    'adult': (0.12, (19, 64), ['19-34 years', '35-44 years', '45-64 years'], 2.5, 11.0,
+              {'DMFT': 0.75, 'DMFS': 0.25}),
+    'elderly': (0.06, (65, 90), ['65-74 years', '75+ years'], 3.5, 20.0, {'DMFT': 0.7, 'DMFS': 0.3}),
+    'mixed': (0.04, (3, 18), ['3-18 years', '6-18 years'], 0.3, 3.8, {'dmft_DMFT': 0.8, 'other': 0.2}),
+}
+
+DESIGNS = {'cross_sectional': 0.7, 'longitudinal': 0.08, 'cohort': 0.12, 'case_control': 0.04,
+           'randomized_trial': 0.03, 'other': 0.03}
+SETTINGS = {'school': 0.45, 'population': 0.25, 'community': 0.15, 'clinic': 0.12, 'other': 0.03}
+CRITERIA = {'who_1997': 0.45, 'who_2013': 0.3, 'icdas': 0.15, 'other': 0.1}
+RISK_OF_BIAS = {'low': 0.35, 'moderate': 0.4, 'high': 0.15, 'unclear': 0.1}
+SEXES = ['male', 'female', 'mixed']
+SES_EFFECTS = {'low': 0.5, 'middle': 0.0, 'high': -0.4, 'mixed': 0.0, 'not_specified': 0.0}
+NOTE_TYPES = {'extraction': 0.5, 'quality': 0.25, 'clarification': 0.15, 'exclusion': 0.05, 'other': 0.05}
+
+SURNAMES = ['Tremblay', 'Smith', 'Roy', 'Gagnon', 'Lee', 'Wilson', 'Johnson', 'MacDonald', 'Taylor', 'Martin',
+            'Brown', 'Singh', 'Nguyen', 'Chen', 'Leblanc', 'Campbell', 'Anderson', 'Morin', 'Patel', 'Clarke']
+JOURNALS = ['Journal of the Canadian Dental Association', 'Community Dentistry and Oral Epidemiology',
+            'Canadian Journal of Public Health', 'BMC Oral Health', 'Journal of Public Health Dentistry',
+            'Caries Research', 'International Journal of Paediatric Dentistry']
+NOTE_TEXTS = {
+    'extraction': "Strata extracted from the tables; totals reconciled with the reported sample size.",
+    'quality': "Quality appraisal: sampling frame and examiner calibration reported.",
+    'clarification': "Age bands in the text and tables disagree; authors contacted.",
+    'exclusion': "Duplicate publication of an included survey; strata kept from the primary report.",
+    'other': "Index converted from the reported surface counts.",
+}
+
+
+def _choice(rng, weights, size):
+    names = list(weights)
+    p = np.array(list(weights.values()), dtype=np.float64)
+    return np.array(names, dtype=object)[rng.choice(len(names), size=size, p=p / p.sum())]
+
+
+def _expit(x):
+    return 1 / (1 + np.exp(-x))
+
+
+def _studies(rng, start, count):
+    """Unsaved DentalCariesStudy objects and the per-study arrays the strata are drawn from"""
+    province = _choice(rng, PROVINCE_WEIGHTS, count)
+    age_group = _choice(rng, {name: spec[0] for name, spec in AGE_GROUPS.items()}, count)
+    year = 1970 + np.floor(55 * rng.beta(2.2, 1.0, count)).astype(int)
+    collection_year = year - rng.integers(1, 5, count)
+    start_day = rng.integers(0, 300, count)
+    duration = rng.integers(30, 400, count)
+    sample_size = np.maximum(np.round(rng.lognormal(6.0, 1.1, count)), 30).astype(int)
+    design = _choice(rng, DESIGNS, count)
+    setting = _choice(rng, SETTINGS, count)
+    criteria = _choice(rng, CRITERIA, count)
+    risk = _choice(rng, RISK_OF_BIAS, count)
+    quality = rng.integers(3, 11, count)
+    province_labels = dict(DentalCariesStudy._meta.get_field('province').choices)
+
+    studies = []
+    for i in range(count):
+        group = AGE_GROUPS[age_group[i]]
+        begin = np.datetime64(f'{collection_year[i]}-01-01') + int(start_day[i])
+        authors = ', '.join(rng.choice(SURNAMES, size=int(rng.integers(1, 6)), replace=False))
+        studies.append(DentalCariesStudy(
+            study_id=f"{PREFIX}{start + i:07d}",
+            title=(
+                f"Dental caries experience among {age_group[i].replace('_', ' ')} participants in "
+                f"{province_labels[province[i]]}: a {design[i].replace('_', ' ')} survey ({year[i]})"
+            ),
+            authors=authors,
+            journal=JOURNALS[int(rng.integers(len(JOURNALS)))],
+            publication_year=int(year[i]),
+            doi=f"10.5555/dcps.synthetic.{start + i}",
+            study_design=design[i],
+            study_setting=setting[i],
+            province=province[i],
+            sample_size=int(sample_size[i]),
+            age_group=age_group[i],
+            age_min=float(group[1][0]),
+            age_max=float(group[1][1]),
+            data_collection_start=begin.item(),
+            data_collection_end=(begin + int(duration[i])).item(),
+            caries_index_used=_choice(rng, group[5], 1)[0],
+            examination_criteria=criteria[i],
+            quality_score=int(quality[i]),
+            risk_of_bias=risk[i],
+            extracted_by='generate_synthetic',
+        ))
+    return studies, {'province': province, 'age_group': age_group, 'year': collection_year,
+                     'sample_size': sample_size}
+
+
+def _strata(rng, study_pks, drawn, strata_per_study):
+    """Unsaved CariesData objects for a batch of saved studies"""
+    count = len(study_pks)
+    # Unique (sex, age category, SES) combinations per study, at least one stratum each
+    k = np.minimum(1 + rng.poisson(strata_per_study - 1, count), 40)
+    rows = []
+    for i in range(count):
+        group = AGE_GROUPS[drawn['age_group'][i]]
+        combos = list(itertools.product(SEXES, group[2], SES_EFFECTS))
+        picked = rng.choice(len(combos), size=min(int(k[i]), len(combos)), replace=False)
+        rows += [(i, *combos[j]) for j in picked]
+    index = np.array([row[0] for row in rows])
+    size = len(rows)
+
+    group_spec = [AGE_GROUPS[drawn['age_group'][i]] for i in index]
+    baseline = np.array([spec[3] for spec in group_spec])
+    affected_mean = np.array([spec[4] for spec in group_spec])
+    year = drawn['year'][index]
+    province_effect = np.array([PROVINCE_EFFECTS[drawn['province'][i]] for i in index])
+    ses_effect = np.array([SES_EFFECTS[row[3]] for row in rows])
+    logit = baseline + province_effect + ses_effect - 0.03 * (year - 2000) + rng.normal(0, 0.5, size)
+    p = _expit(logit)
+
+    # Split the study sample across its strata
+    shares = rng.dirichlet(np.ones(size)) if size else np.empty(0)
+    per_study = np.bincount(index, weights=shares, minlength=count)
+    n = np.maximum(np.round(drawn['sample_size'][index] * shares / per_study[index]), 10).astype(int)
+    half_width = 1.959963984540054 * np.sqrt(p * (1 - p) / n)
+    reports_ci = rng.random(size) < 0.6
+
+    mean = p * affected_mean * rng.lognormal(0, 0.25, size)
+    sd = mean * rng.uniform(0.8, 1.6, size)
+    # Filled teeth take a growing share of dmft over time
+    filled_share = np.clip(0.25 + 0.012 * (year - 1975), 0.2, 0.75)
+    parts = rng.dirichlet([3, 1, 3], size) * 0.5 + np.stack(
+        [(1 - filled_share) * 0.8, (1 - filled_share) * 0.2, filled_share], axis=1) * 0.5
+    reports_parts = rng.random(size) < 0.7
+    decayed, missing, filled = (parts * mean[:, None]).T
+    with np.errstate(invalid='ignore', divide='ignore'):
+        care = np.round(filled / (decayed + missing + filled) * 100, 2)
+
+    objects = []
+    for j, (i, sex, age_category, ses) in enumerate(rows):
+        objects.append(CariesData(
+            study_id=study_pks[i],
+            sex=sex,
+            age_category=age_category,
+            socioeconomic_status=ses,
+            sample_size_group=int(n[j]),
+            caries_prevalence=round(float(p[j] * 100), 2),
+            caries_prevalence_ci_lower=round(float(max(p[j] - half_width[j], 0) * 100), 2) if reports_ci[j] else None,
+            caries_prevalence_ci_upper=round(float(min(p[j] + half_width[j], 1) * 100), 2) if reports_ci[j] else None,
+            mean_dmft_DMFT=round(float(mean[j]), 2),
+            mean_dmft_DMFT_sd=round(float(sd[j]), 2),
+            mean_decayed=round(float(decayed[j]), 2) if reports_parts[j] else None,
+            mean_missing=round(float(missing[j]), 2) if reports_parts[j] else None,
+            mean_filled=round(float(filled[j]), 2) if reports_parts[j] else None,
+            care_index=float(care[j]) if reports_parts[j] and np.isfinite(care[j]) else None,
+        ))
+    return objects
+
+
+def _notes(rng, study_pks, notes_per_study):
+    count = rng.poisson(notes_per_study, len(study_pks))
+    types = _choice(rng, NOTE_TYPES, int(count.sum()))
+    owners = np.repeat(study_pks, count)
+    return [
+        DataExtractionNote(study_id=int(pk), note_type=kind, note_text=NOTE_TEXTS[kind], created_by='generate_synthetic')
+        for pk, kind in zip(owners, types)
+    ]
+
+
+def _next_number():
+    """One past the highest numeric suffix of the existing synthetic study ids (0 if there are none)"""
+    last = DentalCariesStudy.objects.filter(
+        study_id__regex=rf'^{re.escape(PREFIX)}[0-9]+$'
+    ).order_by(Length('study_id').desc(), '-study_id').values_list('study_id', flat=True).first()
+    return int(last[len(PREFIX):]) + 1 if last else 0
+
+
+def generate(studies, strata_per_study=4, notes_per_study=0.6, seed=None, batch_size=2000, progress=None):
+    """Create ``studies`` synthetic studies with their strata and notes; returns (studies, strata, notes)
+
+    Each batch is one transaction. Derived tables are rebuilt once at the end,
+    as the DET importer does. ``progress(done, total)`` is called after each batch.
+    """
+    rng = np.random.default_rng(seed)
+    start = _next_number()
+    totals = [0, 0, 0]
+    for offset in range(0, studies, batch_size):
+        count = min(batch_size, studies - offset)
+        objects, drawn = _studies(rng, start + offset, count)
+        labels = [study.study_id for study in objects]
+        with transaction.atomic():
+            DentalCariesStudy.objects.bulk_create(objects, batch_size=batch_size)
+            pks = dict(DentalCariesStudy.objects.filter(study_id__in=labels).values_list('study_id', 'pk'))
+            study_pks = np.array([pks[label] for label in labels])
+            strata = _strata(rng, study_pks, drawn, strata_per_study)
+            CariesData.objects.bulk_create(strata, batch_size=batch_size)
+            notes = _notes(rng, study_pks, notes_per_study)
+            DataExtractionNote.objects.bulk_create(notes, batch_size=batch_size)
+        totals[0] += count
+        totals[1] += len(strata)
+        totals[2] += len(notes)
+        if progress:
+            progress(offset + count, studies)
+
+    # bulk_create bypasses the post_save handlers that maintain derived tables
+    if studies:
+        _refresh_derived()
+    return tuple(totals)
+
+
+def clear():
+    """Delete every synthetic study with its strata and notes; returns the number of studies removed"""
+    studies = DentalCariesStudy.objects.filter(study_id__startswith=PREFIX)
+    count = studies.count()
+    with transaction.atomic():
+        # Raw deletes skip the per-row signal handlers; derived tables are rebuilt once below
+        CariesData.objects.filter(study__in=studies)._raw_delete(CariesData.objects.db)
+        DataExtractionNote.objects.filter(study__in=studies)._raw_delete(DataExtractionNote.objects.db)
+        studies._raw_delete(studies.db)
+    if count:
+        _refresh_derived()
+    return count
+
+
+def _refresh_derived():
+    rollups.rebuild()
+    search.get_backend().rebuild()
+    caching.bump_data_version()
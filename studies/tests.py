@@ -0,0 +1,125 @@
+"""Query budgets of the public views (see studies.profiling)
+
+Each test requests one budgeted view with PROFILING_ENFORCE_BUDGETS on, so
+going over the view's ``query_budget`` raises QueryBudgetExceeded and fails
+the test. Caches are cleared first, so every request pays for its cold path
+(analytics refresh included). Pages whose template is not in this tree are
+rendered from STUB_TEMPLATES, which touch the same context a page does.
+"""
+from unittest import mock
+
+from django.conf import settings
+from django.core.cache import cache
+from django.template import TemplateDoesNotExist
+from django.test import TestCase, override_settings
+from django.urls import reverse
+
+from . import analytics, synthetic, views
+from .models import DentalCariesStudy
+from .profiling import QueryBudgetExceeded
+
+
+STUB_TEMPLATES = {
+    'studies/study_list.html': (
+        "{% for study in studies %}{{ study.study_id }} {{ study.title }} {{ study.province }}{% endfor %}"
+        "{% for province in filter_options.provinces %}{{ province }}{% endfor %}"
+        "{% for age_group in filter_options.age_groups %}{{ age_group }}{% endfor %}"
+        "{% for index in filter_options.caries_indices %}{{ index }}{% endfor %}"
+        "{{ filter_options.year_range }} {{ page_obj.paginator.count }}"
+    ),
+    'studies/study_search.html': "{% for study in studies %}{{ study.title }} {{ study.snippet }}{% endfor %}",
+    'studies/study_detail.html': (
+        "{{ study.title }}"
+        "{% for stratum in caries_data %}{{ stratum.sex }} {{ stratum.caries_prevalence }}{% endfor %}"
+        "{% for note in extraction_notes %}{{ note.note }}{% endfor %}"
+        "{% for related in related_studies %}{{ related.title }}{% endfor %}"
+        "{{ influence }}"
+    ),
+    'studies/dashboard.html': (
+        "{{ provincial_data }} {{ age_group_data }} {{ model_fit }} {{ model_estimates }} {{ province_map }}"
+    ),
+    'studies/trends.html': "{{ temporal_data }} {{ projection_fans }}",
+}
+
+
+def stub_templates():
+    """TEMPLATES falling back to STUB_TEMPLATES for pages the project has no template for"""
+    engine = dict(settings.TEMPLATES[0], APP_DIRS=False)
+    engine['OPTIONS'] = dict(engine['OPTIONS'], loaders=[
+        'django.template.loaders.filesystem.Loader',
+        'django.template.loaders.app_directories.Loader',
+        ('django.template.loaders.locmem.Loader', STUB_TEMPLATES),
+    ])
+    return [engine]
+
+
+@override_settings(PROFILING_ENFORCE_BUDGETS=True, PROFILING_SAMPLE_RATE=0.0, TEMPLATES=stub_templates())
+class QueryBudgetTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        synthetic.generate(40, seed=1)
+        cls.study_id = DentalCariesStudy.objects.order_by('pk').values_list('study_id', flat=True).first()
+
+    def setUp(self):
+        cache.clear()
+        analytics.reset()
+
+    def assertWithinBudget(self, name, query='', **kwargs):
+        url = reverse(f'studies:{name}', kwargs=kwargs)
+        response = self.client.get(f'{url}?{query}' if query else url)
+        self.assertEqual(response.status_code, 200, url)
+        return response
+
+    def test_home(self):
+        self.assertWithinBudget('home')
+
+    def test_study_list(self):
+        self.assertWithinBudget('study_list', 'province=ON&sort=-publication_year')
+
+    def test_study_search(self):
+        self.assertWithinBudget('study_search', 'q=caries')
+
+    def test_study_detail(self):
+        self.assertWithinBudget('detail', study_id=self.study_id)
+
+    def test_dashboard(self):
+        self.assertWithinBudget('dashboard')
+
+    def test_analytics(self):
+        self.assertWithinBudget('analytics')
+
+    def test_trends(self):
+        self.assertWithinBudget('trends')
+
+    def test_caries_by_province(self):
+        self.assertWithinBudget('api_caries_province')
+
+    def test_caries_by_age(self):
+        self.assertWithinBudget('api_caries_age')
+
+    def test_temporal_trends(self):
+        self.assertWithinBudget('api_temporal_trends', 'bucket=year')
+
+    def test_meta_analysis(self):
+        self.assertWithinBudget('api_meta_analysis', 'by=province,age_group,sex')
+
+    def test_validation(self):
+        self.assertWithinBudget('api_validation', 'mode=kfold&k=5')
+
+    def test_compositions(self):
+        self.assertWithinBudget('api_compositions', 'by=province,age_group')
+
+    def test_spatial(self):
+        self.assertWithinBudget('api_spatial')
+
+    def test_server_error_is_not_a_budget_error(self):
+        # A view that fails keeps its own exception, whatever it cost in queries
+        with mock.patch.object(views.HomeView, 'query_budget', 0), self.settings(TEMPLATES=[]):
+            with self.assertRaises(TemplateDoesNotExist):
+                self.client.get(reverse('studies:home'))
+
+    def test_budget_exceeded(self):
+        with mock.patch.object(views.CariesByAgeAPI, 'query_budget', 0):
+            with self.assertRaises(QueryBudgetExceeded):
+                self.client.get(reverse('studies:api_caries_age'))
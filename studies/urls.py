@@ -1,5 +1,5 @@
 from django.urls import path
-from . import views
+from . import api, views
 
 app_name = 'studies'
 
@@ -21,6 +21,25 @@ urlpatterns = [
     path('api/caries-by-province/', views.CariesByProvinceAPI.as_view(), name='api_caries_province'),
     path('api/caries-by-age/', views.CariesByAgeAPI.as_view(), name='api_caries_age'),
     path('api/temporal-trends/', views.TemporalTrendsAPI.as_view(), name='api_temporal_trends'),
+    path('api/meta-analysis/', views.MetaAnalysisAPI.as_view(), name='api_meta_analysis'),
+    path('api/compositions/', views.CompositionsAPI.as_view(), name='api_compositions'),
+    path('api/spatial/', views.SpatialAPI.as_view(), name='api_spatial'),
+    path('api/model-estimates/', views.ModelEstimatesAPI.as_view(), name='api_model_estimates'),
+    path('api/projections/', views.ProjectionsAPI.as_view(), name='api_projections'),
+    path('api/sensitivity/', views.SensitivityAPI.as_view(), name='api_sensitivity'),
+    path('api/validation/', views.ValidationAPI.as_view(), name='api_validation'),
+    
+    # Background analysis jobs
+    path('api/jobs/', views.JobListAPI.as_view(), name='api_jobs'),
+    path('api/jobs/<int:pk>/', views.JobDetailAPI.as_view(), name='api_job'),
+    path('api/jobs/<int:pk>/cancel/', views.JobCancelAPI.as_view(), name='api_job_cancel'),
+    
+    # Versioned read-only data API
+    path('api/v1/studies/', api.StudyListAPI.as_view(), name='api_v1_studies'),
+    path('api/v1/studies/<str:study_id>/', api.StudyDetailAPI.as_view(), name='api_v1_study'),
+    path('api/v1/strata/', api.StratumListAPI.as_view(), name='api_v1_strata'),
+    path('api/v1/strata/export/', api.StratumExportAPI.as_view(), name='api_v1_strata_export'),
+    path('api/v1/changes/', api.ChangeFeedAPI.as_view(), name='api_v1_changes'),
     
     # About and documentation
     path('about/', views.AboutView.as_view(), name='about'),
@@ -0,0 +1,251 @@
+"""Leave-one-study-out and K-fold cross-validation of the random-effects meta-analysis
+
+Held-out fits are not refitted one by one. For every (held-out group, cell)
+pair the strata that remain are laid out in one expanded array, and
+meta.random_effects pools all pairs in a single vectorized pass. That covers
+the DerSimonian-Laird closed form and REML, which starts from the DL estimate
+and runs its Fisher-scoring iterations across all pairs at once. Pairs are
+processed in chunks to bound memory, so the whole set of folds costs a few
+array passes.
+
+A group is a study (LOSO) or a fold of studies (K-fold; a study's strata are
+never split across folds). Each held-out stratum is predicted from its
+cell's pooled estimate without its group, giving RMSE, expected log
+predictive density and 95% prediction interval coverage. For LOSO, each
+study's influence is the change in its cells' pooled estimates and the
+cluster Cook's distance (change squared over the full-data variance).
+Results are cached per data version like meta.meta_analysis.
+"""
+import hashlib
+
+import numpy as np
+from django.core.cache import cache
+from scipy import stats
+
+from . import analytics, estimates, meta
+
+
+CHUNK_SIZE = 2_000_000  # expanded stratum entries pooled per pass
+DEFAULT_FOLDS = 10
+MAX_FOLDS = 20
+DEFAULT_SEED = 2050
+
+
+def _cells(strata, by):
+    """Cell index of every stratum, the cell count and each cell's key dict"""
+    if not by:
+        return np.zeros(len(strata), dtype=np.int64), 1, [{}]
+    groups = strata.group_by(*by)
+    return groups.inverse, groups.size, groups.rows()
+
+
+def held_out_fits(y, v, n, cell, n_cells, group, method='reml'):
+    """Random-effects fit of every (group, cell) pair with that group's strata left out
+
+    Returns (pair_group, pair_cell, fit) where ``fit`` holds meta.random_effects
+    arrays per pair plus ``n_harmonic``, the harmonic mean sample size of the
+    strata that remain.
+    """
+    pair_keys = np.unique(group * n_cells + cell)
+    pair_group, pair_cell = pair_keys // n_cells, pair_keys % n_cells
+
+    # Strata sorted by cell, so each cell is a contiguous run
+    order = np.argsort(cell, kind='stable')
+    counts = np.bincount(cell, minlength=n_cells)
+    starts = np.concatenate([[0], np.cumsum(counts)[:-1]])
+
+    fit = {name: np.empty(len(pair_keys)) for name in ('k', 'mu', 'se', 'tau2', 'q', 'i2', 'n_harmonic')}
+    sizes = counts[pair_cell]
+    # Consecutive pairs whose expanded entries add up to about CHUNK_SIZE share a pass
+    bucket = (np.cumsum(sizes) - 1) // CHUNK_SIZE
+    bounds = np.concatenate([[0], np.flatnonzero(np.diff(bucket)) + 1, [len(pair_keys)]])
+
+    for first, last in zip(bounds[:-1], bounds[1:]):
+        chunk_sizes = sizes[first:last]
+        pair = np.repeat(np.arange(last - first), chunk_sizes)
+        offset = np.arange(len(pair)) - np.repeat(np.cumsum(chunk_sizes) - chunk_sizes, chunk_sizes)
+        member = order[starts[pair_cell[first:last]][pair] + offset]
+        keep = group[member] != pair_group[first:last][pair]
+        pair, member = pair[keep], member[keep]
+
+        result = meta.random_effects(y[member], v[member], pair, last - first, method)
+        for name, values in result.items():
+            fit[name][first:last] = values
+        with np.errstate(invalid='ignore', divide='ignore'):
+            fit['n_harmonic'][first:last] = result['k'] / np.bincount(
+                pair, weights=1 / n[member], minlength=last - first
+            )
+    return pair_group, pair_cell, fit
+
+
+def _estimate(values, outcome, transform, n_harmonic):
+    """Pooled values on the reporting scale (percent for prevalence)"""
+    if outcome == 'prevalence':
+        return meta._back_transform(values, transform, n_harmonic)
+    return values
+
+
+def _cross_validate(groups_of, outcome, method, transform, by, harmonize=None):
+    """Shared core: full fit, held-out fits and per-stratum predictions"""
+    strata = analytics.frame(harmonize).strata
+    cell, n_cells, cell_keys = _cells(strata, by)
+    y, v = meta._effects(strata, outcome, transform)
+    n = strata.columns['sample_size_group'].astype(np.float64)
+    study = strata.columns['study']
+    usable = np.isfinite(y) & np.isfinite(v) & (v > 0) & (n > 0)
+    y, v, n, cell, study = y[usable], v[usable], n[usable], cell[usable], study[usable]
+    study_ids, study_index = np.unique(study, return_inverse=True)
+    group = groups_of(study_index, len(study_ids))
+
+    full = meta.random_effects(y, v, cell, n_cells, method)
+    pair_group, pair_cell, fit = held_out_fits(y, v, n, cell, n_cells, group, method)
+
+    # Predict each stratum from its (group, cell) held-out fit
+    lookup = np.searchsorted(pair_group * n_cells + pair_cell, group * n_cells + cell)
+    mu, tau2, se = fit['mu'][lookup], fit['tau2'][lookup], fit['se'][lookup]
+    with np.errstate(invalid='ignore'):
+        scale = np.sqrt(v + tau2 + se ** 2)
+        residual = y - mu
+        log_density = stats.norm.logpdf(y, mu, scale)
+        covered = np.abs(residual) <= estimates.Z_95 * scale
+    predicted = np.isfinite(mu) & (fit['k'][lookup] > 0)
+
+    return {
+        'study_ids': study_ids, 'study_index': study_index, 'group': group, 'cell': cell,
+        'cell_keys': cell_keys, 'full': full, 'pair_group': pair_group, 'pair_cell': pair_cell,
+        'fit': fit, 'residual': residual, 'log_density': log_density, 'covered': covered,
+        'predicted': predicted, 'n': n,
+    }
+
+
+def _metrics(core, mask=None):
+    predicted = core['predicted'] if mask is None else core['predicted'] & mask
+    count = int(predicted.sum())
+    if not count:
+        return {'strata': 0, 'rmse': None, 'mae': None, 'elpd': None, 'coverage_95': None}
+    residual = core['residual'][predicted]
+    return {
+        'strata': count,
+        'rmse': float(np.sqrt(np.mean(residual ** 2))),
+        'mae': float(np.mean(np.abs(residual))),
+        'elpd': float(core['log_density'][predicted].sum()),
+        'coverage_95': float(core['covered'][predicted].mean()),
+    }
+
+
+def _validate(by, outcome, method, transform, folds=None):
+    meta._validate(by or meta.DEFAULT_GROUPING, outcome, method, transform)
+    if folds is not None and not 2 <= folds <= MAX_FOLDS:
+        raise ValueError(f"k must be from 2 to {MAX_FOLDS}")
+
+
+def _cached(kind, signature, compute, harmonize=None):
+    frame = analytics.frame(harmonize)
+    key = f"validation:{kind}:v{frame.version}:{hashlib.md5(signature.encode()).hexdigest()}"
+    result = cache.get(key)
+    if result is None:
+        result = compute()
+        cache.set(key, result)
+    return result
+
+
+def loso(by=(), outcome='prevalence', method='reml', transform='logit', harmonize=None):
+    """Leave-one-study-out influence per study and cell, plus predictive metrics
+
+    ``by`` groups the strata into cells as in meta.meta_analysis; the default
+    () pools all strata into one overall estimate. ``harmonize`` converts the
+    strata to one caries index first. Raises ValueError for invalid options.
+    """
+    by = tuple(by)
+    _validate(by, outcome, method, transform)
+
+    def compute():
+        core = _cross_validate(lambda index, count: index, outcome, method, transform, by, harmonize)
+        full, fit = core['full'], core['fit']
+        cell = core['pair_cell']
+        # Cells the study has to itself have nothing left to pool without it
+        alone = fit['k'] == 0
+        fit = {name: np.where(alone, np.nan, values) for name, values in fit.items()}
+        with np.errstate(invalid='ignore', divide='ignore'):
+            n_harmonic_full = np.bincount(core['cell'], minlength=len(full['k'])) / np.bincount(
+                core['cell'], weights=1 / core['n'], minlength=len(full['k'])
+            )
+            delta = full['mu'][cell] - fit['mu']
+            cooks = delta ** 2 / full['se'][cell] ** 2
+            covratio = fit['se'] ** 2 / full['se'][cell] ** 2
+        estimate = _estimate(full['mu'], outcome, transform, n_harmonic_full)
+        without = _estimate(fit['mu'], outcome, transform, fit['n_harmonic'])
+        # Strata each study contributes to each of its cells
+        contributed = np.bincount(
+            np.searchsorted(
+                core['pair_group'] * len(full['k']) + cell,
+                core['group'] * len(full['k']) + core['cell'],
+            ),
+            minlength=len(cell),
+        )
+        rows = []
+        for p in range(len(cell)):
+            rows.append({
+                'study': int(core['study_ids'][core['pair_group'][p]]),
+                **core['cell_keys'][cell[p]],
+                'strata': int(contributed[p]),
+                'estimate': _clean(estimate[cell[p]]),
+                'estimate_without': _clean(without[p]),
+                'change': _clean(estimate[cell[p]] - without[p]),
+                'cooks_distance': _clean(cooks[p]),
+                'covariance_ratio': _clean(covratio[p]),
+                'tau2': _clean(full['tau2'][cell[p]]),
+                'tau2_without': _clean(fit['tau2'][p]),
+                'i2_without': _clean(fit['i2'][p]),
+            })
+        return {
+            'by': list(by), 'outcome': outcome, 'method': method, 'transform': transform, 'harmonize': harmonize,
+            'studies': len(core['study_ids']), 'metrics': _metrics(core), 'influence': rows,
+        }
+
+    return _cached('loso', f"{by}|{outcome}|{method}|{transform}", compute, harmonize)
+
+
+def kfold(k=DEFAULT_FOLDS, by=(), outcome='prevalence', method='reml', transform='logit', seed=DEFAULT_SEED,
+          harmonize=None):
+    """K-fold cross-validation with studies assigned to folds at random (reproducible by ``seed``)"""
+    by = tuple(by)
+    _validate(by, outcome, method, transform, folds=k)
+    studies = len(analytics.frame(harmonize).studies)
+    if k > studies:
+        raise ValueError(f"k must not exceed the number of studies ({studies})")
+
+    def assign(index, count):
+        folds = np.random.default_rng(seed).permutation(count) % k
+        return folds[index]
+
+    def compute():
+        core = _cross_validate(assign, outcome, method, transform, by, harmonize)
+        return {
+            'by': list(by), 'outcome': outcome, 'method': method, 'transform': transform, 'harmonize': harmonize,
+            'k': k, 'seed': seed,
+            'studies': len(core['study_ids']),
+            'metrics': _metrics(core),
+            'folds': [
+                {'fold': fold, 'studies': int(len(np.unique(core['study_index'][core['group'] == fold]))),
+                 **_metrics(core, core['group'] == fold)}
+                for fold in range(k)
+            ],
+        }
+
+    return _cached('kfold', f"{k}|{seed}|{by}|{outcome}|{method}|{transform}", compute, harmonize)
+
+
+def study_influence(study_pk, method='reml', transform='logit'):
+    """Overall LOSO influence rows of one study for prevalence and mean dmft/DMFT"""
+    rows = []
+    for outcome in meta.OUTCOMES:
+        for row in loso((), outcome, method, transform)['influence']:
+            if row['study'] == study_pk:
+                rows.append({'outcome': outcome, **row})
+    return rows
+
+
+def _clean(value):
+    value = float(value)
+    return value if np.isfinite(value) else None
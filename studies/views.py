@@ -1,113 +1,139 @@
 from django.shortcuts import render, get_object_or_404
+from django.urls import reverse
 from django.http import JsonResponse
+from django.core.exceptions import BadRequest
 from django.core.paginator import Paginator
-from django.db.models import Q, Count, Avg, Case, When, FloatField, F, Max, Min
+from django.db.models import Q, Count, Avg, Case, When, FloatField, F, Max, Min, Sum
 from django.db import models
 from django.views.generic import ListView, DetailView, TemplateView, View
-from django.views.decorators.cache import cache_page
 from django.utils.decorators import method_decorator
-from .models import DentalCariesStudy, CariesData, ProjectMetadata
+from . import analytics, bayes, compositions, estimates, jobs, meta, projections, sensitivity, spatial, validation
+from .caching import CachedResponseMixin
+from .search import SEARCH_MODES, search_studies
+from .filters import STUDY_SORTS, study_filters, study_ordering
+from .pagination import CachedCountPaginator, count_cache_key, keyset_paginate
+from .models import DentalCariesStudy, CariesData, ProjectMetadata, StudyRollup, PosteriorSummary, Job, SensitivityRun
 import json
 from datetime import datetime, timedelta
 from django.utils import timezone
 
 
-class HomeView(TemplateView):
+class HomeView(CachedResponseMixin, TemplateView):
     """Homepage with overview and recent studies"""
+    query_budget = 8
     template_name = 'studies/home.html'
     
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
         
         # Get summary statistics
-        study_stats = DentalCariesStudy.objects.aggregate(
-            total_studies=Count('id'),
-            total_participants=models.Sum('sample_size'),
+        study_stats = StudyRollup.objects.aggregate(
+            total_studies=Sum('study_count'),
+            total_participants=Sum('total_participants'),
             latest_year=Max('publication_year'),
             earliest_year=Min('publication_year'),
         )
+        study_stats['total_studies'] = study_stats['total_studies'] or 0
         context.update(study_stats)
         
         # Get recent studies
         context['recent_studies'] = DentalCariesStudy.objects.order_by('-publication_year', '-created_at')[:6]
         
         # Get provincial coverage
-        context['provincial_coverage'] = DentalCariesStudy.objects.exclude(
-            province__isnull=True
-        ).values('province').annotate(
-            study_count=Count('id'),
-            total_participants=models.Sum('sample_size')
+        context['provincial_coverage'] = StudyRollup.objects.values('province').annotate(
+            study_count=Sum('study_count'),
+            total_participants=Sum('total_participants')
         ).order_by('-study_count')[:10]
         
         # Get age group distribution
-        context['age_group_stats'] = DentalCariesStudy.objects.values('age_group').annotate(
-            count=Count('id')
+        context['age_group_stats'] = StudyRollup.objects.values('age_group').annotate(
+            count=Sum('study_count')
         ).order_by('-count')
         
         # Get caries index usage
-        context['index_usage'] = DentalCariesStudy.objects.values('caries_index_used').annotate(
-            count=Count('id')
+        context['index_usage'] = StudyRollup.objects.values('caries_index_used').annotate(
+            count=Sum('study_count')
         ).order_by('-count')
         
         # Quick facts
         context['quick_facts'] = {
-            'provinces_covered': DentalCariesStudy.objects.values('province').distinct().count(),
+            'provinces_covered': StudyRollup.objects.values('province').distinct().count(),
             'years_span': study_stats['latest_year'] - study_stats['earliest_year'] if study_stats['latest_year'] else 0,
-            'avg_sample_size': DentalCariesStudy.objects.aggregate(avg=Avg('sample_size'))['avg'] or 0
+            'avg_sample_size': (
+                study_stats['total_participants'] / study_stats['total_studies']
+                if study_stats['total_studies'] else 0
+            )
         }
         
         return context
 
 
 class StudyListView(ListView):
-    """List all studies with filtering and pagination"""
+    """List all studies with filtering and pagination
+    
+    Pass ``?cursor=`` (empty for the first page) to switch from numbered pages
+    to keyset pagination; each page then links to the next via ``next_cursor``.
+    """
+    query_budget = 6
     model = DentalCariesStudy
     template_name = 'studies/study_list.html'
     context_object_name = 'studies'
     paginate_by = 20
+    paginator_class = CachedCountPaginator
+    
+    # Summary fields rendered by the list; everything else stays deferred
+    list_fields = [
+        'id', 'study_id', 'title', 'authors', 'journal', 'publication_year', 'province',
+        'age_group', 'sample_size', 'caries_index_used', 'study_design', 'quality_score',
+    ]
     
     def get_queryset(self):
-        queryset = DentalCariesStudy.objects.all()
-        
-        # Apply filters from GET parameters
-        province = self.request.GET.get('province')
-        if province:
-            queryset = queryset.filter(province=province)
-        
-        age_group = self.request.GET.get('age_group')
-        if age_group:
-            queryset = queryset.filter(age_group=age_group)
+        queryset = DentalCariesStudy.objects.only(*self.list_fields)
         
-        caries_index = self.request.GET.get('caries_index')
-        if caries_index:
-            queryset = queryset.filter(caries_index_used=caries_index)
-        
-        year_from = self.request.GET.get('year_from')
-        if year_from:
-            queryset = queryset.filter(publication_year__gte=year_from)
-        
-        year_to = self.request.GET.get('year_to')
-        if year_to:
-            queryset = queryset.filter(publication_year__lte=year_to)
+        # Apply the declared filters from GET parameters
+        try:
+            self.filters = study_filters(self.request.GET)
+        except ValueError as exc:
+            raise BadRequest(str(exc))
+        queryset = queryset.filter(**self.filters)
         
-        # Sorting
-        sort_by = self.request.GET.get('sort', '-publication_year')
-        queryset = queryset.order_by(sort_by)
+        # Sorting on whitelisted, indexed keys (id breaks ties so page boundaries are stable)
+        self.sort = study_ordering(self.request.GET.get('sort'))
+        return queryset.order_by(self.sort, 'id')
+    
+    def get_paginator(self, queryset, per_page, orphans=0, allow_empty_first_page=True, **kwargs):
+        return self.paginator_class(
+            queryset, per_page, orphans=orphans, allow_empty_first_page=allow_empty_first_page,
+            count_key=count_cache_key(self.__class__.__name__, self.filters), **kwargs
+        )
+    
+    def paginate_queryset(self, queryset, page_size):
+        cursor = self.request.GET.get('cursor')
+        if cursor is None:
+            return super().paginate_queryset(queryset, page_size)
         
-        return queryset.prefetch_related('caries_data')
+        try:
+            page = keyset_paginate(queryset, self.sort, page_size, cursor)
+        except ValueError:
+            raise BadRequest("Invalid cursor")
+        return (None, page, page.object_list, page.has_other_pages())
     
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
         
-        # Filter options for the sidebar
+        # Filter options for the sidebar, from the rollup cells in one query
+        cells = list(StudyRollup.objects.values_list(
+            'province', 'age_group', 'caries_index_used', 'publication_year'
+        ))
+        provinces, age_groups, indices, years = zip(*cells) if cells else ((), (), (), ())
         context['filter_options'] = {
-            'provinces': DentalCariesStudy.objects.values_list('province', flat=True).distinct(),
-            'age_groups': DentalCariesStudy.objects.values_list('age_group', flat=True).distinct(),
-            'caries_indices': DentalCariesStudy.objects.values_list('caries_index_used', flat=True).distinct(),
-            'year_range': DentalCariesStudy.objects.aggregate(
-                min_year=Min('publication_year'),
-                max_year=Max('publication_year')
-            )
+            'provinces': sorted(set(provinces)),
+            'age_groups': sorted(set(age_groups)),
+            'caries_indices': sorted(set(indices)),
+            'year_range': {
+                'min_year': min(years, default=None),
+                'max_year': max(years, default=None),
+            },
         }
         
         # Current filters
@@ -117,38 +143,38 @@ class StudyListView(ListView):
             'caries_index': self.request.GET.get('caries_index', ''),
             'year_from': self.request.GET.get('year_from', ''),
             'year_to': self.request.GET.get('year_to', ''),
-            'sort': self.request.GET.get('sort', '-publication_year'),
+            'sort': self.sort,
         }
+        context['sort_options'] = STUDY_SORTS
         
         return context
 
 
 class StudySearchView(ListView):
     """Search studies by keywords"""
+    query_budget = 3
     model = DentalCariesStudy
     template_name = 'studies/study_search.html'
     context_object_name = 'studies'
     paginate_by = 20
     
     def get_queryset(self):
-        query = self.request.GET.get('q', '')
+        query = self.request.GET.get('q', '').strip()
         if query:
-            return DentalCariesStudy.objects.filter(
-                Q(title__icontains=query) |
-                Q(authors__icontains=query) |
-                Q(journal__icontains=query) |
-                Q(notes__icontains=query)
-            ).order_by('-publication_year')
+            return search_studies(query, mode=self.request.GET.get('mode', 'websearch'))
         return DentalCariesStudy.objects.none()
     
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
         context['query'] = self.request.GET.get('q', '')
+        context['mode'] = self.request.GET.get('mode', 'websearch')
+        context['search_modes'] = SEARCH_MODES
         return context
 
 
 class StudyDetailView(DetailView):
     """Detailed view of a single study"""
+    query_budget = 10
     model = DentalCariesStudy
     template_name = 'studies/study_detail.html'
     context_object_name = 'study'
@@ -170,49 +196,72 @@ class StudyDetailView(DetailView):
             age_group=self.object.age_group
         ).exclude(id=self.object.id)[:5]
         
+        # Leave-one-study-out influence on the overall pooled estimates (cached per data version)
+        context['influence'] = validation.study_influence(self.object.pk)
+        
         return context
 
 
-class DashboardView(TemplateView):
+class DashboardView(CachedResponseMixin, TemplateView):
     """Main dashboard with key visualizations"""
+    query_budget = 7
     template_name = 'studies/dashboard.html'
     
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
         
         # Summary statistics
-        context['total_studies'] = DentalCariesStudy.objects.count()
-        context['total_participants'] = DentalCariesStudy.objects.aggregate(
-            total=models.Sum('sample_size')
-        )['total'] or 0
-        
-        # Provincial distribution
-        context['provincial_data'] = list(
-            DentalCariesStudy.objects.values('province').annotate(
-                count=Count('id'),
-                avg_caries=Avg('caries_data__mean_dmft_DMFT')
-            ).order_by('-count')
+        frame = analytics.frame()
+        context['total_studies'] = len(frame.studies)
+        context['total_participants'] = int(frame.studies.columns['sample_size'].sum())
+        
+        # Provincial distribution (study counts include studies without strata)
+        by_province = frame.studies.group_by('province')
+        strata_by_province = frame.strata.group_by('province')
+        dmft = estimates.pooled(strata_by_province, 'dmft')
+        context['provincial_data'] = sorted(
+            by_province.rows(
+                count=by_province.count(),
+                avg_caries=strata_by_province.align(dmft['mean'], by_province.keys[0]),
+                avg_caries_se=strata_by_province.align(dmft['se'], by_province.keys[0]),
+            ),
+            key=lambda row: -row['count']
         )
         
         # Age group analysis
-        context['age_group_data'] = list(
-            CariesData.objects.values('study__age_group').annotate(
-                avg_prevalence=Avg('caries_prevalence'),
-                avg_dmft=Avg('mean_dmft_DMFT'),
-                study_count=Count('study', distinct=True)
-            ).order_by('study__age_group')
+        by_age_group = frame.strata.group_by(('study__age_group', 'age_group'))
+        context['age_group_data'] = sorted(
+            by_age_group.rows(
+                study_count=by_age_group.nunique('study'),
+                **estimates.estimate_columns(by_age_group),
+            ),
+            key=lambda row: row['study__age_group']
         )
         
+        # Fitted mean dmft/DMFT per province from the latest hierarchical model version
+        model_fit = bayes.latest_fit()
+        context['model_fit'] = model_fit
+        context['model_estimates'] = list(
+            model_fit.summaries.filter(component='fitted_province').values('label', 'mean', 'q025', 'q975')
+        ) if model_fit else []
+        
+        # Empirical-Bayes and ICAR-smoothed prevalence per province for the map
+        context['province_map'] = spatial.province_map()
+        
         return context
 
 
 class AnalyticsView(TemplateView):
     """Advanced analytics and trends"""
+    query_budget = 6
     template_name = 'studies/analytics.html'
     
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
         
+        # Random-effects pooled prevalence per province and age group
+        context['meta_analysis'] = meta.meta_analysis()
+        
         # Placeholder for advanced analytics
         context['analysis_placeholder'] = True
         context['coming_soon_features'] = [
@@ -227,22 +276,36 @@ class AnalyticsView(TemplateView):
         return context
 
 
-class TrendsView(TemplateView):
+class TrendsView(CachedResponseMixin, TemplateView):
     """Temporal trends visualization"""
+    query_budget = 7
     template_name = 'studies/trends.html'
     
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
         
         # Temporal trends data
-        context['temporal_data'] = list(
-            DentalCariesStudy.objects.values('publication_year').annotate(
-                study_count=Count('id'),
-                avg_sample_size=Avg('sample_size'),
-                avg_caries=Avg('caries_data__mean_dmft_DMFT')
-            ).order_by('publication_year')
+        frame = analytics.frame()
+        by_year = frame.studies.group_by('publication_year')
+        strata_by_year = frame.strata.group_by('publication_year')
+        dmft = estimates.pooled(strata_by_year, 'dmft')
+        context['temporal_data'] = by_year.rows(
+            study_count=by_year.count(),
+            avg_sample_size=by_year.mean('sample_size'),
+            avg_caries=strata_by_year.align(dmft['mean'], by_year.keys[0]),
+            avg_caries_se=strata_by_year.align(dmft['se'], by_year.keys[0]),
         )
         
+        # Projection fan charts per scenario from the stored quantiles
+        province = self.request.GET.get('province', projections.NATIONAL)
+        context['projection_province'] = province
+        context['projection_fans'] = {}
+        for run in projections.latest_runs():
+            try:
+                context['projection_fans'][run.scenario] = projections.fan_chart(run, province)
+            except KeyError:
+                break
+        
         return context
 
 
@@ -273,47 +336,287 @@ class ProtocolView(TemplateView):
 
 
 # API Views for AJAX/Chart data
-class CariesByProvinceAPI(View):
+class CariesByProvinceAPI(CachedResponseMixin, View):
     """API endpoint for provincial caries data"""
+    query_budget = 6
     
     def get(self, request):
-        data = list(
-            CariesData.objects.values('study__province').annotate(
-                avg_prevalence=Avg('caries_prevalence'),
-                avg_dmft=Avg('mean_dmft_DMFT'),
-                study_count=Count('study', distinct=True),
-                total_participants=models.Sum('sample_size_group')
-            ).order_by('-avg_prevalence')
+        harmonize = request.GET.get('harmonize') or None
+        try:
+            strata = analytics.frame(harmonize).strata
+        except ValueError as exc:
+            return JsonResponse({'error': str(exc)}, status=400)
+        groups = strata.group_by(('study__province', 'province'))
+        data = groups.rows(
+            study_count=groups.nunique('study'),
+            total_participants=groups.sum('sample_size_group').astype(int),
+            **estimates.estimate_columns(groups),
         )
-        return JsonResponse({'data': data})
+        data.sort(key=lambda row: (row['avg_prevalence'] is None, -(row['avg_prevalence'] or 0)))
+        return JsonResponse({'harmonize': harmonize, 'data': data})
 
 
-class CariesByAgeAPI(View):
+class CariesByAgeAPI(CachedResponseMixin, View):
     """API endpoint for age-stratified caries data"""
+    query_budget = 6
     
     def get(self, request):
-        data = list(
-            CariesData.objects.values('age_category').annotate(
-                avg_prevalence=Avg('caries_prevalence'),
-                avg_dmft=Avg('mean_dmft_DMFT'),
-                count=Count('id')
-            ).order_by('age_category')
+        harmonize = request.GET.get('harmonize') or None
+        try:
+            strata = analytics.frame(harmonize).strata
+        except ValueError as exc:
+            return JsonResponse({'error': str(exc)}, status=400)
+        groups = strata.group_by('age_category')
+        data = groups.rows(
+            count=groups.count(),
+            **estimates.estimate_columns(groups),
         )
-        return JsonResponse({'data': data})
+        data.sort(key=lambda row: row['age_category'])
+        return JsonResponse({'harmonize': harmonize, 'data': data})
 
 
-class TemporalTrendsAPI(View):
+class TemporalTrendsAPI(CachedResponseMixin, View):
     """API endpoint for temporal trends"""
+    query_budget = 6
+    
+    # Bucket widths in years for the ?bucket= parameter
+    BUCKETS = {'year': 1, '5y': 5, 'decade': 10}
+    
+    def get(self, request):
+        bucket = request.GET.get('bucket', 'decade')
+        if bucket not in self.BUCKETS:
+            return JsonResponse(
+                {'error': f"Unknown bucket '{bucket}'. Use one of: {', '.join(self.BUCKETS)}"},
+                status=400
+            )
+        width = self.BUCKETS[bucket]
+        harmonize = request.GET.get('harmonize') or None
+        try:
+            strata = analytics.frame(harmonize).strata
+        except ValueError as exc:
+            return JsonResponse({'error': str(exc)}, status=400)
+        
+        # Group by period of data collection (integer division on the year)
+        groups = strata.group_by(('period', strata.columns['collection_year'] // width * width))
+        data = groups.rows(
+            study_count=groups.nunique('study'),
+            **estimates.estimate_columns(groups),
+        )
+        return JsonResponse({'bucket': bucket, 'harmonize': harmonize, 'data': data})
+
+
+class MetaAnalysisAPI(CachedResponseMixin, View):
+    """API endpoint for the stratified random-effects meta-analysis table"""
+    query_budget = 6
+    
+    def get(self, request):
+        by = [name.strip() for name in request.GET.get('by', ','.join(meta.DEFAULT_GROUPING)).split(',') if name.strip()]
+        options = {
+            'outcome': request.GET.get('outcome', 'prevalence'),
+            'method': request.GET.get('method', 'reml'),
+            'transform': request.GET.get('transform', 'logit'),
+            'harmonize': request.GET.get('harmonize') or None,
+        }
+        try:
+            data = meta.meta_analysis(by, **options)
+        except ValueError as exc:
+            return JsonResponse({'error': str(exc)}, status=400)
+        return JsonResponse({'by': by, **options, 'data': data})
+
+
+class ModelEstimatesAPI(CachedResponseMixin, View):
+    """API endpoint for posterior summaries of a hierarchical model version (latest by default)"""
     
     def get(self, request):
-        # Group by decade for better visualization
+        component = request.GET.get('component', 'fitted_province')
+        version = request.GET.get('version')
+        fits = PosteriorSummary.objects.filter(fit__status='completed')
+        if version:
+            try:
+                fits = fits.filter(fit__version=int(version))
+            except ValueError:
+                return JsonResponse({'error': "version must be an integer"}, status=400)
+        else:
+            model_fit = bayes.latest_fit()
+            if model_fit is None:
+                return JsonResponse({'error': "No completed model fit"}, status=404)
+            version = model_fit.version
         data = list(
-            CariesData.objects.extra(
-                select={'decade': "FLOOR(EXTRACT(year FROM study__data_collection_start)/10)*10"}
-            ).values('decade').annotate(
-                avg_prevalence=Avg('caries_prevalence'),
-                avg_dmft=Avg('mean_dmft_DMFT'),
-                study_count=Count('study', distinct=True)
-            ).order_by('decade')
+            fits.filter(component=component)
+            .order_by('pk')
+            .values('label', 'mean', 'sd', 'q025', 'q50', 'q975')
+        )
+        if not data:
+            return JsonResponse({'error': f"No '{component}' summaries for model version {version}"}, status=404)
+        return JsonResponse({'version': int(version), 'component': component, 'data': data})
+
+
+class ProjectionsAPI(CachedResponseMixin, View):
+    """API endpoint for projection fan chart data of the latest model version"""
+    
+    def get(self, request):
+        province = request.GET.get('province', projections.NATIONAL)
+        age = request.GET.get('age', projections.ALL_AGES)
+        runs = projections.latest_runs()
+        scenario = request.GET.get('scenario')
+        if scenario:
+            runs = runs.filter(scenario=scenario)
+        runs = list(runs)
+        if not runs:
+            return JsonResponse({'error': "No stored projections"}, status=404)
+        try:
+            data = {run.scenario: projections.fan_chart(run, province, age) for run in runs}
+        except KeyError as exc:
+            return JsonResponse({'error': exc.args[0]}, status=400)
+        return JsonResponse({
+            'version': runs[0].fit.version,
+            'province': province,
+            'age': age,
+            'parameters': {run.scenario: run.parameters for run in runs},
+            'data': data,
+        })
+
+
+class JobListAPI(View):
+    """API endpoint to submit analysis jobs and list recent ones (staff only)"""
+    
+    def dispatch(self, request, *args, **kwargs):
+        if not request.user.is_staff:
+            return JsonResponse({'error': "Staff login required"}, status=403)
+        return super().dispatch(request, *args, **kwargs)
+    
+    def get(self, request):
+        queryset = Job.objects.all()
+        if request.GET.get('status'):
+            queryset = queryset.filter(status=request.GET['status'])
+        if request.GET.get('task'):
+            queryset = queryset.filter(task=request.GET['task'])
+        return JsonResponse({'tasks': sorted(jobs.TASKS), 'data': [jobs.job_payload(job) for job in queryset[:50]]})
+    
+    def post(self, request):
+        # Accept a JSON body {"task": ..., "params": {...}} or form fields with params as JSON
+        try:
+            if request.content_type == 'application/json':
+                payload = json.loads(request.body or b'{}')
+            else:
+                payload = {'task': request.POST.get('task'), 'params': json.loads(request.POST.get('params') or '{}')}
+            if not isinstance(payload.get('params', {}), dict):
+                raise ValueError("params must be a JSON object")
+            job, created = jobs.submit(
+                payload.get('task'), payload.get('params'), created_by=request.user.get_username(),
+                force=bool(payload.get('force')),
+            )
+        except ValueError as exc:
+            return JsonResponse({'error': str(exc)}, status=400)
+        
+        # 202 while the job is pending; 200 when an identical completed job already holds the result
+        response = JsonResponse(
+            {'created': created, **jobs.job_payload(job)}, status=200 if job.status == 'completed' else 202
         )
-        return JsonResponse({'data': data}) 
\ No newline at end of file
+        response['Location'] = reverse('studies:api_job', args=[job.pk])
+        return response
+
+
+class JobDetailAPI(View):
+    """API endpoint for polling a job's status, progress and result (staff only)"""
+    
+    def get(self, request, pk):
+        if not request.user.is_staff:
+            return JsonResponse({'error': "Staff login required"}, status=403)
+        job = get_object_or_404(Job, pk=pk)
+        return JsonResponse(jobs.job_payload(job))
+
+
+class JobCancelAPI(View):
+    """API endpoint to cancel a queued or running job (staff only)"""
+    
+    def post(self, request, pk):
+        if not request.user.is_staff:
+            return JsonResponse({'error': "Staff login required"}, status=403)
+        job = jobs.cancel(get_object_or_404(Job, pk=pk))
+        return JsonResponse(jobs.job_payload(job))
+
+
+class SensitivityAPI(CachedResponseMixin, View):
+    """API endpoint for the comparison table of a sensitivity run (latest completed by default)"""
+    
+    def get(self, request):
+        runs = SensitivityRun.objects.filter(status='completed')
+        run_id = request.GET.get('run')
+        if run_id:
+            if not run_id.isdigit():
+                return JsonResponse({'error': "run must be an integer"}, status=400)
+            runs = runs.filter(pk=int(run_id))
+        run = runs.order_by('-created_at').first()
+        if run is None:
+            return JsonResponse({'error': "No completed sensitivity run"}, status=404)
+        return JsonResponse({
+            'run': run.pk,
+            'name': run.name,
+            'n_specs': run.n_specs,
+            'processes': run.processes,
+            'elapsed': run.elapsed,
+            'data': sensitivity.comparison_table(run),
+        })
+
+
+class ValidationAPI(CachedResponseMixin, View):
+    """API endpoint for leave-one-study-out influence or K-fold cross-validation of the meta-analysis"""
+    query_budget = 6
+    
+    def get(self, request):
+        mode = request.GET.get('mode', 'loso')
+        by = [name.strip() for name in request.GET.get('by', '').split(',') if name.strip()]
+        options = {
+            'outcome': request.GET.get('outcome', 'prevalence'),
+            'method': request.GET.get('method', 'reml'),
+            'transform': request.GET.get('transform', 'logit'),
+            'harmonize': request.GET.get('harmonize') or None,
+        }
+        try:
+            if mode == 'loso':
+                data = validation.loso(by, **options)
+            elif mode == 'kfold':
+                k = int(request.GET.get('k', validation.DEFAULT_FOLDS))
+                seed = int(request.GET.get('seed', validation.DEFAULT_SEED))
+                data = validation.kfold(k, by, seed=seed, **options)
+            else:
+                raise ValueError("mode must be 'loso' or 'kfold'")
+        except ValueError as exc:
+            return JsonResponse({'error': str(exc)}, status=400)
+        return JsonResponse({'mode': mode, **data})
+
+
+class CompositionsAPI(CachedResponseMixin, View):
+    """API endpoint for decayed/missing/filled compositions and care index per group"""
+    query_budget = 6
+    
+    def get(self, request):
+        by = [name.strip() for name in request.GET.get('by', 'province').split(',') if name.strip()]
+        harmonize = request.GET.get('harmonize') or None
+        try:
+            data = compositions.composition_table(by, harmonize)
+        except ValueError as exc:
+            return JsonResponse({'error': str(exc)}, status=400)
+        return JsonResponse({'by': by, 'harmonize': harmonize, 'balances': list(compositions.BALANCES), 'data': data})
+
+
+class SpatialAPI(CachedResponseMixin, View):
+    """API endpoint for smoothed province estimates and Moran's I"""
+    query_budget = 6
+    
+    def get(self, request):
+        harmonize = request.GET.get('harmonize') or None
+        try:
+            permutations = int(request.GET.get('permutations', spatial.PERMUTATIONS))
+            if not 0 <= permutations <= 100000:
+                raise ValueError("permutations must be between 0 and 100000")
+            data = spatial.province_map(
+                outcome=request.GET.get('outcome', 'prevalence'),
+                graph=request.GET.get('graph', 'default'),
+                permutations=permutations,
+                harmonize=harmonize,
+            )
+        except ValueError as exc:
+            return JsonResponse({'error': str(exc)}, status=400)
+        return JsonResponse({'harmonize': harmonize, **data})